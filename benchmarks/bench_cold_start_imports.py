@@ -0,0 +1,191 @@
+"""
+Measures the cold-start import cost of every lambda with `python -X importtime`
+and fails when a lambda regresses against the recorded baseline.
+
+Usage:
+    python benchmarks/bench_cold_start_imports.py [--runs N] [--tolerance PCT]
+    python benchmarks/bench_cold_start_imports.py --update-baseline
+
+Each lambda is loaded in a fresh interpreter laid out like its Lambda package,
+with the lambda's own directory and lambdas/common on sys.path and dummy
+values for the required environment variables. The reported cost is the sum
+of the cumulative import times of the modules the lambda imports at load
+time, as printed by -X importtime. The best of --runs runs is kept to reduce
+noise.
+
+Absolute timings depend on the machine, so every cost is also divided by the
+cost of importing a reference module (REFERENCE_MODULE) measured the same way
+in the same run. The baseline in cold_start_baseline.json holds these
+relative costs, which carry over between machines far better than raw
+timings. Lambdas that cannot be loaded (e.g. a dependency is not installed)
+are reported and skipped.
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cold_start_baseline.json")
+
+LAMBDAS = {
+    "batch_process": "lambdas/batch_process/batch_process_lambda.py",
+    "cnm_r": "lambdas/cnm_r/lambda_function-cnm_response.py",
+    "data-subscriber-download": "lambdas/data-subscriber-download/data_subscriber_download_lambda.py",
+    "data-subscriber-download-slc-ionosphere":
+        "lambdas/data-subscriber-download-slc-ionosphere/data_subscriber_download_slc_ionosphere_lambda.py",
+    "data-subscriber-query": "lambdas/data-subscriber-query/data_subscriber_query_lambda.py",
+    "event-misfire": "lambdas/event-misfire/event-misfire.py",
+    "harikiri": "lambdas/harikiri/harikiri.py",
+    "isl": "lambdas/isl/isl.py",
+    "isl-sns": "lambdas/isl-sns/isl-sns.py",
+    "report": "lambdas/report/report_handler.py",
+    "timer": "lambdas/timer/timer_handler.py",
+}
+
+# superset of the environment variables the lambdas read at load time
+DUMMY_ENV = {
+    "MOZART_URL": "https://mozart/mozart",
+    "MOZART_IP": "mozart",
+    "MOZART_ES_URL": "http://mozart:9200",
+    "GRQ_IP": "grq",
+    "GRQ_ES_PORT": "9200",
+    "ENDPOINT": "OPS",
+    "JOB_RELEASE": "release",
+    "JOB_QUEUE": "queue",
+    "JOB_TYPE": "job_type",
+    "PRODUCT_TAG": "true",
+    "EVENT_TRIGGER": "sqs",
+    "SIGNAL_FILE_SUFFIX": "{}",
+    "SIGNAL_FILE_BUCKET": "bucket",
+    "DELAY_THRESHOLD": "3600",
+    "E_MISFIRE_METRIC_ALARM_NAME": "alarm",
+    "AWS_DEFAULT_REGION": "us-west-2",
+}
+
+# standard library module whose import cost the lambdas' costs are expressed in
+REFERENCE_MODULE = "asyncio"
+
+MARKER = "--- lambda import start ---"
+
+LOADER = """
+import importlib.util, sys
+sys.stderr.write({marker!r} + "\\n")
+spec = importlib.util.spec_from_file_location("lambda_function", {path!r})
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+"""
+
+REFERENCE_LOADER = """
+import sys
+sys.stderr.write({marker!r} + "\\n")
+import {module}
+"""
+
+IMPORTTIME_RE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def measure(path):
+    """
+    Loads the lambda at path in a fresh interpreter.
+
+    :return: (total cumulative import time in microseconds, list of
+    (module, microseconds) for the top-level imports), or None if the lambda
+    failed to load.
+    """
+    lambda_dir = os.path.dirname(path)
+    return _measure(LOADER.format(marker=MARKER, path=path), lambda_dir,
+                    [lambda_dir, os.path.join(ROOT, "lambdas", "common")])
+
+
+def measure_reference():
+    """
+    Imports REFERENCE_MODULE in a fresh interpreter.
+
+    :return: the cumulative import time of REFERENCE_MODULE in microseconds.
+    """
+    return _measure(REFERENCE_LOADER.format(marker=MARKER, module=REFERENCE_MODULE), ROOT, [])[0]
+
+
+def _measure(code, cwd, path):
+    env = dict(os.environ)
+    env.update(DUMMY_ENV)
+    env["PYTHONPATH"] = os.pathsep.join(path)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=cwd, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True
+    )
+    if proc.returncode != 0:
+        print(proc.stderr.strip().splitlines()[-1], file=sys.stderr)
+        return None
+
+    lines = proc.stderr.splitlines()
+    lines = lines[lines.index(MARKER) + 1:]
+    top_level = []
+    for line in lines:
+        match = IMPORTTIME_RE.match(line)
+        # top-level imports have no indentation before the module name
+        if match and len(match.group(3)) == 1:
+            top_level.append((match.group(4), int(match.group(2))))
+    return sum(us for _, us in top_level), top_level
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="runs per lambda, the fastest is kept")
+    parser.add_argument("--tolerance", type=float, default=25.0,
+                        help="allowed regression over the baseline relative cost, in percent")
+    parser.add_argument("--slack-ms", type=float, default=5.0,
+                        help="absolute regression always allowed, in milliseconds")
+    parser.add_argument("--update-baseline", action="store_true", help="record the current timings as the baseline")
+    parser.add_argument("--top", type=int, default=3, help="slowest top-level imports to show per lambda")
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE) as f:
+            baseline = json.load(f)
+
+    reference_us = min(measure_reference() for _ in range(args.runs))
+    print("%-40s %8.1f ms  (reference, 1.00x)" % (REFERENCE_MODULE, reference_us / 1000))
+
+    results = {}
+    regressions = []
+    for name, relpath in LAMBDAS.items():
+        runs = [measure(os.path.join(ROOT, relpath)) for _ in range(args.runs)]
+        if any(run is None for run in runs):
+            print("%-40s could not be loaded, skipped" % name)
+            continue
+        total_us, top_level = min(runs, key=lambda run: run[0])
+        relative = total_us / reference_us
+        results[name] = round(relative, 2)
+
+        slowest = sorted(top_level, key=lambda item: -item[1])[:args.top]
+        line = "%-40s %8.1f ms  %5.2fx" % (name, total_us / 1000, relative)
+        if name in baseline:
+            line += "  (baseline %5.2fx)" % baseline[name]
+            allowed = baseline[name] * (1 + args.tolerance / 100) + args.slack_ms * 1000 / reference_us
+            if relative > allowed:
+                regressions.append(name)
+                line += "  REGRESSION"
+        print(line)
+        for module, us in slowest:
+            print("    %-36s %8.1f ms" % (module, us / 1000))
+
+    if args.update_baseline:
+        with open(BASELINE_FILE, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print("Baseline written to %s" % BASELINE_FILE)
+        return 0
+
+    if regressions:
+        print("Cold start import regressions: %s" % ", ".join(regressions))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+"""
+Compares event-misfire's job lookups against a local fake Elasticsearch:
+one client and one wildcard search per file (the old get_job_info) versus
+get_job_counts, which batches prefix searches into _msearch requests.
+
+Usage: python benchmarks/bench_event_misfire_es_lookup.py [--files N] [--latency-ms MS]
+
+The fake ES answers on localhost and adds --latency-ms to every HTTP request
+to stand in for the network round trip and request overhead of a real
+cluster. Search cost inside the cluster is not modelled.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, os.path.join(ROOT, "lambdas", "common"))
+
+
+class FakeES(BaseHTTPRequestHandler):
+    job_ids = []
+    latency = 0.0
+    requests = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("X-Elastic-Product", "Elasticsearch")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def count(self, query):
+        if "wildcard" in query:
+            prefix = query["wildcard"]["job_id"]["value"].rstrip("*")
+        else:
+            prefix = query["prefix"]["job_id"]
+        return sum(1 for job_id in self.job_ids if job_id.startswith(prefix))
+
+    def search_response(self, search):
+        hits = self.count(search["query"])
+        if search.get("terminate_after"):
+            hits = min(hits, search["terminate_after"])
+        shown = [] if search.get("size") == 0 else [{"_source": {}}] * min(hits, 10)
+        return {"hits": {"total": {"value": hits, "relation": "eq"}, "hits": shown}}
+
+    def do_GET(self):
+        # elasticsearch-py 7.0 sends searches as GET requests with a body
+        if self.headers.get("Content-Length") and self.path.split("?")[0].endswith(("/_search", "/_msearch")):
+            self.do_POST()
+        else:
+            self.reply({"version": {"number": "7.10.2", "build_flavor": "default"},
+                        "tagline": "You Know, for Search"})
+
+    def do_POST(self):
+        type(self).requests += 1
+        time.sleep(self.latency)
+        body = self.rfile.read(int(self.headers["Content-Length"])).decode("utf-8")
+        if self.path.split("?")[0].endswith("/_msearch"):
+            lines = [json.loads(line) for line in body.splitlines() if line.strip()]
+            self.reply({"responses": [self.search_response(search) for search in lines[1::2]]})
+        else:
+            self.reply(self.search_response(json.loads(body)))
+
+
+def load_event_misfire(es_url):
+    os.environ.update({
+        "SIGNAL_FILE_BUCKET": "bucket",
+        "MOZART_ES_URL": es_url,
+        "DELAY_THRESHOLD": "3600",
+        "E_MISFIRE_METRIC_ALARM_NAME": "alarm",
+    })
+    spec = importlib.util.spec_from_file_location(
+        "event_misfire", os.path.join(ROOT, "lambdas", "event-misfire", "event-misfire.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def original_get_job_info(es_url, file_name):
+    # what event-misfire did for every stale file, with the job name ISL uses
+    import elasticsearch
+
+    es = elasticsearch.Elasticsearch(es_url)
+    query = {"query": {"wildcard": {"job_id": {"value": "ingest-staged-{}-*".format(os.path.basename(file_name))}}}}
+    result = es.search(index="job_status-current", body=json.dumps(query))
+    return len(result["hits"]["hits"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=1000, help="stale files to look up")
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="added latency per ES request")
+    args = parser.parse_args()
+
+    files = ["tlm/file_%05d.h5" % i for i in range(args.files)]
+    # two thirds of the files have an ingest job, named after the base name of the key as ISL does
+    FakeES.job_ids = ["ingest-staged-%s-20230101T000000.000000Z" % os.path.basename(f)
+                      for i, f in enumerate(files) if i % 3]
+    FakeES.latency = args.latency_ms / 1000
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeES)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    es_url = "http://127.0.0.1:%d" % server.server_port
+    event_misfire = load_event_misfire(es_url)
+
+    try:
+        FakeES.requests = 0
+        start = time.perf_counter()
+        original = {f: original_get_job_info(es_url, f) for f in files}
+        original_time, original_requests = time.perf_counter() - start, FakeES.requests
+
+        FakeES.requests = 0
+        start = time.perf_counter()
+        bulk = event_misfire.get_job_counts(files)
+        bulk_time, bulk_requests = time.perf_counter() - start, FakeES.requests
+    finally:
+        server.shutdown()
+
+    assert {f for f in files if original[f] > 0} == {f for f in files if bulk[f] > 0} == set(files[1::3] + files[2::3])
+
+    print("files: %d, latency per request: %.1f ms, msearch batch size: %d"
+          % (args.files, args.latency_ms, event_misfire.ES_MSEARCH_BATCH_SIZE))
+    print("one search per file: %8.1f ms  (%d requests)" % (original_time * 1000, original_requests))
+    print("batched msearch:     %8.1f ms  (%d requests)  %.1fx" % (bulk_time * 1000, bulk_requests,
+                                                                   original_time / bulk_time))
+
+
+if __name__ == "__main__":
+    main()
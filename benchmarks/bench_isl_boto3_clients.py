@@ -0,0 +1,56 @@
+"""
+Compares the per-record cost of building boto3 clients in the ISL lambda
+against reusing the cached clients from aws_clients.
+
+Usage: python benchmarks/bench_isl_boto3_clients.py [--records N]
+
+No AWS calls are made. Only client construction is timed, which is the
+cost that caching removes from each record.
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "lambdas", "common"))
+
+# Static dummy credentials keep boto3 from probing the instance metadata service
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-west-2")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+
+import boto3  # noqa: E402
+
+import aws_clients  # noqa: E402
+
+
+def per_record_clients():
+    # what process_record used to build for every record
+    boto3.resource("s3")
+    boto3.client("s3")
+
+
+def cached_clients():
+    aws_clients.get_client("s3")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=50, help="number of records to simulate")
+    args = parser.parse_args()
+
+    # warm up botocore's loader caches so both cases are measured warm
+    per_record_clients()
+    cached_clients()
+
+    uncached = timeit.timeit(per_record_clients, number=args.records) / args.records
+    cached = timeit.timeit(cached_clients, number=args.records) / args.records
+
+    print("records: %d" % args.records)
+    print("per-record clients: %8.3f ms/record" % (uncached * 1000))
+    print("cached clients:     %8.3f ms/record" % (cached * 1000))
+    print("speedup:            %8.1fx" % (uncached / cached))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Compares the per-record job type lookup the ISL lambdas used to do (parse
+JOB_TYPES from JSON, then re.search every pattern in order) against
+job_type_router.JobTypeRouter.
+
+Usage: python benchmarks/bench_job_type_router.py [--job-types N] [--files N] [--unique N]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "lambdas", "common"))
+
+from job_type_router import JobTypeRouter  # noqa: E402
+
+PRODUCTS = ["L0A", "L0B", "L1", "L2_CSLC-S1", "L2_RTC-S1", "L3_DSWx-HLS", "L3_DSWx-S1", "L3_DISP-S1"]
+SENSORS = ["S1A", "S1B", "L8", "L9", "S2A", "S2B"]
+
+
+def generate_job_types(n):
+    job_types = {}
+    for i in range(n):
+        product = PRODUCTS[i % len(PRODUCTS)]
+        sensor = SENSORS[(i // len(PRODUCTS)) % len(SENSORS)]
+        job_types["INGEST_%d" % i] = {
+            "PATTERN": r"^OPERA_%s_%s_T\d{3}-\d{6}-IW\d_\d{8}T\d{6}Z_v%d\.\d\.(h5|tif)$" % (
+                re.escape(product), sensor, i),
+            "RELEASE": "release",
+            "QUEUE": "queue_%d" % i,
+        }
+    return job_types
+
+
+def generate_files(n, unique, job_types_count):
+    rng = random.Random(0)
+    shapes = []
+    for _ in range(unique):
+        i = rng.randrange(job_types_count + job_types_count // 4)  # ~20% match no pattern
+        product = PRODUCTS[i % len(PRODUCTS)]
+        sensor = SENSORS[(i // len(PRODUCTS)) % len(SENSORS)]
+        shapes.append("OPERA_%s_%s_T%03d-%06d-IW%d_2023%04dT%06dZ_v%d.0.h5" % (
+            product, sensor, rng.randrange(1000), rng.randrange(10 ** 6), rng.randrange(1, 4),
+            rng.randrange(101, 1231), rng.randrange(10 ** 6), i))
+    return [shapes[rng.randrange(unique)] for _ in range(n)]
+
+
+def original_lookup(data_file, job_types_json):
+    job_types = json.loads(job_types_json)
+    for job_type in job_types.keys():
+        regex = job_types[job_type]["PATTERN"]
+        print("Checking if {} matches {}".format(regex, data_file))
+        if re.search(regex, data_file):
+            return job_type
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--job-types", type=int, default=48, help="number of job type patterns")
+    parser.add_argument("--files", type=int, default=5000, help="number of lookups")
+    parser.add_argument("--unique", type=int, default=1000, help="number of distinct file names")
+    args = parser.parse_args()
+
+    job_types = generate_job_types(args.job_types)
+    job_types_json = json.dumps(job_types)
+    files = generate_files(args.files, args.unique, args.job_types)
+
+    # build once, as the lambda does at cold start
+    router = JobTypeRouter(job_types, "DEFAULT", "release", "queue")
+    with contextlib.redirect_stdout(io.StringIO()):
+        expected = [original_lookup(f, job_types_json) for f in files]
+        actual = [router._match(f) for f in files]
+    assert actual == expected, "router disagrees with the original lookup"
+
+    def run_original():
+        for f in files:
+            original_lookup(f, job_types_json)
+
+    def run_router_uncached():
+        for f in files:
+            router._match_uncached(f)
+
+    def run_router():
+        cached = JobTypeRouter(job_types, "DEFAULT", "release", "queue")
+        for f in files:
+            cached._match(f)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        original = min(timeit.repeat(run_original, number=1, repeat=3))
+    uncached = min(timeit.repeat(run_router_uncached, number=1, repeat=3))
+    cached = min(timeit.repeat(run_router, number=1, repeat=3))
+
+    print("job types: %d, lookups: %d, distinct files: %d" % (args.job_types, args.files, args.unique))
+    print("original lookup:          %8.2f us/lookup" % (original / args.files * 1e6))
+    print("router, combined regex:   %8.2f us/lookup  (%.1fx)" % (uncached / args.files * 1e6, original / uncached))
+    print("router, combined + LRU:   %8.2f us/lookup  (%.1fx)" % (cached / args.files * 1e6, original / cached))
+
+
+if __name__ == "__main__":
+    main()
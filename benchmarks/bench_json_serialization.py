@@ -0,0 +1,123 @@
+"""
+Compares the JSON work done per ISL record before and after json_codec, on a
+realistic met_required payload (a signal file listing many granules).
+
+Before: the SQS body is decoded with json, the metadata is pretty-printed for
+the log, the job params are dumped twice for the log, then the tags and
+params are dumped for the form and the whole form dumped again for the log.
+After: the body is decoded and the tags and params are serialized once with
+json_codec, and the log reuses the serialized strings.
+
+Usage: python benchmarks/bench_json_serialization.py [--files N] [--records N]
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "lambdas", "common"))
+
+import json_codec  # noqa: E402
+
+ENDPOINT = "s3-us-west-2.amazonaws.com"
+BUCKET = "opera-dev-isl-fwd"
+
+
+def generate_record(n_files):
+    key = "met_required/S1A_OPER_AUX_POEORB_OPOD_20230101T080000_V20221231T225942_20230102T005942.EOF.signal"
+    s3_event = {"Records": [{
+        "eventVersion": "2.1",
+        "eventSource": "aws:s3",
+        "awsRegion": "us-west-2",
+        "eventTime": "2023-01-01T08:00:00.000Z",
+        "eventName": "ObjectCreated:Put",
+        "s3": {
+            "bucket": {"name": BUCKET, "arn": "arn:aws:s3:::" + BUCKET},
+            "object": {"key": key, "size": 120 * n_files, "eTag": "d41d8cd98f00b204e9800998ecf8427e"},
+        },
+    }]}
+    record = {
+        "messageId": "059f36b4-87a3-44ab-83d2-661975830a7d",
+        "receiptHandle": "AQEBwJnKyrHigUMZj6rYigCgxlaS3SLy0a" * 4,
+        "body": json.dumps(s3_event),
+        "attributes": {"ApproximateReceiveCount": "1", "SentTimestamp": "1672560000000"},
+        "eventSource": "aws:sqs",
+        "eventSourceARN": "arn:aws:sqs:us-west-2:123456789012:opera-dev-isl-queue",
+        "awsRegion": "us-west-2",
+    }
+    urls = ["s3://%s/%s/met_required/S1A_IW_SLC__1SDV_20230101T%06d_%03d.zip" % (ENDPOINT, BUCKET, i, i)
+            for i in range(n_files)]
+    return record, urls
+
+
+def build_job_params(message, record, urls):
+    md = {
+        "tags": ["ISL"],
+        "ISL_urls": urls + ["s3://%s/%s/%s" % (ENDPOINT, BUCKET, message["Records"][0]["s3"]["object"]["key"])],
+        "restaged": True,
+        "SQS_record": record,
+        "S3_event_record": message["Records"][0],
+        "Lambda_trigger_time": "2023-01-01T08:00:01.000000Z",
+    }
+    data_file = os.path.basename(urls[0])
+    job_params = {
+        "id": data_file,
+        "data_url": urls,
+        "data_file": data_file,
+        "prod_met": md,
+        "checksum": False,
+        "checksum_type": None,
+        "payload_hash": "d41d8cd98f00b204e9800998ecf8427e",
+    }
+    return md, job_params
+
+
+def original(record, urls, log):
+    message = json.loads(record["body"])
+    md, job_params = build_job_params(message, record, urls)
+    log(json.dumps(md, indent=2))
+    log(json.dumps(job_params))
+    params = {"queue": "queue", "priority": 0, "tags": json.dumps(["data-staged"]), "type": "job-ingest:release",
+              "params": json.dumps(job_params), "name": "ingest-staged-" + job_params["data_file"]}
+    log(json.dumps(params))
+    return params
+
+
+def optimized(record, urls, log):
+    message = json_codec.loads(record["body"])
+    md, job_params = build_job_params(message, record, urls)
+    params = {"queue": "queue", "priority": 0, "tags": json_codec.dumps(["data-staged"]),
+              "type": "job-ingest:release", "params": json_codec.dumps(job_params),
+              "name": "ingest-staged-" + job_params["data_file"]}
+    log(", ".join("%s=%s" % (key, value) for key, value in params.items()))
+    return params
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=200, help="granules listed in the signal file")
+    parser.add_argument("--records", type=int, default=500, help="records processed per run")
+    args = parser.parse_args()
+
+    record, urls = generate_record(args.files)
+    logged = []
+    assert json.loads(original(record, urls, logged.append)["params"]) == \
+        json_codec.loads(optimized(record, urls, logged.append)["params"])
+
+    def run(func):
+        def bench():
+            sink = []
+            for _ in range(args.records):
+                func(record, urls, sink.append)
+        return min(timeit.repeat(bench, number=1, repeat=5)) / args.records
+
+    before = run(original)
+    after = run(optimized)
+    print("backend: %s, granules per signal file: %d, records: %d" % (json_codec.BACKEND, args.files, args.records))
+    print("original:   %8.1f us/record" % (before * 1e6))
+    print("json_codec: %8.1f us/record  (%.1fx)" % (after * 1e6, before / after))
+
+
+if __name__ == "__main__":
+    main()
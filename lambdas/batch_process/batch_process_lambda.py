@@ -1,20 +1,20 @@
 from __future__ import print_function
 import json
+import math
 import os
-import re
-from distutils.util import strtobool
-from typing import Dict
-import dateutil.parser
-import requests
+from typing import TYPE_CHECKING, Dict
+import metrics
+import mozart_client
+import retry
 
-from types import SimpleNamespace
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from aws_lambda_powertools.utilities.data_classes import EventBridgeEvent
-from aws_lambda_powertools.utilities.typing import LambdaContext
-from hysds_commons.elasticsearch_utils import ElasticsearchUtility
 import logging
 
+if TYPE_CHECKING:
+    from aws_lambda_powertools.utilities.typing import LambdaContext
+
 DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
 JOB_NAME_DATETIME_FORMAT = "%Y%m%dT%H%M%S"
 
@@ -39,12 +39,84 @@ JOB_SUBMIT_URL = "%s/api/v0.1/job/submit?enable_dedup=false" % MOZART_URL
 
 ES_DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
 ES_INDEX = 'batch_proc'
+# max number of batch procs serviced at the same time
+MAX_PROC_CONCURRENCY = int(os.environ.get("MAX_PROC_CONCURRENCY", 10))
+# procs are not started once the invocation has less time than this left
+PROC_TIME_RESERVE_MS = int(os.environ.get("PROC_TIME_RESERVE_MS", 10000))
+# DISP procs query collections starting with this, sweeping frames of the frame to burst map within windows of
+# k Sentinel-1 repeat cycles
+DISP_COLLECTION_PREFIX = "OPERA_L2_CSLC-S1"
+DISP_REVISIT_DAYS = 12
+# the DISP-S1 frame to burst map of opera-adt/burst_db, packaged next to the lambda
+DISP_FRAME_BURST_MAP_JSON = os.environ.get(
+    "DISP_FRAME_BURST_MAP_JSON",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "opera-s1-disp-frame-to-burst.json"))
+# dates are written as ES_DATETIME_FORMAT, or as ISO 8601 when given as datetimes
+ES_DATE_MAPPING = {"type": "date", "format": "strict_date_hour_minute_second||strict_date_optional_time"}
+BATCH_PROC_MAPPINGS = {
+    "properties": {
+        "enabled": {"type": "boolean"},
+        "label": {"type": "keyword"},
+        "processing_mode": {"type": "keyword"},
+        "temporal": {"type": "boolean"},
+        "include_regions": {"type": "keyword"},
+        "exclude_regions": {"type": "keyword"},
+        "data_start_date": ES_DATE_MAPPING,
+        "data_end_date": ES_DATE_MAPPING,
+        "last_attempted_proc_data_date": ES_DATE_MAPPING,
+        "last_successful_proc_data_date": ES_DATE_MAPPING,
+        "last_run_date": ES_DATE_MAPPING,
+        # last_run_date + run_interval_mins, so due procs can be selected with a range query
+        "next_run_date": ES_DATE_MAPPING,
+        "data_date_incr_mins": {"type": "integer"},
+        "run_interval_mins": {"type": "integer"},
+        "job_type": {"type": "keyword"},
+        "collection_short_name": {"type": "keyword"},
+        "provider_name": {"type": "keyword"},
+        "job_queue": {"type": "keyword"},
+        "download_job_queue": {"type": "keyword"},
+        "chunk_size": {"type": "integer"},
+        "max_windows_per_tick": {"type": "integer"},
+        "max_concurrent_windows": {"type": "integer"},
+        # per-lane progress of procs with max_concurrent_windows > 1
+        "lanes": {
+            "properties": {
+                "start_date": ES_DATE_MAPPING,
+                "end_date": ES_DATE_MAPPING,
+                "last_attempted_proc_data_date": ES_DATE_MAPPING,
+                "last_successful_proc_data_date": ES_DATE_MAPPING,
+            }
+        },
+        "lanes_max_concurrent_windows": {"type": "integer"},
+        # the data end date the lanes were split up to
+        "lanes_data_end_date": ES_DATE_MAPPING,
+        # DISP procs only
+        "frames_per_query": {"type": "integer"},
+        "k": {"type": "integer"},
+        "m": {"type": "integer"},
+        "last_successful_proc_frame": {"type": "integer"},
+    }
+}
 LOGGER = logging.getLogger(ES_INDEX)
-eu = ElasticsearchUtility('http://%s:%s' % (GRQ_IP, str(GRQ_ES_PORT)), LOGGER)
+_eu = None
+_frame_to_bursts = None
+_index_ready = False
 
 print("Loading Lambda function")
 
 
+def get_eu():
+    """
+    Returns the GRQ ElasticsearchUtility, created on first use so that
+    hysds_commons and elasticsearch are not imported at cold start
+    """
+    global _eu
+    if _eu is None:
+        from hysds_commons.elasticsearch_utils import ElasticsearchUtility
+        _eu = ElasticsearchUtility('http://%s:%s' % (GRQ_IP, str(GRQ_ES_PORT)), LOGGER)
+    return _eu
+
+
 def convert_datetime(datetime_obj, strformat=DATETIME_FORMAT):
     """
     Converts from a datetime string to a datetime object or vice versa
@@ -54,63 +126,281 @@ def convert_datetime(datetime_obj, strformat=DATETIME_FORMAT):
     return datetime.strptime(str(datetime_obj), strformat)
 
 
+def to_datetime(value):
+    """
+    Returns a batch proc date, given as a datetime or as an ES date string,
+    as a datetime
+    """
+    if isinstance(value, datetime):
+        return value
+    return datetime.strptime(value, ES_DATETIME_FORMAT)
+
+
+def is_disp_proc(p):
+    """
+    Returns True if the batch proc sweeps DISP frames
+    """
+    return (p.collection_short_name or "").startswith(DISP_COLLECTION_PREFIX)
+
+
+def process_disp_frame_burst_json(file=DISP_FRAME_BURST_MAP_JSON):
+    """
+    Loads a DISP-S1 frame to burst map of opera-adt/burst_db
+
+    :param file: Path to the map.
+    :return: A (frame_to_bursts, metadata, version) tuple. frame_to_bursts
+    maps each frame id, as an int in ascending order, to its frame record,
+    which lists its "burst_id_list".
+    :raises ValueError: If the map has no frames.
+    """
+    with open(file) as f:
+        j = json.load(f)
+    metadata = j["metadata"]
+    frame_to_bursts = {int(frame_id): j["data"][frame_id] for frame_id in sorted(j["data"], key=int)}
+    if not frame_to_bursts:
+        raise ValueError("DISP frame to burst map {} has no frames".format(file))
+    return frame_to_bursts, metadata, metadata.get("version")
+
+
+def get_disp_frame_burst_map():
+    """
+    Returns the frame to burst map of DISP_FRAME_BURST_MAP_JSON, loaded on
+    first use
+    """
+    global _frame_to_bursts
+    if _frame_to_bursts is None:
+        _frame_to_bursts, metadata, version = process_disp_frame_burst_json(DISP_FRAME_BURST_MAP_JSON)
+        print("Loaded DISP frame to burst map version", version, "with", len(_frame_to_bursts), "frames")
+    return _frame_to_bursts
+
+
+class BatchProc:
+    """
+    A batch_proc document, parsed and validated once when it is loaded.
+    Dates are datetimes and optional fields take their defaults; documents
+    missing required fields or holding malformed values raise ValueError.
+    """
+    REQUIRED_FIELDS = ("label", "data_start_date", "data_end_date", "last_run_date", "data_date_incr_mins",
+                       "run_interval_mins", "job_type", "job_queue", "download_job_queue", "chunk_size")
+    # optional fields and their defaults
+    DEFAULTS = {
+        "enabled": True,
+        "processing_mode": "forward",
+        "temporal": False,
+        "include_regions": "",
+        "exclude_regions": "",
+        "last_attempted_proc_data_date": None,
+        # defaults to data_start_date
+        "last_successful_proc_data_date": None,
+        "collection_short_name": None,
+        "provider_name": None,
+        "max_windows_per_tick": 1,
+        "max_concurrent_windows": 1,
+        "lanes": None,
+        "lanes_max_concurrent_windows": None,
+        "lanes_data_end_date": None,
+        "frames_per_query": None,
+        "k": None,
+        "m": None,
+        "last_successful_proc_frame": 0,
+    }
+    DATE_FIELDS = ("data_start_date", "data_end_date", "last_run_date", "last_attempted_proc_data_date",
+                   "last_successful_proc_data_date", "lanes_data_end_date")
+    POSITIVE_INT_FIELDS = ("data_date_incr_mins", "run_interval_mins", "chunk_size", "max_windows_per_tick",
+                           "max_concurrent_windows")
+    DISP_POSITIVE_INT_FIELDS = ("frames_per_query", "k", "m")
+    PROCESSING_MODES = ("forward", "reprocessing", "historical")
+
+    __slots__ = ("doc_id", "seq_no", "primary_term") + REQUIRED_FIELDS + tuple(DEFAULTS)
+
+    def __init__(self, source, doc_id=None, seq_no=None, primary_term=None):
+        """
+        :param source: The batch proc document.
+        :param doc_id: The batch proc document id.
+        :param seq_no: The _seq_no of the document when it was queried.
+        :param primary_term: The _primary_term of the document when it was queried.
+        """
+        self.doc_id = doc_id
+        self.seq_no = seq_no
+        self.primary_term = primary_term
+
+        missing = [field for field in self.REQUIRED_FIELDS if source.get(field) is None]
+        if missing:
+            raise ValueError("Batch proc {} is missing {}".format(source.get("label", doc_id), ", ".join(missing)))
+        for field in self.REQUIRED_FIELDS:
+            setattr(self, field, source[field])
+        for field, default in self.DEFAULTS.items():
+            value = source.get(field)
+            setattr(self, field, default if value is None else value)
+
+        for field in self.DATE_FIELDS:
+            value = getattr(self, field)
+            if value is not None:
+                setattr(self, field, self._parse_date(field, value))
+        for field in self.POSITIVE_INT_FIELDS + (self.DISP_POSITIVE_INT_FIELDS if is_disp_proc(self) else ()):
+            value = getattr(self, field)
+            if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+                raise ValueError("Batch proc {} has invalid {}: {!r}".format(self.label, field, value))
+        # DISP procs sweep frames within a single sequence of windows, see process_disp_proc
+        if is_disp_proc(self) and self.max_concurrent_windows != 1:
+            raise ValueError("Batch proc {} is a DISP proc, which does not support max_concurrent_windows".format(
+                self.label))
+        if self.processing_mode not in self.PROCESSING_MODES:
+            raise ValueError("Batch proc {} has invalid processing_mode: {!r}".format(self.label, self.processing_mode))
+        if self.data_end_date < self.data_start_date:
+            raise ValueError("Batch proc {} ends before it starts".format(self.label))
+
+        if self.last_successful_proc_data_date is None:
+            self.last_successful_proc_data_date = self.data_start_date
+        if self.lanes:
+            self.lanes = [{k: self._parse_date("lanes." + k, v) for k, v in lane.items()} for lane in self.lanes]
+
+    @classmethod
+    def from_hit(cls, hit):
+        """
+        Loads a batch proc from an ES search hit
+        """
+        return cls(hit["_source"], hit["_id"], hit.get("_seq_no"), hit.get("_primary_term"))
+
+    def _parse_date(self, field, value):
+        try:
+            return datetime.strptime(value, ES_DATETIME_FORMAT)
+        except (TypeError, ValueError):
+            raise ValueError("Batch proc {} has invalid {}: {!r}".format(self.label, field, value)) from None
+
+    def __repr__(self):
+        return "BatchProc({!r})".format(self.label)
+
+
+def create_batch_proc_index():
+    """
+    Creates the batch_proc index with BATCH_PROC_MAPPINGS if it does not
+    exist yet, or else adds the mappings of the fields it does not map yet.
+    Fields already mapped, e.g. by dynamic mapping, are left as they are, as
+    ES rejects changes to existing mappings.
+    """
+    es = get_eu().es
+    if not es.indices.exists(index=ES_INDEX):
+        es.indices.create(index=ES_INDEX, body={"mappings": BATCH_PROC_MAPPINGS})
+        return
+    mapped = set()
+    for index_mapping in es.indices.get_mapping(index=ES_INDEX).values():
+        mapped.update(index_mapping.get("mappings", {}).get("properties", {}))
+    missing = {k: v for k, v in BATCH_PROC_MAPPINGS["properties"].items() if k not in mapped}
+    if missing:
+        print("Adding batch_proc mappings for", ", ".join(sorted(missing)))
+        es.indices.put_mapping(index=ES_INDEX, body={"properties": missing})
+
+
+def ensure_batch_proc_index():
+    """
+    Applies BATCH_PROC_MAPPINGS once per container, see
+    create_batch_proc_index. A failure is logged and retried on the next
+    tick, as the procs can still be serviced without the mappings.
+    """
+    global _index_ready
+    if _index_ready:
+        return
+    try:
+        create_batch_proc_index()
+        _index_ready = True
+    except Exception as e:
+        print("Failed to apply the batch_proc mappings: {}".format(repr(e)))
+
+
+def get_due_procs_query(now):
+    """
+    Returns the query selecting the enabled batch procs whose next run date
+    has passed. Procs written before next_run_date existed are selected too,
+    and checked against last_run_date by the caller. Hits carry their
+    _seq_no and _primary_term, so that procs can be claimed with
+    claim_batch_proc.
+    """
+    return {
+        "seq_no_primary_term": True,
+        "query": {
+            "bool": {
+                "filter": [
+                    {"term": {"enabled": True}},
+                    {"bool": {"should": [
+                        {"range": {"next_run_date": {"lte": now.strftime(ES_DATETIME_FORMAT)}}},
+                        {"bool": {"must_not": {"exists": {"field": "next_run_date"}}}},
+                    ]}},
+                ]
+            }
+        }
+    }
+
+
 def submit_job(job_name, job_spec, job_params, queue, tags, priority=0):
     """Submit job to mozart via REST API."""
+    return mozart_client.submit_job(JOB_SUBMIT_URL, job_name, job_spec, job_params, queue, tags, priority)
 
-    # setup params
-    params = {
-        "queue": queue,
-        "priority": priority,
-        "tags": json.dumps(tags),
-        "type": job_spec,
-        "params": json.dumps(job_params),
-        "name": job_name,
-    }
 
-    # submit job
-    print("Job params: %s" % json.dumps(params))
-    print("Job URL: %s" % JOB_SUBMIT_URL)
-    req = requests.post(JOB_SUBMIT_URL, data=params, verify=False)
+def next_disp_job(p, frame_to_bursts):
+    """
+    Returns the next DISP query job of a batch proc: the next
+    frames_per_query frames of its current window of k * DISP_REVISIT_DAYS
+    days, rolling over to the first frames of the next window once every
+    frame of the map has been queried.
 
-    print("Request code: %s" % req.status_code)
-    print("Request text: %s" % req.text)
+    :return: The (s_date, e_date, first_frame, last_frame) of the job. The
+    proc has finished if s_date is not before its data end date.
+    """
+    data_end_date = to_datetime(p.data_end_date)
+    s_date = max(to_datetime(p.last_successful_proc_data_date), to_datetime(p.data_start_date))
+    window = timedelta(days=p.k * DISP_REVISIT_DAYS)
+    max_frame = max(frame_to_bursts)
+    first_frame = getattr(p, "last_successful_proc_frame", 0) + 1
+    if first_frame > max_frame:
+        s_date += window
+        first_frame = 1
+    e_date = min(s_date + window, data_end_date)
+    return s_date, e_date, first_frame, min(first_frame + p.frames_per_query - 1, max_frame)
+
+
+def form_job_params(p, frame_to_bursts):
+    """
+    Forms the next query job of a batch proc from its progress
+
+    :param p: The batch proc.
+    :param frame_to_bursts: The DISP frame to burst map for DISP procs, None
+    for others.
+    :return: A (job_name, job_spec, job_params, job_tags, last_proc_date,
+    last_proc_frame, finished) tuple. last_proc_date and last_proc_frame are
+    the progress to record once the job is submitted: the data end date of
+    the job, or for DISP procs the start date of the window and the last frame
+    queried. If finished, the proc has no job left and the job fields are None.
+    """
+    data_end_date = to_datetime(p.data_end_date)
+    if frame_to_bursts is not None:
+        s_date, e_date, first_frame, last_frame = next_disp_job(p, frame_to_bursts)
+        if s_date >= data_end_date:
+            return None, None, None, None, s_date, last_frame, True
+        return form_window_job_params(p, s_date, e_date, (first_frame, last_frame)) + (s_date, last_frame, False)
 
-    if req.status_code != 200:
-        req.raise_for_status()
-    result = req.json()
-    print("Request Result: %s" % result)
+    s_date = max(to_datetime(p.last_successful_proc_data_date), to_datetime(p.data_start_date))
+    if s_date >= data_end_date:
+        return None, None, None, None, s_date, None, True
+    e_date = min(s_date + timedelta(minutes=p.data_date_incr_mins), data_end_date)
+    return form_window_job_params(p, s_date, e_date) + (e_date, None, False)
 
-    if "result" in result.keys() and "success" in result.keys():
-        if result["success"] is True:
-            job_id = result["result"]
-            print("submitted job: %s job_id: %s" % (job_spec, job_id))
-            return job_id
-        else:
-            print("job not submitted successfully: %s" % result)
-            raise Exception("job not submitted successfully: %s" % result)
-    else:
-        raise Exception("job not submitted successfully: %s" % result)
 
+def form_window_job_params(p, s_date, e_date, frame_range=None):
+    """
+    Forms the query job of a batch proc for a data window
 
-def form_job_params(p, s_date, e_date):
+    :param p: The batch proc.
+    :param s_date: The start of the data window.
+    :param e_date: The end of the data window.
+    :param frame_range: The (first, last) DISP frames to query, for DISP procs.
+    :return: A (job_name, job_spec, job_params, job_tags) tuple.
+    """
     end_point = ENDPOINT
     download_job_queue = p.download_job_queue
-    try:
-        if p.temporal is True:
-            temporal = True
-        else:
-            temporal = False
-    except:
-        print("Temporal parameter not found in batch proc. Defaulting to false.")
-        temporal = False
-
-    try:
-        processing_mode = p.processing_mode
-        if p.processing_mode == "historical":
-            temporal = True  # temporal is always true for historical processing
-    except:
-        print("processing_mode parameter not found in batch proc. Defaulting to forward.")
-        processing_mode = 'forward'
+    processing_mode = p.processing_mode
+    # temporal is always true for historical processing
+    temporal = processing_mode == "historical" or p.temporal is True
 
     job_spec = "job-%s:%s" % (p.job_type, JOB_RELEASE)
     job_params = {
@@ -129,18 +419,15 @@ def form_job_params(p, s_date, e_date):
     }
 
     # Include and exclude regions are optional
-    try:
-        includes = p.include_regions
-        if len(includes.strip()) > 0:
-            job_params["include_regions"] = f'--include-regions={includes}'
-    except:
-        pass
-    try:
-        excludes = p.exclude_regions
-        if len(excludes.strip()) > 0:
-            job_params["exclude_regions"] = f'--exclude-regions={excludes}'
-    except:
-        pass
+    if p.include_regions.strip():
+        job_params["include_regions"] = f'--include-regions={p.include_regions}'
+    if p.exclude_regions.strip():
+        job_params["exclude_regions"] = f'--exclude-regions={p.exclude_regions}'
+
+    if frame_range is not None:
+        job_params["frame_range"] = f'--frame-range={frame_range[0]},{frame_range[1]}'
+        job_params["k"] = f'--k={p.k}'
+        job_params["m"] = f'--m={p.m}'
 
     tags = ["data-subscriber-query-timer"]
     if processing_mode == 'historical':
@@ -152,91 +439,435 @@ def form_job_params(p, s_date, e_date):
 
     return job_name, job_spec, job_params, tags
 
-def batch_proc_once():
-    procs = eu.query(index=ES_INDEX)  # TODO: query for only enabled docs
-    for proc in procs:
-        doc_id = proc['_id']
-        proc = proc['_source']
-        p = SimpleNamespace(**proc)
-
-        # If this batch proc is disabled, continue TODO: this goes away when we change the query above
-        if p.enabled == False:
-            continue
-
-        now = datetime.utcnow()
-        new_last_run_date = datetime.strptime(p.last_run_date, ES_DATETIME_FORMAT) + timedelta(
-            minutes=p.run_interval_mins)
-
-        # If it's not time to run yet, just continue
-        if new_last_run_date > now:
-            continue
-
-        # Update last_run_date here
-        eu.update_document(id=doc_id,
-                           body={"doc_as_upsert": True,
-                                 "doc": {
-                                     "last_run_date": now.strftime(ES_DATETIME_FORMAT), }},
-                           index=ES_INDEX)
-
-        data_start_date = datetime.strptime(p.data_start_date, ES_DATETIME_FORMAT)
-        data_end_date = datetime.strptime(p.data_end_date, ES_DATETIME_FORMAT)
-
-        # Start date time is when the last successful process data time.
-        # If this is before the data start time, which may be the case when this batch_proc is first run,
-        # change it to the data start time.
-        s_date = datetime.strptime(p.last_successful_proc_data_date, ES_DATETIME_FORMAT)
-        if s_date < data_start_date:
-            s_date = data_start_date
 
-        # End date time is when the start data time plus data increment time in minutes.
-        # If this is after the data end time, which would be the case when this is the very last iteration of this proc,
-        # change it to the data end time.
-        e_date = s_date + timedelta(minutes=p.data_date_incr_mins)
-        if e_date > data_end_date:
-            e_date = data_end_date
+def write_batch_proc_updates(updates):
+    """
+    Partially updates the batch proc documents in a single _bulk request
+
+    :param updates: List of (doc_id, doc, seq_no, primary_term) tuples, doc
+    holding the fields to update. A document is only updated if it is still
+    at seq_no and primary_term, i.e. if no other scheduler claimed it since,
+    or unconditionally if seq_no is None.
+    :return: The ids of the documents that could not be updated, all of them
+    if the request itself failed.
+    """
+    if not updates:
+        return []
+    actions = []
+    for doc_id, doc, seq_no, primary_term in updates:
+        if seq_no is None:
+            actions.append({"update": {"_index": ES_INDEX, "_id": doc_id}})
+            actions.append({"doc": doc, "doc_as_upsert": True})
+        else:
+            # ES does not support conditional upserts
+            actions.append({"update": {"_index": ES_INDEX, "_id": doc_id,
+                                       "if_seq_no": seq_no, "if_primary_term": primary_term}})
+            actions.append({"doc": doc})
+    try:
+        with metrics.timed("ESUpdate"):
+            res = get_eu().es.bulk(body=actions)
+    except Exception as e:
+        print("Failed to update batch procs {}: {}".format(", ".join(update[0] for update in updates), repr(e)))
+        return [update[0] for update in updates]
+    failed = []
+    if res.get("errors"):
+        for item in res.get("items", []):
+            if "error" in item["update"]:
+                print("Failed to update batch proc {}: {}".format(item["update"]["_id"], item["update"]["error"]))
+                failed.append(item["update"]["_id"])
+    return failed
+
+
+def claim_batch_proc(doc_id, seq_no, primary_term, doc):
+    """
+    Claims a due batch proc for this scheduler by writing its new run dates,
+    on condition that the document has not changed since it was queried.
+    Concurrent schedulers may then service the same proc set: only one of
+    them wins the claim for each run.
+
+    :param doc_id: The batch proc document id.
+    :param seq_no: The _seq_no of the document when it was queried, or None
+    to claim it unconditionally.
+    :param primary_term: The _primary_term of the document when it was queried.
+    :param doc: The fields to update.
+    :return: The (seq_no, primary_term) of the document after the claim, to
+    make the proc's state write conditional on, or None if another scheduler
+    updated the proc first.
+    """
+    from elasticsearch.exceptions import ConflictError
 
-        # See if we've reached the end of this batch proc. If so, disable it.
-        if s_date >= data_end_date:
-            print(p.label, "Batch Proc completed processing. It is now disabled")
-            eu.update_document(id=doc_id,
-                               body={"doc_as_upsert": True,
-                                     "doc": {
-                                         "enabled": False, }},
-                               index=ES_INDEX)
-            continue
-
-        # update last_attempted_proc_data_date here
-        eu.update_document(id=doc_id,
-                           body={"doc_as_upsert": True,
-                                 "doc": {
-                                     "last_attempted_proc_data_date": e_date, }},
-                           index=ES_INDEX)
+    concurrency = {} if seq_no is None else {"if_seq_no": seq_no, "if_primary_term": primary_term}
+    try:
+        with metrics.timed("ESUpdate"):
+            res = get_eu().es.update(index=ES_INDEX, id=doc_id, body={"doc": doc}, **concurrency)
+    except ConflictError:
+        return None
+    return res.get("_seq_no"), res.get("_primary_term")
+
+
+def split_lanes(gaps, data_date_incr_mins, max_lanes):
+    """
+    Splits the data still to process, given as (start, end) gaps, into at
+    most max_lanes contiguous, non-overlapping lanes of whole
+    data_date_incr_mins windows. A lane never spans two gaps, so there is
+    one lane per gap when there are more gaps than max_lanes.
+    """
+    if not gaps:
+        return []
+    incr = timedelta(minutes=data_date_incr_mins)
+    gap_windows = [math.ceil((e_date - s_date) / incr) for s_date, e_date in gaps]
+    windows_per_lane = max(1, math.ceil(sum(gap_windows) / max_lanes))
+    while (sum(math.ceil(windows / windows_per_lane) for windows in gap_windows) > max_lanes
+           and windows_per_lane < max(gap_windows)):
+        windows_per_lane += 1
+
+    lanes = []
+    for s_date, data_end_date in gaps:
+        while s_date < data_end_date:
+            e_date = min(s_date + windows_per_lane * incr, data_end_date)
+            lanes.append({"start_date": s_date, "end_date": e_date, "last_successful_proc_data_date": s_date})
+            s_date = e_date
+    return lanes
+
+
+def get_unprocessed_gaps(p, s_date):
+    """
+    Returns the (start, end) ranges of data a batch proc has left to process:
+    the rest of each of its lanes, and the data past the data end date its
+    lanes were split up to when the data end date was moved later. The data
+    already submitted by its lanes is never included, so it is not submitted
+    again.
+    """
+    if not p.lanes:
+        return [(s_date, p.data_end_date)] if s_date < p.data_end_date else []
+    gaps = []
+    for lane in p.lanes:
+        start, end = lane["last_successful_proc_data_date"], min(lane["end_date"], p.data_end_date)
+        if start < end:
+            gaps.append((start, end))
+    # lanes written before lanes_data_end_date was recorded end at the data end date they were split up to
+    last_end = p.lanes_data_end_date or max(lane["end_date"] for lane in p.lanes)
+    if last_end < p.data_end_date:
+        gaps.append((max(last_end, s_date), p.data_end_date))
+    return gaps
+
+
+def get_lanes(p):
+    """
+    Returns the lanes of a batch proc, in data order. A proc with
+    max_concurrent_windows of N > 1 keeps its lanes in its "lanes" field;
+    they are split from its last_successful_proc_data_date on first use, and
+    again whenever N or the data end date changes. A re-split only covers
+    what the existing lanes have left to process. Other procs have a single
+    lane from their last_successful_proc_data_date to their data end date,
+    or, when N was lowered to 1, one lane for each range their former lanes
+    have left to process, see leaves_lanes.
+    """
+    # Start date time is when the last successful process data time.
+    # If this is before the data start time, which may be the case when this batch_proc is first run,
+    # change it to the data start time.
+    s_date = max(p.last_successful_proc_data_date, p.data_start_date)
+    if (not p.lanes or p.lanes_max_concurrent_windows != p.max_concurrent_windows
+            or (p.lanes_data_end_date or p.lanes[-1]["end_date"]) != p.data_end_date):
+        if p.lanes or p.max_concurrent_windows > 1:
+            print(p.label, "Splitting remaining data into", p.max_concurrent_windows, "lanes")
+        return split_lanes(get_unprocessed_gaps(p, s_date), p.data_date_incr_mins, p.max_concurrent_windows)
+    return [dict(lane) for lane in p.lanes]
+
+
+def leaves_lanes(p, lanes):
+    """
+    Returns True if a batch proc with max_concurrent_windows of 1 has no
+    progress left to keep in its "lanes" field: the data it has left to
+    process, if any, runs from its first unfinished lane up to its data end
+    date, so its last_successful_proc_data_date alone records its progress.
+    """
+    unfinished = [lane for lane in lanes if lane["last_successful_proc_data_date"] < lane["end_date"]]
+    return (p.max_concurrent_windows == 1 and len(unfinished) <= 1
+            and all(lane["end_date"] == p.data_end_date for lane in unfinished))
+
+
+def submit_lane_windows(p, lane, max_windows, now, context, job_ids, windows):
+    """
+    Submits the next window of a lane and, while the lane is behind the
+    current time, up to max_windows consecutive windows in total. Updates the
+    lane's last attempted and successful dates, and appends the job ids and
+    (start, end) windows submitted.
+    """
+    s_date = lane["last_successful_proc_data_date"]
+    for submitted in range(max_windows):
+        # End date time is when the start data time plus data increment time in minutes.
+        # If this is after the lane end time, which would be the case when this is the very last iteration of
+        # this lane, change it to the lane end time.
+        e_date = min(s_date + timedelta(minutes=p.data_date_incr_mins), lane["end_date"])
+        # Catch up on the following windows only if their data is already in the past
+        if s_date >= lane["end_date"] or (submitted and e_date > now):
+            break
 
+        lane["last_attempted_proc_data_date"] = e_date
 
         # Compute job parameters
-        (job_name, job_spec, job_params, job_tags) = form_job_params(p, s_date, e_date)
-        #return job_params
+        (job_name, job_spec, job_params, job_tags) = form_window_job_params(p, s_date, e_date)
 
         # submit mozart job
         print("Submitting query job for", p.label, "with start date", s_date, "and end date", e_date)
-        job_success = submit_job(job_name, job_spec, job_params, p.job_queue, job_tags)
+        job_ids.append(submit_job(job_name, job_spec, job_params, p.job_queue, job_tags))
+        windows.append((s_date, e_date))
+
+        lane["last_successful_proc_data_date"] = s_date = e_date
+
+        if not retry.has_time(context, reserve_ms=PROC_TIME_RESERVE_MS):
+            break
+
+
+def process_disp_proc(p, frame_to_bursts, now, context=None):
+    """
+    Submits the next DISP query jobs of a claimed batch proc. Each job
+    queries the next frames_per_query frames of the current window, see
+    next_disp_job, so the frames of a window are queried in parallel by
+    several jobs. While the proc's windows are behind the current time, up
+    to max_windows_per_tick jobs are submitted in a tick. DISP procs have no
+    lanes: BatchProc rejects a max_concurrent_windows other than 1.
+
+    :return: A (result, doc) tuple, as for process_proc. Submitted results
+    also list the "frame_ranges" of the jobs.
+    """
+    doc = {}
+    job_ids = []
+    windows = []
+    try:
+        for submitted in range(p.max_windows_per_tick):
+            s_date, e_date, first_frame, last_frame = next_disp_job(p, frame_to_bursts)
+            if s_date >= p.data_end_date or (submitted and e_date > now):
+                break
+
+            doc["last_attempted_proc_data_date"] = e_date.strftime(ES_DATETIME_FORMAT)
+            (job_name, job_spec, job_params, job_tags) = form_window_job_params(p, s_date, e_date,
+                                                                                (first_frame, last_frame))
+            print("Submitting query job for", p.label, "with start date", s_date, "and end date", e_date,
+                  "and frames", first_frame, "to", last_frame)
+            job_ids.append(submit_job(job_name, job_spec, job_params, p.job_queue, job_tags))
+            windows.append((s_date, e_date, first_frame, last_frame))
+
+            p.last_successful_proc_data_date = s_date
+            p.last_successful_proc_frame = last_frame
+            doc["last_successful_proc_data_date"] = s_date.strftime(ES_DATETIME_FORMAT)
+            doc["last_successful_proc_frame"] = last_frame
+
+            if not retry.has_time(context, reserve_ms=PROC_TIME_RESERVE_MS):
+                break
+    except Exception as e:
+        print("Failed to process batch proc {}: {}".format(p.label, repr(e)))
+        if not job_ids:
+            return {"label": p.label, "status": "failed", "error": str(e)}, doc or None
+
+    # See if we've reached the end of this batch proc. If so, disable it.
+    if not job_ids:
+        print(p.label, "Batch Proc completed processing. It is now disabled")
+        doc["enabled"] = False
+        return {"label": p.label, "status": "completed"}, doc
+
+    return {"label": p.label, "status": "submitted", "job_ids": job_ids,
+            "windows": [(convert_datetime(s_date), convert_datetime(e_date)) for s_date, e_date, _, _ in windows],
+            "frame_ranges": [(first_frame, last_frame) for _, _, first_frame, last_frame in windows],
+            "start_date": convert_datetime(windows[0][0]),
+            "end_date": convert_datetime(windows[-1][1])}, doc
+
+
+def process_proc(p, context=None):
+    """
+    Submits the next query jobs of a batch proc if it is due, and works out
+    the proc's state transition.
+
+    A proc with max_concurrent_windows of N > 1 has its remaining data split
+    into N lanes, and submits the next window of every lane each tick, so N
+    non-overlapping windows are in flight at once. A lane whose windows have
+    fallen behind the current time catches up by submitting up to the proc's
+    max_windows_per_tick (default 1) consecutive windows. A proc whose N is
+    lowered to 1 works through the rest of its lanes one after the other, and
+    clears its lanes once one range up to its data end date is left. Windows
+    are only submitted while the invocation has more than
+    PROC_TIME_RESERVE_MS left. DISP procs sweep the frames of each window
+    instead, see process_disp_proc.
+
+    :param p: The BatchProc.
+    :param context: The Lambda context, or None to run without a time budget.
+    :return: A (result, doc) tuple. result is a dict with the proc "label",
+    its "status" ("submitted", "not_due", "skipped" when claimed by another
+    scheduler, "completed" or "failed") and, when submitted, the "job_ids",
+    the "windows" they cover and the "start_date" and "end_date" of the data
+    covered. doc holds the fields left to update in the batch proc document,
+    to write on condition that the document is still at the proc's seq_no
+    and primary_term, or is None if the proc was not claimed.
+    """
+    now = datetime.utcnow()
+    new_last_run_date = p.last_run_date + timedelta(minutes=p.run_interval_mins)
+
+    # If it's not time to run yet, just continue
+    if new_last_run_date > now:
+        return {"label": p.label, "status": "not_due"}, None
+
+    # Load the frame map before claiming, so a missing map does not push the proc to its next run date
+    frame_to_bursts = get_disp_frame_burst_map() if is_disp_proc(p) else None
+
+    # Claim the run before submitting anything. It stays recorded even if the proc fails below,
+    # so it is not retried before its next run date. Until the proc's state is written, the claim
+    # holds the proc for the rest of the invocation, so no other scheduler claims it mid-tick.
+    next_run_date = now + timedelta(minutes=p.run_interval_mins)
+    lease_until = now + timedelta(milliseconds=retry.remaining_ms(context) or 0)
+    claim = claim_batch_proc(p.doc_id, p.seq_no, p.primary_term, {
+        "last_run_date": now.strftime(ES_DATETIME_FORMAT),
+        "next_run_date": max(next_run_date, lease_until).strftime(ES_DATETIME_FORMAT)})
+    if claim is None:
+        print(p.label, "Batch Proc was claimed by another scheduler")
+        return {"label": p.label, "status": "skipped"}, None
+
+    p.seq_no, p.primary_term = claim
+
+    if frame_to_bursts is not None:
+        result, doc = process_disp_proc(p, frame_to_bursts, now, context)
+    else:
+        result, doc = process_lane_proc(p, now, context)
+    # Release the lease taken by the claim: the proc is due again run_interval_mins after this run
+    return result, dict(doc or {}, next_run_date=next_run_date.strftime(ES_DATETIME_FORMAT))
+
+
+def process_lane_proc(p, now, context=None):
+    """
+    Submits the next query jobs of a claimed batch proc over its lanes, see
+    process_proc.
 
-        # Update last_successful_proc_data_date here
-        eu.update_document(id=doc_id,
-                           body={"doc_as_upsert": True,
-                                 "doc": {
-                                     "last_successful_proc_data_date": e_date, }},
-                           index=ES_INDEX)
+    :return: A (result, doc) tuple, as for process_proc.
+    """
 
-        return job_success
+    doc = {}
+    job_ids = []
+    windows = []
+    error = None
+    lanes = get_lanes(p)
+
+    # See if we've reached the end of this batch proc. If so, disable it.
+    pending = [lane for lane in lanes if lane["last_successful_proc_data_date"] < lane["end_date"]]
+    if not pending:
+        print(p.label, "Batch Proc completed processing. It is now disabled")
+        doc["enabled"] = False
+        return {"label": p.label, "status": "completed"}, doc
+
+    # A re-split may leave more lanes than max_concurrent_windows, when more lanes were in progress
+    for lane in pending[:p.max_concurrent_windows]:
+        if windows and not retry.has_time(context, reserve_ms=PROC_TIME_RESERVE_MS):
+            break
+        try:
+            submit_lane_windows(p, lane, p.max_windows_per_tick, now, context, job_ids, windows)
+        except Exception as e:
+            print("Failed to process batch proc {}: {}".format(p.label, repr(e)))
+            error = e
+
+    attempted = [lane["last_attempted_proc_data_date"] for lane in lanes if "last_attempted_proc_data_date" in lane]
+    if attempted:
+        doc["last_attempted_proc_data_date"] = max(attempted).strftime(ES_DATETIME_FORMAT)
+    if not leaves_lanes(p, lanes):
+        doc["lanes"] = [{k: v.strftime(ES_DATETIME_FORMAT) for k, v in lane.items()} for lane in lanes]
+        doc["lanes_max_concurrent_windows"] = p.max_concurrent_windows
+        doc["lanes_data_end_date"] = p.data_end_date.strftime(ES_DATETIME_FORMAT)
+    elif p.lanes:
+        print(p.label, "Batch Proc left its lanes")
+        doc["lanes"] = doc["lanes_max_concurrent_windows"] = doc["lanes_data_end_date"] = None
+
+    if not job_ids:
+        return {"label": p.label, "status": "failed", "error": str(error)}, doc or None
+
+    # The data is processed up to the first lane that is not finished
+    doc["last_successful_proc_data_date"] = next(
+        (lane["last_successful_proc_data_date"] for lane in lanes
+         if lane["last_successful_proc_data_date"] < lane["end_date"]), p.data_end_date).strftime(ES_DATETIME_FORMAT)
+
+    if len(job_ids) > 1:
+        print(p.label, "submitted", len(job_ids), "windows over", len(lanes), "lanes")
+
+    return {"label": p.label, "status": "submitted", "job_ids": job_ids,
+            "windows": [(convert_datetime(s_date), convert_datetime(e_date)) for s_date, e_date in windows],
+            "start_date": convert_datetime(min(s_date for s_date, _ in windows)),
+            "end_date": convert_datetime(max(e_date for _, e_date in windows))}, doc
+
+
+def batch_proc_once(context=None):
+    """
+    Services every due batch proc, at most MAX_PROC_CONCURRENCY at a time.
+    Procs are not started once the invocation has less than
+    PROC_TIME_RESERVE_MS left; they are serviced on the next tick. Each due
+    proc is claimed before its job is submitted, so several schedulers can run
+    at once. The claim holds the proc until the end of the invocation, and the
+    state write fails if another scheduler claimed it since, so a slow
+    scheduler never overwrites newer progress. The rest of the state
+    transition of each proc is written as soon as its jobs are submitted, so a
+    failure later in the tick does not lose the progress of procs already
+    serviced and have their jobs, submitted with enable_dedup=false, submitted
+    again on the next tick. The first tick of a container applies
+    BATCH_PROC_MAPPINGS, see ensure_batch_proc_index.
+
+    :param context: The Lambda context, or None to run without a time budget.
+    :return: A summary listing the "submitted" jobs, and the labels of the
+    procs "completed", "deferred" for lack of time, "skipped" as claimed by
+    another scheduler and "failed" in this tick, and of the procs whose state
+    could not be written ("update_failed").
+    """
+    ensure_batch_proc_index()
+    with metrics.timed("ESQuery"):
+        procs = get_eu().query(index=ES_INDEX, body=get_due_procs_query(datetime.utcnow()))
+
+    def run(proc):
+        try:
+            p = BatchProc.from_hit(proc)
+        except ValueError as e:
+            print("Invalid batch proc {}: {}".format(proc['_id'], e))
+            return None, {"label": proc['_source'].get("label", proc['_id']), "status": "failed",
+                          "error": str(e)}, None
+        if not retry.has_time(context, reserve_ms=PROC_TIME_RESERVE_MS):
+            return p, {"label": p.label, "status": "deferred"}, None
+        try:
+            return (p,) + process_proc(p, context)
+        except Exception as e:
+            print("Failed to process batch proc {}: {}".format(p.label, repr(e)))
+            return p, {"label": p.label, "status": "failed", "error": str(e)}, None
+
+    def service(proc):
+        p, result, doc = run(proc)
+        if doc is not None and write_batch_proc_updates([(proc['_id'], doc, p.seq_no, p.primary_term)]):
+            result["update_failed"] = True
+        return result
+
+    results = []
+    if procs:
+        with ThreadPoolExecutor(max_workers=min(MAX_PROC_CONCURRENCY, len(procs))) as executor:
+            results = list(executor.map(service, procs))
+
+    summary = {
+        "submitted": [{k: v for k, v in r.items() if k not in ("status", "update_failed")}
+                      for r in results if r["status"] == "submitted"],
+        "completed": [r["label"] for r in results if r["status"] == "completed"],
+        "deferred": [r["label"] for r in results if r["status"] == "deferred"],
+        "skipped": [r["label"] for r in results if r["status"] == "skipped"],
+        "failed": [r["label"] for r in results if r["status"] == "failed"],
+        "update_failed": [r["label"] for r in results if r.get("update_failed")],
+    }
+    metrics.put_metric("DueProcs", len(procs))
+    for status in ("submitted", "deferred", "skipped", "failed"):
+        metrics.put_metric("Procs" + status.capitalize(), len(summary[status]))
+    metrics.put_metric("JobsSubmitted", sum(len(r["job_ids"]) for r in summary["submitted"]))
+    metrics.put_metric("ProcUpdatesFailed", len(summary["update_failed"]))
+    return summary
 
 
-def lambda_handler(event: Dict, context: LambdaContext):
+@metrics.instrument("batch_process")
+def lambda_handler(event: Dict, context: "LambdaContext"):
     """
     This lambda handler calls submit_job with the job type info
     and dataset_type set in the environment
     """
 
+    from aws_lambda_powertools.utilities.data_classes import EventBridgeEvent
+
     event = EventBridgeEvent(event)
 
     print("Got event of type: %s" % type(event))
@@ -244,8 +875,8 @@ def lambda_handler(event: Dict, context: LambdaContext):
     print("Got context: %s" % context)
     print("os.environ: %s" % os.environ)
 
-    # submit mozart job
-    return batch_proc_once()
+    # submit mozart jobs
+    return batch_proc_once(context)
 
 
 if __name__ == '__main__':
@@ -15,6 +15,10 @@ import six
 
 WHEELHOUSE = "wheelhouse"
 DIST = "dist"
+# Modules shared by every lambda, packaged next to lambda_function.py
+COMMON = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common")
+# DISP-S1 frame to burst map of opera-adt/burst_db, packaged next to lambda_function.py
+DISP_FRAME_BURST_MAP_JSON = "opera-s1-disp-frame-to-burst.json"
 
 
 class Package(setuptools.Command):
@@ -148,6 +152,11 @@ class Package(setuptools.Command):
         os.symlink(lambda_func, aws_lambda_file_path)
 
     def run(self):
+        # Only DISP batch procs need the map, and they fail without it while the other procs still run
+        package_map = os.path.exists(DISP_FRAME_BURST_MAP_JSON)
+        if not package_map:
+            print("WARNING: {} is missing, DISP batch procs will fail. Download the DISP-S1 frame to burst map "
+                  "from opera-adt/burst_db into {}".format(DISP_FRAME_BURST_MAP_JSON, os.getcwd()))
         commands = []
         commands.extend([
             "rm -rf {workspace}/{dir}".format(workspace=self.workspace,
@@ -179,7 +188,11 @@ class Package(setuptools.Command):
         self.execute(
             "zip -9 {package_name} {files}".format(
                 package_name=lambda_package,
-                files=' '.join(glob.glob("lambda_function.py"))))
+                files=' '.join(glob.glob("lambda_function.py") + ([DISP_FRAME_BURST_MAP_JSON] if package_map else []))))
+        self.execute(
+            "zip -9 -j {package_name} {files}".format(
+                package_name=lambda_package,
+                files=' '.join(sorted(glob.glob(os.path.join(COMMON, "*.py"))))))
         os.chdir(os.path.join(self.workspace, WHEELHOUSE))
         self.execute(
             "zip -rg ../{dist}/{archive_name}-{version}.zip "
@@ -11,10 +11,12 @@ with delivery and ingestion time.
 '''
 
 import os
-import json
-import requests
 import base64
-import backoff
+
+import json_codec
+import metrics
+import mozart_client
+import retry
 
 print ('Loading function')
 
@@ -24,65 +26,97 @@ JOB_TYPE = os.environ['JOB_TYPE']
 JOB_RELEASE = os.environ['JOB_RELEASE']
 TAGGING = os.environ['PRODUCT_TAG']  # set to True if product in HySDS catalog should be tagged as delivered.
 EVENT_TRIGGER = os.environ['EVENT_TRIGGER']
+JOB_SUBMIT_URL = '%s/api/v0.1/job/submit' % MOZART_URL
+
+def is_not_request_exception(e):
+    """Return True if the exception was not raised by requests, i.e. should not be retried.
+       requests is imported here to keep it out of the cold start import path."""
+    import requests
+
+    return not isinstance(e, requests.exceptions.RequestException)
+
 
-@backoff.on_exception(
-    backoff.expo, requests.exceptions.RequestException, max_tries=8, max_value=32
-)
-def submit_job(job_type, release, product_id, tag, job_params, identifier=""):
+def submit_job(job_type, release, product_id, tag, job_params, identifier="", context=None):
     """
-    submits a job to mozart
+    submits a job to mozart, retrying request errors while the invocation
+    has time left
     :param job_type:
     :param release:
     :param product_id:
     :param tag:
     :param job_params:
+    :param identifier:
+    :param context: the Lambda context, used to bound the retries
     :return:
     """
 
     # submit mozart job
     print("submit_job : job_type : {}, release : {}, product_id : {}, tag : {}, job_params : {}, identifier : {}".format(job_type, release, product_id, tag, job_params, identifier))
-    job_submit_url = '%s/api/v0.1/job/submit' % MOZART_URL
-    params = {
-        'queue': QUEUE,
-        'priority': '5',
-        'name': 'job_%s-%s' % ('process_cnm_response', identifier),
-        'tags': json.dumps(tag),
-        'type': 'job-%s:%s' % (job_type, release),
-        'params': json.dumps(job_params),
-        'enable_dedup': True
+    job = form_job(job_type, release, tag, job_params, identifier)
+    job_id = retry.call(
+        lambda: mozart_client.submit_job(JOB_SUBMIT_URL, **job),
+        context, max_tries=8, max_value=32, giveup=is_not_request_exception
+    )
+    print ('submitted upate ES:%s job: %s job_id: %s' % (job_type, release, job_id))
+    return job_id
+
+
+def submit_jobs(job_type, release, tag, records, context=None):
+    """
+    submits a job to mozart for each record concurrently. Submissions that
+    fail are retried one at a time through submit_job.
+    :param job_type:
+    :param release:
+    :param tag:
+    :param records: list of (product_id, identifier, job_params) tuples
+    :param context: the Lambda context, used to bound the retries
+    :return: list aligned with records, True for each record whose job could
+    not be submitted
+    """
+    jobs = [form_job(job_type, release, tag, job_params, identifier)
+            for product_id, identifier, job_params in records]
+    results = mozart_client.submit_jobs(JOB_SUBMIT_URL, jobs)
+    failed = []
+    for (product_id, identifier, job_params), result in zip(records, results):
+        if result["error"] is not None:
+            print("Retrying submission for identifier : {}".format(identifier))
+            try:
+                submit_job(job_type, release, product_id, tag, job_params, identifier, context)
+            except Exception as e:
+                print("Failed to submit job for identifier {}: {}".format(identifier, repr(e)))
+                failed.append(True)
+                continue
+        failed.append(False)
+    return failed
+
 
+def form_job(job_type, release, tag, job_params, identifier):
+    """
+    forms the mozart_client.submit_job arguments for a cnm response job
+    """
+    return {
+        "job_name": 'job_%s-%s' % ('process_cnm_response', identifier),
+        "job_spec": 'job-%s:%s' % (job_type, release),
+        "job_params": job_params,
+        "queue": QUEUE,
+        "tags": tag,
+        "priority": '5',
+        "enable_dedup": True,
     }
-    print ('submitting jobs with params:')
-    print ('Job params: %s' % json.dumps(params, sort_keys=True, indent=4, 
-                                         separators=(',', ': ')))
-    print ('Job Submit URL: {}'.format(job_submit_url))
-    req = requests.post(job_submit_url, data=params, verify=False)
-    print("Request code: %s"% req.status_code)
-    if req.status_code != 200:
-        req.raise_for_status()
-    result = req.json()
-    print("Result: %s"% result)
-    if 'result' in result.keys() and 'success' in result.keys():
-        if result['success'] is True:
-            job_id = result['result']
-            print ('submitted upate ES:%s job: %s job_id: %s' % (job_type, release, job_id))
-        else:
-            print ('job not submitted successfully: %s' % result)
-            raise Exception('job not submitted successfully: %s' % result)
-    else:
-        raise Exception('job not submitted successfully: %s' % result)
 
 
+@metrics.instrument("cnm_r")
 def lambda_handler(event, context):
     """
     This lambda handler calls submit_job with the job type info
     and product id from the sns message
     :param event:
     :param context:
-    :return:
+    :return: for Kinesis and SQS events, the partial batch response listing
+    the records whose job could not be submitted
     """
     print ("Got event of type: %s" % type(event))
-    print ("Got event: %s" % json.dumps(event, indent=2))
+    print ("Got event: %s" % json_codec.dumps(event))
     print ("Got context: %s" % context)
 
     job_type = JOB_TYPE
@@ -100,39 +134,59 @@ def lambda_handler(event, context):
 
     event_trigger = EVENT_TRIGGER
     if event_trigger.lower() == "sns":
-        cnm_message = json.loads(event["Records"][0]["Sns"]["Message"])
+        with metrics.timed("EventParse"):
+            cnm_message = json_codec.loads(event["Records"][0]["Sns"]["Message"])
         print("Received message: {}".format(cnm_message))
         job_params["cnm_message"] = cnm_message
         product = cnm_message["collection"]
         identifier =  cnm_message.get("identifier", product)
         print("From CNM collection key: %s" % product)
         print("identifier : {}".format(identifier))
-        submit_job(job_type, job_release, product, job_tag, job_params, identifier)
+        submit_job(job_type, job_release, product, job_tag, job_params, identifier, context)
     elif event_trigger.lower() == "kinesis":
         # For Kinesis streams, we could be processing multiple messages
-        # in a single trigger.
+        # in a single trigger, so submit them all at once.
+        records = []
         for record in event['Records']:
             # Kinesis data is base64 encoded so decode here
-            payload = base64.b64decode(record["kinesis"]["data"])
+            with metrics.timed("EventParse"):
+                payload = base64.b64decode(record["kinesis"]["data"])
+                cnm_message = json_codec.loads(payload)
             print("Decoded payload: " + str(payload))
-            cnm_message = json.loads(payload)
             print("Received message: {}".format(cnm_message))
-            job_params["cnm_message"] = cnm_message
             product = cnm_message["collection"]
             identifier =  cnm_message.get("identifier", product)
             print("From CNM collection key: %s" % product)
             print("identifier : {}".format(identifier))
-            submit_job(job_type, job_release, product, job_tag, job_params, identifier)
+            records.append((product, identifier, dict(job_params, cnm_message=cnm_message)))
+        failed = submit_jobs(job_type, job_release, job_tag, records, context)
+        # requires ReportBatchItemFailures on the Kinesis event source mapping
+        return {"batchItemFailures": [
+            {"itemIdentifier": record["kinesis"]["sequenceNumber"]}
+            for record, record_failed in zip(event["Records"], failed) if record_failed
+        ]}
     elif event_trigger.lower() == "sqs":
+        # requires ReportBatchItemFailures on the SQS event source mapping
+        failures = []
         for event_record in event["Records"]:
-            body = json.loads(event_record["body"])
-            print("Body: {}".format(json.dumps(body, indent=2)))
+            if not retry.has_time(context):
+                print("Not enough time left, leaving message {} for redelivery".format(event_record["messageId"]))
+                failures.append({"itemIdentifier": event_record["messageId"]})
+                continue
+            with metrics.timed("EventParse"):
+                body = json_codec.loads(event_record["body"])
+            print("Body: {}".format(event_record["body"]))
             job_params["cnm_message"] = body
             product = body["collection"]
             identifier = body.get("identifier", product)
             print("CNM product: %s" % product)
             print("identifier : {}".format(identifier))
-            submit_job(job_type, job_release, product, job_tag, job_params, identifier)
+            try:
+                submit_job(job_type, job_release, product, job_tag, job_params, identifier, context)
+            except Exception as e:
+                print("Failed to submit job for message {}: {}".format(event_record["messageId"], repr(e)))
+                failures.append({"itemIdentifier": event_record["messageId"]})
+        return {"batchItemFailures": failures}
     else:
         raise RuntimeError(
             "EVENT_TRIGGER value not valid: {}. must be set to 'sns', 'sqs'"
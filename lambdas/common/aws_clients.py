@@ -0,0 +1,31 @@
+"""
+Lazily created boto3 clients, shared across records and warm invocations.
+
+Creating a client costs tens of milliseconds of credential and endpoint
+resolution, so each client is built once per container. boto3 clients are
+thread-safe once created, but creating them from the default session is not,
+so creation is serialized behind a lock.
+"""
+import threading
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def get_client(service_name):
+    """
+    Returns the cached boto3 client for the given service, creating it on
+    first use.
+
+    :param service_name: The AWS service name, e.g. "s3".
+    :return: The boto3 client.
+    """
+    client = _clients.get(service_name)
+    if client is None:
+        with _lock:
+            client = _clients.get(service_name)
+            if client is None:
+                # imported here to keep boto3 out of the cold start import path
+                import boto3
+                client = _clients[service_name] = boto3.client(service_name)
+    return client
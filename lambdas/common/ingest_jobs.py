@@ -0,0 +1,190 @@
+"""
+Builds the ingest-staged jobs submitted for files landing in the ISL bucket.
+
+Used by the isl lambda for S3 events delivered through SQS, and by
+event-misfire to resubmit files whose event never triggered an ingest. Reads
+the same environment as the isl lambda: SIGNAL_FILE_SUFFIX, MET_REQUIRED,
+DATASET_S3_ENDPOINT, and JOB_TYPES, JOB_TYPE, JOB_RELEASE and JOB_QUEUE
+through job_type_router.
+"""
+from __future__ import print_function
+
+import os
+from datetime import datetime
+
+import aws_clients
+import job_type_router
+import json_codec
+import metrics
+
+DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+
+_signal_file_suffix = None
+
+
+def get_signal_file_suffix():
+    """
+    Returns the SIGNAL_FILE_SUFFIX mapping of file type to signal file
+    extension, parsed once per container. None if it is not set.
+    """
+    global _signal_file_suffix
+    if _signal_file_suffix is None and "SIGNAL_FILE_SUFFIX" in os.environ:
+        _signal_file_suffix = json_codec.loads(os.environ["SIGNAL_FILE_SUFFIX"])
+    return _signal_file_suffix
+
+
+def triggers_ingest_job(key):
+    """
+    Returns False for the keys that do not trigger an ingest job of their
+    own, for which form_ingest_job returns None: the data files of the
+    MET_REQUIRED file type, which are ingested through their signal file.
+    """
+    file_type = key[: key.find("/")]
+    signal_file_suffix = (get_signal_file_suffix() or {}).get(file_type)
+    return not (signal_file_suffix is not None and file_type == os.environ["MET_REQUIRED"]
+                and not key.endswith(signal_file_suffix["ext"]))
+
+
+def parse_signal_file(bucket, filename):
+    obj = aws_clients.get_client("s3").get_object(Bucket=bucket, Key=filename)
+    body = obj["Body"].read().decode("utf-8").splitlines()
+    print("Signal File Body = {}".format(body))
+    arr = []
+    for line in body:
+        # remove empty line
+        if line:
+            arr.append(line)
+    return arr
+
+
+def get_group(file_name):
+    group = file_name.split("_")[8][1:]
+    return group
+
+
+def form_ingest_job(s3_record, trigger_record):
+    """
+    Builds the ingest job for an S3 object created event.
+    :param s3_record: The S3 event record.
+    :param trigger_record: The record that delivered the S3 event, kept in
+    the job metadata as SQS_record.
+    :return: The mozart_client.submit_job arguments: job_name, job_spec,
+    job_params, queue, tags and priority. None if the object does not
+    require an ingest job.
+    """
+    is_urgent_response = False
+    checksum = False
+    checksum_type = None
+    signal_ds_url = None
+    signal_file_suffix = get_signal_file_suffix()
+    s3_info = s3_record["s3"]
+    print("s3_info in message : %s " % s3_info)
+    # parse signal and dataset files and urls
+    bucket = s3_info["bucket"]["name"]
+    trigger_file = s3_info["object"]["key"]
+    # trigger_file has the prefix to know what kind of file is being ingested.
+    file_type = trigger_file[: trigger_file.find("/")]
+    print("Trigger file: {}".format(trigger_file))
+    s3obj_etag = s3_info["object"]["eTag"]
+    print("S3 eTag: {}".format(s3obj_etag))
+
+    metreq = os.environ["MET_REQUIRED"]
+
+    if signal_file_suffix.get(file_type) is None:
+        # this file type doesn't have an associated signal file
+        ds_file = trigger_file
+        if file_type == "tlm":
+            if get_group(trigger_file) == "01":
+                is_urgent_response = True
+            client = aws_clients.get_client("s3")
+            with metrics.timed("S3Read"):
+                res = client.head_object(Bucket=bucket, Key=ds_file)
+            checksum = res["Metadata"]["md5checksum"]
+            checksum_type = "md5"
+    else:
+        # this file type has a signal file
+        # set signal file url
+        signal_ds_url = "s3://%s/%s/%s" % (
+            os.environ["DATASET_S3_ENDPOINT"],
+            bucket,
+            trigger_file,
+        )
+        # handling .signal file in met_required/ directory
+        if file_type == metreq:
+            signal = signal_file_suffix[file_type]["ext"]
+            ds_file = trigger_file.replace(signal, "")
+            if trigger_file.endswith(signal):
+                print("has suffix {}".format(signal))
+            # not signal file suffix, so skip
+            else:
+                # don't submit ingest job if not triggered by signal file.
+                print(
+                    "Triggered by non-signal file {}. Aborting ingest job submission".format(
+                        trigger_file
+                    )
+                )
+                return None
+
+    if file_type != metreq:
+        ds_url = [
+            "s3://%s/%s/%s" % (os.environ["DATASET_S3_ENDPOINT"], bucket, ds_file)
+        ]
+        if signal_ds_url is not None:
+            ds_url.append(signal_ds_url)
+    else:
+        with metrics.timed("S3Read"):
+            file_list = parse_signal_file(bucket, trigger_file)
+        ds_url = []
+        isl_url = []
+        for f in file_list:
+            signal_ds_url = "s3://%s/%s/%s/%s" % (
+                os.environ["DATASET_S3_ENDPOINT"],
+                bucket,
+                file_type,
+                f,
+            )
+            ds_url.append(signal_ds_url)
+            isl_url.append(signal_ds_url)
+        # signal file
+        signal_file_url = "s3://%s/%s/%s" % (
+            os.environ["DATASET_S3_ENDPOINT"],
+            bucket,
+            trigger_file,
+        )
+        # add signal file to isl_url so it can be purged by the purge isl job
+        isl_url.append(signal_file_url)
+
+    print("ds_url = {}".format(ds_url))
+
+    # Create some metadata
+    md = {
+        "tags": ["ISL"],
+        "ISL_urls": isl_url if file_type == metreq else ds_url,
+        "restaged": True if file_type == metreq else False,
+        "SQS_record": trigger_record,
+        "S3_event_record": s3_record,
+        "Lambda_trigger_time": datetime.utcnow().strftime(DATETIME_FORMAT),
+    }
+
+    # data file
+    id = data_file = os.path.basename(ds_url[0])
+
+    # submit mozart jobs to update ES
+    job_type, job_release, queue = job_type_router.get_router().route(data_file)
+
+    return {
+        "job_name": "ingest-staged-{}".format(data_file),
+        "job_spec": "job-%s:%s" % (job_type, job_release),
+        "job_params": {
+            "id": id,
+            "data_url": ds_url,
+            "data_file": data_file,
+            "prod_met": md,
+            "checksum": checksum,
+            "checksum_type": checksum_type,
+            "payload_hash": s3obj_etag,
+        },
+        "queue": queue,
+        "tags": ["data-staged"],
+        "priority": 5 if is_urgent_response else 0,
+    }
@@ -0,0 +1,116 @@
+"""
+Routes ingested data files to the job type, release and queue configured in
+the JOB_TYPES environment variable.
+
+JOB_TYPES maps a job type to its PATTERN, RELEASE and QUEUE. A data file is
+routed to the first job type, in mapping order, whose PATTERN is found in the
+file name (re.search semantics). Files that match no pattern use the default
+job type, release and queue.
+
+All patterns are compiled once into a single regex. Each pattern becomes a
+lookahead anchored at the start of the file name, with an empty named group
+marking which pattern matched, so the alternation still honours the mapping
+order. If the patterns cannot be combined (they use numbered
+backreferences or global inline flags, which would change meaning once
+combined), each pattern is compiled separately and tried in order. Results
+are memoized per file name in an LRU cache.
+"""
+from __future__ import print_function
+
+import functools
+import json
+import os
+import re
+
+DEFAULT_CACHE_SIZE = 4096
+
+# constructs that would change meaning once the patterns are combined
+UNCOMBINABLE_RE = re.compile(r"\\[1-9]|\(\?[aiLmsux]+\)")
+
+_router = None
+
+
+class JobTypeRouter:
+    """
+    Matches data file names against the job type patterns
+    """
+
+    def __init__(self, job_types, default_type, default_release, default_queue, cache_size=DEFAULT_CACHE_SIZE):
+        """
+        :param job_types: A mapping of job types to a dict with PATTERN,
+        RELEASE and QUEUE.
+        :param default_type: Default job type.
+        :param default_release: Default job release version.
+        :param default_queue: Default job queue.
+        :param cache_size: Max number of file names to memoize.
+        """
+        self.job_types = job_types
+        self.default = (default_type, default_release, default_queue)
+        self._types = list(job_types.keys())
+        self._combined = None
+        self._patterns = None
+        try:
+            for job_type in self._types:
+                if UNCOMBINABLE_RE.search(job_types[job_type]["PATTERN"]):
+                    raise re.error("pattern of {} cannot be combined".format(job_type))
+            self._combined = re.compile("|".join(
+                "(?=.*?(?:{}))(?P<_t{}>)".format(job_types[job_type]["PATTERN"], i)
+                for i, job_type in enumerate(self._types)
+            ))
+        except re.error as e:
+            print("Could not combine job type patterns, matching them one at a time: {}".format(e))
+            self._patterns = [re.compile(job_types[job_type]["PATTERN"]) for job_type in self._types]
+        self._match = functools.lru_cache(maxsize=cache_size)(self._match_uncached)
+
+    def _match_uncached(self, data_file):
+        if self._combined is not None:
+            match = self._combined.match(data_file)
+            if match and match.lastgroup is not None:
+                return self._types[int(match.lastgroup[2:])]
+        else:
+            for job_type, pattern in zip(self._types, self._patterns):
+                if pattern.search(data_file):
+                    return job_type
+        return None
+
+    def route(self, data_file):
+        """
+        Determine the job type.
+        :param data_file: The data file being ingested.
+        :return: The (type, release, queue) of the first job type whose
+        pattern matches the data file, or the defaults if none match.
+        """
+        job_type = self._match(data_file)
+        if job_type is None:
+            print(
+                "Could not match data file '{}' to a given job type: {}. "
+                "Using default job type info".format(data_file, self._types)
+            )
+            return self.default
+
+        release = self.job_types[job_type]["RELEASE"]
+        queue = self.job_types[job_type]["QUEUE"]
+        print(
+            "Data file '{}' matches job type info: "
+            "type: {}, release: {}, queue: {}".format(data_file, job_type, release, queue)
+        )
+        return job_type, release, queue
+
+
+def get_router():
+    """
+    Returns the JobTypeRouter for the JOB_TYPES, JOB_TYPE, JOB_RELEASE and
+    JOB_QUEUE environment variables, built once per container.
+    """
+    global _router
+    if _router is None:
+        job_types = {}
+        if "JOB_TYPES" in os.environ:
+            job_types = json.loads(os.environ["JOB_TYPES"])
+        _router = JobTypeRouter(
+            job_types,
+            os.environ["JOB_TYPE"],  # e.g. "INGEST_L0A_LR_RAW"
+            os.environ["JOB_RELEASE"],  # e.g. "gman-dev"
+            os.environ["JOB_QUEUE"],
+        )
+    return _router
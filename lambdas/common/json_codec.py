@@ -0,0 +1,42 @@
+"""
+JSON encoding and decoding for job payloads and event bodies.
+
+orjson is used when it is installed in the Lambda package, and the standard
+library json module otherwise. Both paths produce compact UTF-8 JSON (no
+spaces after separators, non-ASCII characters left unescaped), so a payload
+serializes to the same text with either backend. Values orjson cannot
+serialize (e.g. dicts with non-str keys or integers over 64 bits) fall back
+to the standard library.
+
+Payloads should be serialized once and the resulting string reused for both
+logging and the request body.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the Lambda package
+    orjson = None
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+
+def dumps(obj):
+    """
+    Serializes obj to a compact JSON string.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj).decode("utf-8")
+        except TypeError:
+            pass
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
+
+
+def loads(s):
+    """
+    Deserializes a JSON document given as str or bytes.
+    """
+    if orjson is not None:
+        return orjson.loads(s)
+    return json.loads(s)
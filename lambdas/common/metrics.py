@@ -0,0 +1,148 @@
+"""
+Per-invocation stage timing emitted as CloudWatch Embedded Metric Format.
+
+Handlers are wrapped with the ``instrument`` decorator, which starts a fresh
+collection for every invocation and prints the collected metrics as EMF JSON
+log lines when the handler returns. CloudWatch turns those log lines into
+metrics, so no extra API calls are made.
+
+Stages are timed with ``timed``, and any other value can be recorded with
+``put_metric``. Every metric carries the ``LambdaName`` dimension. Metrics
+recorded with a job type also carry a ``JobType`` dimension.
+
+The namespace is taken from the METRICS_NAMESPACE environment variable
+(default "opera-sds-lambdas").
+"""
+from __future__ import print_function
+
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import json_codec
+
+NAMESPACE = os.environ.get("METRICS_NAMESPACE", "opera-sds-lambdas")
+
+# CloudWatch accepts at most 100 values per metric in a single EMF document
+MAX_VALUES_PER_METRIC = 100
+
+_lock = threading.Lock()
+_lambda_name = None
+_metrics = {}
+
+
+def start(lambda_name):
+    """
+    Starts a new collection of metrics, dropping anything not yet flushed.
+    """
+    global _lambda_name, _metrics
+    with _lock:
+        _lambda_name = lambda_name
+        _metrics = {}
+
+
+def put_metric(name, value, unit="Count", job_type=None):
+    """
+    Records a metric value for the current invocation. Nothing is recorded
+    outside an instrumented invocation.
+
+    :param name: The metric name.
+    :param value: The metric value.
+    :param unit: A CloudWatch unit, e.g. "Count" or "Milliseconds".
+    :param job_type: Optional value of the JobType dimension.
+    """
+    with _lock:
+        if _lambda_name is None:
+            return
+        group = _metrics.setdefault(job_type, {})
+        metric = group.setdefault(name, {"unit": unit, "values": []})
+        metric["values"].append(value)
+
+
+@contextmanager
+def timed(name, job_type=None):
+    """
+    Times the enclosed block and records it in milliseconds under name.
+    """
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        put_metric(name, (time.perf_counter() - start_time) * 1000, "Milliseconds", job_type)
+
+
+def to_emf():
+    """
+    Builds the EMF documents for the metrics recorded so far.
+
+    :return: A list of EMF documents, one per job type and chunk of at most
+    MAX_VALUES_PER_METRIC values per metric.
+    """
+    with _lock:
+        lambda_name = _lambda_name
+        metrics = {job_type: {name: dict(metric, values=list(metric["values"])) for name, metric in group.items()}
+                   for job_type, group in _metrics.items()}
+
+    timestamp = int(time.time() * 1000)
+    docs = []
+    for job_type, group in metrics.items():
+        dimensions = {"LambdaName": lambda_name}
+        if job_type is not None:
+            dimensions["JobType"] = job_type
+
+        chunks = max(len(metric["values"]) for metric in group.values())
+        for offset in range(0, chunks, MAX_VALUES_PER_METRIC):
+            doc = {
+                "_aws": {
+                    "Timestamp": timestamp,
+                    "CloudWatchMetrics": [{
+                        "Namespace": NAMESPACE,
+                        "Dimensions": [list(dimensions.keys())],
+                        "Metrics": [],
+                    }],
+                },
+            }
+            doc.update(dimensions)
+            for name, metric in group.items():
+                values = metric["values"][offset:offset + MAX_VALUES_PER_METRIC]
+                if not values:
+                    continue
+                doc["_aws"]["CloudWatchMetrics"][0]["Metrics"].append({"Name": name, "Unit": metric["unit"]})
+                doc[name] = values if len(values) > 1 else values[0]
+            docs.append(doc)
+    return docs
+
+
+def flush():
+    """
+    Prints the recorded metrics as EMF log lines and ends the collection.
+    """
+    global _lambda_name, _metrics
+    for doc in to_emf():
+        print(json_codec.dumps(doc))
+    with _lock:
+        _lambda_name = None
+        _metrics = {}
+
+
+def instrument(lambda_name):
+    """
+    Decorator for Lambda handlers. Collects metrics for each invocation,
+    times the whole invocation and flushes the metrics when it finishes.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            start(lambda_name)
+            try:
+                with timed("InvocationDuration"):
+                    return handler(event, context)
+            except Exception:
+                put_metric("InvocationErrors", 1)
+                raise
+            finally:
+                flush()
+        return wrapper
+    return decorator
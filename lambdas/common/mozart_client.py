@@ -0,0 +1,236 @@
+"""
+Shared client for submitting jobs to Mozart via its REST API.
+
+This module is packaged alongside lambda_function.py in every Lambda
+package (see the ``package`` command in each lambda's setup.py). The HTTP
+session is created once per container and reused across invocations, so
+warm Lambdas keep their connections to Mozart alive instead of paying a new
+TCP+TLS handshake on every submission.
+
+Tuning is done through the environment:
+    MOZART_POOL_SIZE        max connections kept open to Mozart (default 10)
+    MOZART_CONNECT_TIMEOUT  connect timeout in seconds (default 5)
+    MOZART_READ_TIMEOUT     read timeout in seconds (default 60)
+    MOZART_MAX_CONCURRENCY  max submissions in flight in submit_jobs
+                            (default MOZART_POOL_SIZE)
+"""
+from __future__ import print_function
+
+import os
+import threading
+
+import json_codec
+import metrics
+
+POOL_SIZE = int(os.environ.get("MOZART_POOL_SIZE", 10))
+CONNECT_TIMEOUT = float(os.environ.get("MOZART_CONNECT_TIMEOUT", 5))
+READ_TIMEOUT = float(os.environ.get("MOZART_READ_TIMEOUT", 60))
+MAX_CONCURRENCY = int(os.environ.get("MOZART_MAX_CONCURRENCY", POOL_SIZE))
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Returns the module-scoped requests session, creating it on first use.
+    Creation is serialized behind a lock, as submissions from thread pools
+    can race to create it on a cold container.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                # imported here to keep requests out of the cold start import path
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.verify = False
+                _session = session
+    return _session
+
+
+def get_job_type(job_spec):
+    """
+    Returns the job type of a job spec, e.g. "ingest" for "job-ingest:release".
+    """
+    job_type = job_spec.split(":")[0]
+    return job_type[len("job-"):] if job_type.startswith("job-") else job_type
+
+
+def form_submit_params(job_name, job_spec, job_params, queue, tags, priority=0, enable_dedup=None):
+    """
+    Builds the form data expected by Mozart's job submit endpoint.
+    """
+    params = {
+        "queue": queue,
+        "priority": priority,
+        "tags": json_codec.dumps(tags),
+        "type": job_spec,
+        "params": json_codec.dumps(job_params),
+        "name": job_name,
+    }
+    if enable_dedup is not None:
+        params["enable_dedup"] = enable_dedup
+    return params
+
+
+def parse_submit_response(req, job_spec):
+    """
+    Validates a Mozart job submit response and returns the job id.
+
+    :param req: The response returned by the job submit endpoint.
+    :param job_spec: The job spec that was submitted, used for logging.
+    :return: The id of the submitted job.
+    """
+    print("Request code: %s" % req.status_code)
+    print("Request text: %s" % req.text)
+
+    if req.status_code != 200:
+        req.raise_for_status()
+    result = req.json()
+    print("Request Result: %s" % result)
+
+    if "result" in result.keys() and "success" in result.keys():
+        if result["success"] is True:
+            job_id = result["result"]
+            print("submitted job: %s job_id: %s" % (job_spec, job_id))
+            return job_id
+        else:
+            print("job not submitted successfully: %s" % result)
+            raise Exception("job not submitted successfully: %s" % result)
+    else:
+        raise Exception("job not submitted successfully: %s" % result)
+
+
+def get_request_timeout(timeout=None):
+    """
+    Returns the (connect, read) timeout passed to requests. An explicit
+    timeout in seconds caps both the connect and the read timeout.
+    """
+    if timeout is None:
+        return CONNECT_TIMEOUT, READ_TIMEOUT
+    return min(CONNECT_TIMEOUT, timeout), min(READ_TIMEOUT, timeout)
+
+
+def submit_job(job_submit_url, job_name, job_spec, job_params, queue, tags, priority=0, enable_dedup=None,
+               timeout=None):
+    """
+    Submits a job to Mozart via REST API using the pooled session.
+
+    :param job_submit_url: Mozart job submit endpoint.
+    :param job_name: Name of the job.
+    :param job_spec: Job spec, e.g. "job-<type>:<release>".
+    :param job_params: Job parameters.
+    :param queue: Queue to submit the job to.
+    :param tags: List of tags for the job.
+    :param priority: Job priority.
+    :param enable_dedup: Optional value for Mozart's enable_dedup form field.
+    :param timeout: Optional timeout in seconds capping the connect and read
+    timeouts of the request. Defaults to MOZART_CONNECT_TIMEOUT and
+    MOZART_READ_TIMEOUT.
+    :return: The id of the submitted job.
+    """
+    params = form_submit_params(job_name, job_spec, job_params, queue, tags, priority, enable_dedup)
+
+    # the payload is already serialized in params, log it as is
+    print("Job params: %s" % ", ".join("%s=%s" % (key, value) for key, value in params.items()))
+    print("Job URL: %s" % job_submit_url)
+    job_type = get_job_type(job_spec)
+    try:
+        with metrics.timed("MozartSubmitLatency", job_type):
+            req = get_session().post(job_submit_url, data=params, timeout=get_request_timeout(timeout))
+        job_id = parse_submit_response(req, job_spec)
+    except Exception:
+        metrics.put_metric("JobSubmitFailures", 1, job_type=job_type)
+        raise
+    metrics.put_metric("JobsSubmitted", 1, job_type=job_type)
+    return job_id
+
+
+async def submit_job_async(job_submit_url, job_name, job_spec, job_params, queue, tags, priority=0,
+                           enable_dedup=None, executor=None, timeout=None):
+    """
+    Async counterpart of submit_job.
+
+    The request is sent on the pooled session from a worker thread, so
+    concurrent submissions share the same keep-alive connections.
+
+    The timeout is enforced by requests rather than by the event loop:
+    abandoning the await would leave the worker thread sending the request,
+    and a submission reported as failed could still create the job in Mozart.
+
+    :param executor: Executor to run the request in. Defaults to the event
+    loop's default executor.
+    :param timeout: Timeout in seconds for the request, see submit_job.
+    Raises requests.exceptions.Timeout when exceeded.
+    :return: The id of the submitted job.
+    """
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        executor,
+        lambda: submit_job(job_submit_url, job_name, job_spec, job_params, queue, tags, priority, enable_dedup,
+                           timeout)
+    )
+
+
+async def submit_jobs_async(job_submit_url, jobs, max_concurrency=None, timeout=None, rate_limit=None):
+    """
+    Submits many jobs concurrently, with at most max_concurrency submissions
+    in flight at a time and, optionally, at most rate_limit submissions
+    started per second.
+
+    :param job_submit_url: Mozart job submit endpoint.
+    :param jobs: List of dicts holding the keyword arguments of submit_job:
+    job_name, job_spec, job_params, queue, tags and optionally priority and
+    enable_dedup.
+    :param max_concurrency: Max submissions in flight. Defaults to
+    MAX_CONCURRENCY.
+    :param timeout: Per-submission request timeout in seconds, see submit_job.
+    :param rate_limit: Max submissions started per second. Unlimited by
+    default.
+    :return: A list aligned with jobs holding a dict with the submitted
+    "job_id" and the "error" raised by the submission, if any.
+    """
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+
+    max_concurrency = max_concurrency or MAX_CONCURRENCY
+    semaphore = asyncio.Semaphore(max_concurrency)
+    loop = asyncio.get_running_loop()
+    # start times are handed out in submission order, 1 / rate_limit apart
+    interval = 1.0 / rate_limit if rate_limit else 0
+    next_start = [loop.time()]
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        async def submit(job):
+            if interval:
+                start_time = max(loop.time(), next_start[0])
+                next_start[0] = start_time + interval
+                await asyncio.sleep(start_time - loop.time())
+            async with semaphore:
+                try:
+                    job_id = await submit_job_async(job_submit_url, executor=executor, timeout=timeout, **job)
+                    return {"job_id": job_id, "error": None}
+                except Exception as e:
+                    print("Failed to submit job %s: %s" % (job["job_name"], repr(e)))
+                    return {"job_id": None, "error": e}
+
+        return await asyncio.gather(*[submit(job) for job in jobs])
+
+
+def submit_jobs(job_submit_url, jobs, max_concurrency=None, timeout=None, rate_limit=None):
+    """
+    Blocking entry point for submit_jobs_async, for use from Lambda handlers.
+    """
+    import asyncio
+
+    if not jobs:
+        return []
+    return asyncio.run(submit_jobs_async(job_submit_url, jobs, max_concurrency, timeout, rate_limit))
@@ -0,0 +1,85 @@
+"""
+Retries with exponential backoff, bounded by the time left in the Lambda
+invocation.
+
+A retry is only attempted when the remaining time, as reported by
+``context.get_remaining_time_in_millis()``, can fit the backoff wait plus
+the longest attempt seen so far, while keeping RETRY_RESERVE_MS (default
+2000) in reserve for the handler to report its results. Otherwise the call
+gives up with DeadlineExceeded, so the handler can record what it finished
+instead of being killed mid-batch.
+
+Backoff follows backoff.expo with full jitter: the n-th wait is drawn
+uniformly from [0, min(max_value, 2 ** (n - 1))] seconds.
+"""
+from __future__ import print_function
+
+import os
+import random
+import time
+
+RESERVE_MS = int(os.environ.get("RETRY_RESERVE_MS", 2000))
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised when the invocation does not have enough time left for another
+    attempt.
+    """
+
+
+def remaining_ms(context):
+    """
+    Returns the milliseconds left in the invocation, or None when there is no
+    Lambda context (e.g. when run locally).
+    """
+    if context is None:
+        return None
+    return context.get_remaining_time_in_millis()
+
+
+def has_time(context, needed_ms=0, reserve_ms=RESERVE_MS):
+    """
+    Returns True if the invocation can spend needed_ms and still keep
+    reserve_ms in reserve.
+    """
+    remaining = remaining_ms(context)
+    return remaining is None or remaining - reserve_ms >= needed_ms
+
+
+def call(func, context, retry_on=Exception, giveup=None, max_tries=8, max_value=32, reserve_ms=RESERVE_MS,
+         sleep=time.sleep):
+    """
+    Calls func, retrying failures while the invocation has time left.
+
+    :param func: Callable taking no arguments.
+    :param context: The Lambda context, or None for no deadline.
+    :param retry_on: Exception type, or tuple of types, to retry on.
+    :param giveup: Optional predicate; exceptions for which it returns True
+    are raised without retrying.
+    :param max_tries: Max number of attempts.
+    :param max_value: Max backoff wait in seconds.
+    :param reserve_ms: Time to keep in reserve for the handler.
+    :param sleep: Function used to wait between attempts.
+    :return: The value returned by func.
+    :raises DeadlineExceeded: If there is not enough time left to start the
+    first attempt or to retry. The last failure, if any, is chained.
+    """
+    if not has_time(context, 0, reserve_ms):
+        raise DeadlineExceeded("Not enough time left to call %s" % getattr(func, "__name__", func))
+
+    longest_ms = 0
+    for attempt in range(1, max_tries + 1):
+        start_time = time.perf_counter()
+        try:
+            return func()
+        except retry_on as e:
+            longest_ms = max(longest_ms, (time.perf_counter() - start_time) * 1000)
+            if (giveup is not None and giveup(e)) or attempt == max_tries:
+                raise
+            wait = random.uniform(0, min(max_value, 2 ** (attempt - 1)))
+            if not has_time(context, wait * 1000 + longest_ms, reserve_ms):
+                print("Giving up after attempt %d, not enough time left to retry: %s" % (attempt, repr(e)))
+                raise DeadlineExceeded("Not enough time left to retry after %d attempts" % attempt) from e
+            print("Attempt %d failed, retrying in %.1fs: %s" % (attempt, wait, repr(e)))
+            sleep(wait)
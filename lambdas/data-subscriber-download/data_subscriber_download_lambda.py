@@ -4,7 +4,8 @@ import json
 import os
 from datetime import datetime
 
-import requests
+import metrics
+import mozart_client
 
 DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
 JOB_NAME_DATETIME_FORMAT = "%Y%m%dT%H%M%S"
@@ -28,42 +29,10 @@ def convert_datetime(datetime_obj, strformat=DATETIME_FORMAT):
 
 def submit_job(job_name, job_spec, job_params, queue, tags, priority=0):
     """Submit job to mozart via REST API."""
-
-    # setup params
-    params = {
-        "queue": queue,
-        "priority": priority,
-        "tags": json.dumps(tags),
-        "type": job_spec,
-        "params": json.dumps(job_params),
-        "name": job_name,
-    }
-
-    # submit job
-    print("Job params: %s" % json.dumps(params))
-    print("Job URL: %s" % JOB_SUBMIT_URL)
-    req = requests.post(JOB_SUBMIT_URL, data=params, verify=False)
-
-    print("Request code: %s" % req.status_code)
-    print("Request text: %s" % req.text)
-
-    if req.status_code != 200:
-        req.raise_for_status()
-    result = req.json()
-    print("Request Result: %s" % result)
-
-    if "result" in result.keys() and "success" in result.keys():
-        if result["success"] is True:
-            job_id = result["result"]
-            print("submitted job: %s job_id: %s" % (job_spec, job_id))
-            return job_id
-        else:
-            print("job not submitted successfully: %s" % result)
-            raise Exception("job not submitted successfully: %s" % result)
-    else:
-        raise Exception("job not submitted successfully: %s" % result)
+    return mozart_client.submit_job(JOB_SUBMIT_URL, job_name, job_spec, job_params, queue, tags, priority)
 
 
+@metrics.instrument("data-subscriber-download")
 def lambda_handler(event, context):
     """
     This lambda handler calls submit_job with the job type info
@@ -5,14 +5,13 @@ import logging
 import os
 import re
 from datetime import datetime
-from distutils.util import strtobool
-from typing import Dict
+from typing import TYPE_CHECKING, Dict
 
-import dateutil.parser
-import requests
-from aws_lambda_powertools.utilities.data_classes import EventBridgeEvent
-from aws_lambda_powertools.utilities.typing import LambdaContext
-from dateutil.relativedelta import relativedelta
+import metrics
+import mozart_client
+
+if TYPE_CHECKING:
+    from aws_lambda_powertools.utilities.typing import LambdaContext
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -28,43 +27,31 @@ MOZART_URL = os.environ["MOZART_URL"]
 JOB_SUBMIT_URL = f"{MOZART_URL}/api/v0.1/job/submit?enable_dedup=false"
 
 
+def strtobool(val):
+    """
+    Converts a string representation of truth to True or False, as
+    distutils.util.strtobool did. Importing distutils costs more than 100 ms
+    of cold start, and it is removed in Python 3.12.
+    """
+    val = val.lower()
+    if val in ("y", "yes", "t", "true", "on", "1"):
+        return True
+    if val in ("n", "no", "f", "false", "off", "0"):
+        return False
+    raise ValueError("invalid truth value %r" % (val,))
+
+
 def submit_job(job_name, job_spec, job_params, queue, tags, priority=0):
     """Submit job to mozart via REST API."""
+    return mozart_client.submit_job(JOB_SUBMIT_URL, job_name, job_spec, job_params, queue, tags, priority)
 
-    # setup params
-    params = {
-        "queue": queue,
-        "priority": priority,
-        "tags": json.dumps(tags),
-        "type": job_spec,
-        "params": json.dumps(job_params),
-        "name": job_name,
-    }
-
-    # submit job
-    logger.info(f"Job params: {json.dumps(params)}")
-    logger.info(f"Job URL: {JOB_SUBMIT_URL}")
-    req = requests.post(JOB_SUBMIT_URL, data=params, verify=False)
-
-    logger.info(f"Request code: {req.status_code}")
-    logger.info(f"Request text: {req.text}")
-
-    req.raise_for_status()
-    result = req.json()
-    logger.info(f"Request Result: {result}")
-
-    if "result" in result.keys() and "success" in result.keys():
-        if result["success"] is True:
-            job_id = result["result"]
-            logger.info(f"submitted job: {job_spec} job_id: {job_id}")
-            return job_id
-        else:
-            logger.info(f"job not submitted successfully: {result}")
-            raise Exception(f"job not submitted successfully: {result}")
-    else:
-        raise Exception(f"job not submitted successfully: {result}")
 
 def _create_job(event: Dict):
+    # imported here to keep them out of the cold start import path
+    import dateutil.parser
+    from aws_lambda_powertools.utilities.data_classes import EventBridgeEvent
+    from dateutil.relativedelta import relativedelta
+
     event = EventBridgeEvent(event)
 
     query_end_datetime = dateutil.parser.isoparse(event.time)
@@ -146,7 +133,8 @@ def _create_job(event: Dict):
 
     return job_name, job_spec, job_params, queue, tags
 
-def lambda_handler(event: Dict, context: LambdaContext):
+@metrics.instrument("data-subscriber-query")
+def lambda_handler(event: Dict, context: "LambdaContext"):
     """
     This lambda handler calls submit_job with the job type info
     and dataset_type set in the environment
@@ -164,6 +152,8 @@ def lambda_handler(event: Dict, context: LambdaContext):
 
 
 def get_temporal_start_datetime(query_end_datetime):
+    from dateutil.relativedelta import relativedelta
+
     try:
         temporal_start_datetime_margin_days = os.environ.get("TEMPORAL_START_DATETIME_MARGIN_DAYS", "")
         temporal_start_datetime = (query_end_datetime - relativedelta(days=int(temporal_start_datetime_margin_days))).strftime(DATETIME_FORMAT)
@@ -1,12 +1,16 @@
 from __future__ import print_function
 
-import os, sys, re, json, requests, boto3
+import os, sys, re, json
 from datetime import tzinfo, timedelta, datetime, timezone
 import logging
 import ntpath
-import elasticsearch
 import traceback
-from time import time
+from time import perf_counter, time
+
+import aws_clients
+import json_codec
+import metrics
+import retry
 '''
 log_format = "[%(asctime)s: %(levelname)s/%(funcName)s] %(message)s"
 logging.basicConfig(format=log_format, level=logging.INFO)
@@ -23,119 +27,552 @@ if "MOZART_ES_URL" not in os.environ:
     raise RuntimeError("Need to specify MOZART_ES_URL in environment.")
 
 MOZART_ES_URL = os.environ["MOZART_ES_URL"]
+# max number of files looked up in a single ES multi-search request
+ES_MSEARCH_BATCH_SIZE = int(os.environ.get("ES_MSEARCH_BATCH_SIZE", 100))
+# number of threads listing the bucket's top-level prefixes, 1 lists the bucket sequentially
+S3_LIST_WORKERS = int(os.environ.get("S3_LIST_WORKERS", 1))
+# time kept in reserve to finish the current batch and save the scan cursor
+SCAN_TIME_RESERVE_MS = int(os.environ.get("SCAN_TIME_RESERVE_MS", 10000))
+# optional bucket holding the scan state, so scans resume across containers.
+# Without it the state is only kept in /tmp by warm containers.
+STATE_BUCKET = os.environ.get("STATE_BUCKET")
+STATE_PREFIX = os.environ.get("STATE_PREFIX", "event-misfire/")
+STATE_DIR = "/tmp"
+SCAN_STATE_NAME = "scan_state.json"
+# files found to have an ingest job are not looked up again for this long,
+# as long as their ETag does not change
+VERIFIED_CACHE_TTL_SECONDS = int(os.environ.get("VERIFIED_CACHE_TTL_SECONDS", 86400))
+VERIFIED_CACHE_NAME = "verified_files.json"
+# max metrics in a single put_metric_data call
+MAX_METRIC_DATA = 1000
+# opt-in resubmission of the ingest job of missed files, which requires the
+# isl lambda's environment (MOZART_URL, SIGNAL_FILE_SUFFIX, MET_REQUIRED,
+# DATASET_S3_ENDPOINT, JOB_TYPE, JOB_RELEASE, JOB_QUEUE and JOB_TYPES)
+REINGEST_MISSED_FILES = os.environ.get("REINGEST_MISSED_FILES", "false").lower() == "true"
+REINGEST_MAX_CONCURRENCY = int(os.environ.get("REINGEST_MAX_CONCURRENCY", 5))
+# max ingest jobs submitted per second
+REINGEST_RATE_LIMIT = float(os.environ.get("REINGEST_RATE_LIMIT", 10))
 event_misfire_delay_threshold_second = int(os.environ["DELAY_THRESHOLD"])
 event_misfire_metric_name = os.environ["E_MISFIRE_METRIC_ALARM_NAME"]
 
-def send_cloudwatch_alarm(missed_file_count):
-    import boto3
+_es = None
+
+def new_statistic_set():
+    return {"SampleCount": 0, "Sum": 0.0, "Minimum": None, "Maximum": None}
+
+
+def add_sample(statistic_set, value):
+    """
+    Adds a value to a CloudWatch statistic set.
+    """
+    statistic_set["SampleCount"] += 1
+    statistic_set["Sum"] += value
+    if statistic_set["Minimum"] is None or value < statistic_set["Minimum"]:
+        statistic_set["Minimum"] = value
+    if statistic_set["Maximum"] is None or value > statistic_set["Maximum"]:
+        statistic_set["Maximum"] = value
+
+
+def new_scan_stats():
+    """
+    Returns the statistics accumulated over a scan of the bucket, published
+    with NumberOfMissedFiles once the scan completes.
+    """
+    return {
+        "candidate_count": 0,
+        # files whose ES lookup failed, neither counted as missed nor reingested
+        "lookup_failure_count": 0,
+        # missed files that do not trigger an ingest job of their own, so cannot be reingested
+        "not_reingestable_count": 0,
+        # age of the stale files in seconds, its Maximum is the oldest file
+        "stale_file_age": new_statistic_set(),
+        "es_lookup_latency": new_statistic_set(),
+        "missed_by_file_type": {},
+    }
+
+
+def get_file_type(key):
+    """
+    Returns the top-level prefix of a key, "root" for keys without one.
+    """
+    return key[: key.find("/")] if "/" in key else "root"
 
+
+def send_cloudwatch_alarm(missed_file_count, stats=None):
+    """
+    Publishes NumberOfMissedFiles, plus the scan statistics if given, in a
+    single put_metric_data call (more only if there are over
+    MAX_METRIC_DATA metrics).
+    """
     # Create CloudWatch client
-    cloudwatch = boto3.client('cloudwatch')
+    cloudwatch = aws_clients.get_client('cloudwatch')
 
-    response = cloudwatch.put_metric_data(
-    MetricData = [
+    dimensions = [
+        {
+            'Name': 'LAMBDA_NAME',
+            'Value': 'event-misfire_lambda'
+        },
+        {
+            'Name': 'E_MISFIRE_METRIC_ALARM_NAME',
+            'Value': event_misfire_metric_name
+        },
+    ]
+    metric_data = [
         {
             'MetricName': 'NumberOfMissedFiles',
-            'Dimensions': [
-                {
-                    'Name': 'LAMBDA_NAME',
-                    'Value': 'event-misfire_lambda'
-                },
-                {
-                    'Name': 'E_MISFIRE_METRIC_ALARM_NAME',
-                    'Value': event_misfire_metric_name
-                },
-            ],
+            'Dimensions': dimensions,
             'Unit': 'Count',
             'Value': missed_file_count
         },
-    ],
-    Namespace='AWS/Lambda'
-)
+    ]
+    if stats is not None:
+        metric_data.append({
+            'MetricName': 'NumberOfCandidateFiles',
+            'Dimensions': dimensions,
+            'Unit': 'Count',
+            'Value': stats["candidate_count"]
+        })
+        metric_data.append({
+            'MetricName': 'NumberOfUnverifiedFiles',
+            'Dimensions': dimensions,
+            'Unit': 'Count',
+            'Value': stats.get("lookup_failure_count", 0)
+        })
+        metric_data.append({
+            'MetricName': 'NumberOfNotReingestableFiles',
+            'Dimensions': dimensions,
+            'Unit': 'Count',
+            'Value': stats.get("not_reingestable_count", 0)
+        })
+        for metric_name, key, unit in (('StaleFileAge', 'stale_file_age', 'Seconds'),
+                                       ('ESLookupLatency', 'es_lookup_latency', 'Milliseconds')):
+            if stats[key]["SampleCount"] > 0:
+                metric_data.append({
+                    'MetricName': metric_name,
+                    'Dimensions': dimensions,
+                    'Unit': unit,
+                    'StatisticValues': stats[key]
+                })
+        for file_type, count in sorted(stats["missed_by_file_type"].items()):
+            metric_data.append({
+                'MetricName': 'NumberOfMissedFiles',
+                'Dimensions': dimensions + [{'Name': 'FILE_TYPE', 'Value': file_type}],
+                'Unit': 'Count',
+                'Value': count
+            })
+
+    for i in range(0, len(metric_data), MAX_METRIC_DATA):
+        cloudwatch.put_metric_data(MetricData=metric_data[i:i + MAX_METRIC_DATA], Namespace='AWS/Lambda')
+
 
-def get_s3_files(bucket_name, pref=""):
-    s3 = boto3.client('s3')
+def iter_stale_pages(bucket_name, older_than, pref="", start_after=""):
+    """
+    Lists the objects under pref that were last modified before older_than.
+    Objects are filtered as each listing page arrives, so only the current
+    page is held in memory.
 
+    :param bucket_name: The bucket to list.
+    :param older_than: Objects last modified at or after this time are
+    skipped.
+    :param pref: The key prefix to list.
+    :param start_after: Only keys after this one are listed.
+    :return: A generator of (last listed key, matching objects) for each
+    listing page, in key order. Objects are as returned by list_objects_v2.
+    """
+    s3 = aws_clients.get_client('s3')
+
+    paginator = s3.get_paginator('list_objects_v2')
+    kwargs = {"Bucket": bucket_name, "Prefix": pref}
+    if start_after:
+        kwargs["StartAfter"] = start_after
+    pages = iter(paginator.paginate(**kwargs))
+
+    while True:
+        with metrics.timed("S3List"):
+            page = next(pages, None)
+        if page is None:
+            return
+        contents = page.get('Contents', [])
+        if contents:
+            yield contents[-1]['Key'], [
+                obj for obj in contents
+                if not obj['Key'].endswith("/") and obj['LastModified'] < older_than
+            ]
+
+
+def iter_stale_pages_by_prefix(bucket_name, older_than, workers, start_after=""):
+    """
+    Same as iter_stale_pages for the whole bucket, but lists each top-level
+    prefix in a thread pool of the given size. Pages are still yielded in
+    key order. At most workers prefixes are listed ahead of the one being
+    consumed, and their stale objects are held in memory until it is. When
+    the generator is closed early, prefixes not started yet are cancelled
+    and the ones being listed stop after their current page.
+    """
+    s3 = aws_clients.get_client('s3')
+
+    prefixes = []
+    root_objects = []
     paginator = s3.get_paginator('list_objects_v2')
-    pages = paginator.paginate(Bucket=bucket_name, Prefix=pref)
-
-    sorted_objects_dict = {}
-
-    for page in pages:
-        count = page['KeyCount']
-        if count>0:
-            for obj in page['Contents']:
-                if not obj['Key'].endswith("/"):
-                    sorted_objects_dict[obj['Key']] = obj['LastModified']
-
-    return sorted_objects_dict
-
-def get_job_info(file_name):
-    no_of_jobs = 0
-    ES = elasticsearch.Elasticsearch(MOZART_ES_URL)
-
-    job_id = "ingest-staged-{}-*".format(file_name)
-    query = { 
-      "query": {
-        "wildcard": {
-          "job_id": {
-            "value": job_id
-          }
-        }
-      }
-    }    
-    es_header = {"Content-Type": "application/json"}
-    q = json.dumps(query)
-    print(q)
+    with metrics.timed("S3List"):
+        for page in paginator.paginate(Bucket=bucket_name, Delimiter="/"):
+            prefixes.extend(p['Prefix'] for p in page.get('CommonPrefixes', []))
+            root_objects.extend(page.get('Contents', []))
+
+    # keys sort after the prefix of their folder and before any later one, so
+    # merging root keys and prefixes by name keeps the bucket's key order
+    units = sorted([(prefix, None) for prefix in prefixes] + [(obj['Key'], obj) for obj in root_objects],
+                   key=lambda unit: unit[0])
+    units = [
+        (name, obj) for name, obj in units
+        if name > start_after or (obj is None and start_after.startswith(name))
+    ]
+    prefixes = iter([name for name, obj in units if obj is None])
+
+    # imported here, as the thread pool is only used when S3_LIST_WORKERS is set
+    import threading
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor
+
+    closed = threading.Event()
+
+    def list_prefix(prefix):
+        pages = []
+        for page in iter_stale_pages(bucket_name, older_than, prefix,
+                                     start_after if start_after.startswith(prefix) else ""):
+            if closed.is_set():
+                break
+            pages.append(page)
+        return pages
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    listings = deque()
+
+    def list_ahead():
+        while len(listings) < workers:
+            prefix = next(prefixes, None)
+            if prefix is None:
+                return
+            listings.append(executor.submit(list_prefix, prefix))
+
+    try:
+        list_ahead()
+        for name, obj in units:
+            if obj is None:
+                listing = listings.popleft()
+                list_ahead()
+                yield from listing.result()
+            elif not name.endswith("/"):
+                yield name, [obj] if obj['LastModified'] < older_than else []
+    finally:
+        # shutdown(cancel_futures=True) needs Python 3.9
+        closed.set()
+        for listing in listings:
+            listing.cancel()
+        executor.shutdown(wait=True)
+
+
+def load_state(name, default, local_first=False):
+    """
+    Loads a JSON state document from STATE_BUCKET if set, otherwise from
+    STATE_DIR.
+
+    :param name: The document name.
+    :param default: Returned when the document does not exist or cannot be
+    read.
+    :param local_first: Read the copy in STATE_DIR first, as left by a warm
+    container, and only fall back to STATE_BUCKET when there is none.
+    """
+    path = os.path.join(STATE_DIR, name)
     try:
-        result = ES.search(index="job_status-current", body=q) 
-        no_of_jobs = len(result["hits"]["hits"])
+        if STATE_BUCKET and not (local_first and os.path.exists(path)):
+            obj = aws_clients.get_client('s3').get_object(Bucket=STATE_BUCKET, Key=STATE_PREFIX + name)
+            return json_codec.loads(obj['Body'].read())
+        with open(path) as f:
+            return json_codec.loads(f.read())
     except Exception as err:
-        print("ERROR Searching for job : {}".format(str(err)))
-    print(no_of_jobs)
-    if no_of_jobs>0:
-        print(result["hits"]["hits"][0])
-    return no_of_jobs
-    
+        print("Could not load state {}, starting from defaults: {}".format(name, str(err)))
+        return default
 
-def lambda_handler(event, context):
-    s3_files = {}
+
+def save_state(name, state):
+    """
+    Saves a JSON state document to STATE_DIR and, if set, to STATE_BUCKET.
+    """
+    body = json_codec.dumps(state)
+    with open(os.path.join(STATE_DIR, name), "w") as f:
+        f.write(body)
+    if STATE_BUCKET:
+        aws_clients.get_client('s3').put_object(Bucket=STATE_BUCKET, Key=STATE_PREFIX + name, Body=body.encode("utf-8"))
+
+
+def get_es():
+    """
+    Returns the module-scoped Elasticsearch client for MOZART_ES_URL, creating
+    it on first use.
+    """
+    global _es
+    if _es is None:
+        # imported here to keep elasticsearch out of the cold start import path
+        import elasticsearch
+
+        _es = elasticsearch.Elasticsearch(MOZART_ES_URL)
+    return _es
+
+
+def get_job_counts(file_names):
+    """
+    Looks up the ingest jobs of many files with one multi-search request per
+    ES_MSEARCH_BATCH_SIZE files.
+
+    A file has an ingest job if a job_id in job_status-current starts with
+    "ingest-staged-<base name>-", as ISL names ingest jobs after the base
+    name of the object key. Each search only counts up to the first hit,
+    since only the existence of a job matters.
+
+    :param file_names: The object keys to look up.
+    :return: A mapping of each file name to the number of jobs found, 0 or 1,
+    or None if its search failed and it is not known whether it has a job.
+    """
+    job_counts = {}
+    file_names = list(file_names)
+    for i in range(0, len(file_names), ES_MSEARCH_BATCH_SIZE):
+        batch = file_names[i:i + ES_MSEARCH_BATCH_SIZE]
+        body = []
+        for file_name in batch:
+            body.append({"index": "job_status-current"})
+            body.append({
+                "size": 0,
+                "terminate_after": 1,
+                "query": {"prefix": {"job_id": "ingest-staged-{}-".format(os.path.basename(file_name))}},
+            })
+        try:
+            responses = get_es().msearch(body=body)["responses"]
+        except Exception as err:
+            print("ERROR Searching for jobs of {} files: {}".format(len(batch), str(err)))
+            responses = [{"error": str(err)}] * len(batch)
+
+        for file_name, response in zip(batch, responses):
+            if "error" in response:
+                print("ERROR Searching for job of {}: {}".format(file_name, response["error"]))
+                job_counts[file_name] = None
+                continue
+            total = response["hits"]["total"]
+            job_counts[file_name] = total["value"] if isinstance(total, dict) else total
+    return job_counts
+
+
+def load_verified_cache(now):
+    """
+    Loads the verified-file cache, dropping entries older than
+    VERIFIED_CACHE_TTL_SECONDS.
+
+    :param now: The current time, as seconds since the epoch.
+    :return: A mapping of object key to [ETag, time verified].
+    """
+    cache = load_state(VERIFIED_CACHE_NAME, {}, local_first=True)
+    return {key: entry for key, entry in cache.items() if now - entry[1] < VERIFIED_CACHE_TTL_SECONDS}
+
+
+def check_files(objects, verified=None, stats=None):
+    """
+    Returns the keys of the objects that have no ingest job. Objects whose
+    lookup failed are not returned, they are checked again on the next scan.
+
+    :param objects: The objects to check, as returned by list_objects_v2.
+    :param verified: Optional verified-file cache, see load_verified_cache.
+    Objects whose key and ETag are in the cache are not looked up, and
+    objects found to have a job are added to it.
+    :param stats: Optional scan statistics, see new_scan_stats, to record
+    the ES lookup latency, failed lookups and missed files in.
+    """
+    if verified is None:
+        verified = {}
+    for obj in objects:
+        print("{} was last modified at {}".format(obj['Key'], obj['LastModified']))
+    unverified = [obj for obj in objects if verified.get(obj['Key'], [None])[0] != obj['ETag']]
+    metrics.put_metric("VerifiedCacheHits", len(objects) - len(unverified))
+    if not unverified:
+        return []
+
+    start_time = perf_counter()
+    with metrics.timed("ESQuery"):
+        job_counts = get_job_counts([obj['Key'] for obj in unverified])
+    if stats is not None:
+        add_sample(stats["es_lookup_latency"], (perf_counter() - start_time) * 1000)
+    verified_at = time()
     missed_files = []
- 
-    #check if there any file left in signal_file_bucket
-    s3_files = get_s3_files(signal_file_bucket)
+    lookup_failures = 0
+    for obj in unverified:
+        key = obj['Key']
+        if job_counts[key] is None:
+            print("Could not look up the job of {}, checking it on the next scan".format(key))
+            lookup_failures += 1
+        elif job_counts[key]>0:
+            print("Job Found for {}, No action Required".format(key))
+            verified[key] = [obj['ETag'], verified_at]
+        else:
+            print("No Job Found for {}. Submit Alert".format(key))
+            missed_files.append(key)
+            if stats is not None:
+                file_type = get_file_type(key)
+                stats["missed_by_file_type"][file_type] = stats["missed_by_file_type"].get(file_type, 0) + 1
+    metrics.put_metric("ESLookupFailures", lookup_failures)
+    if stats is not None:
+        stats["lookup_failure_count"] = stats.get("lookup_failure_count", 0) + lookup_failures
+    return missed_files
+
+
+def to_s3_record(bucket_name, obj):
+    """
+    Builds the S3 object created event record ISL would have received for a
+    listed object.
+    """
+    return {
+        "eventSource": "aws:s3",
+        "eventName": "ObjectCreated:Put",
+        "eventTime": obj['LastModified'].strftime(DATETIME_FORMAT),
+        "s3": {
+            "bucket": {"name": bucket_name},
+            "object": {"key": obj['Key'], "eTag": obj['ETag'].strip('"'), "size": obj.get('Size')},
+        },
+    }
+
+
+def reingest_files(objects, verified):
+    """
+    Submits the ingest job ISL would have submitted for each object, at most
+    REINGEST_MAX_CONCURRENCY at a time and REINGEST_RATE_LIMIT per second.
+    Resubmitted objects are added to the verified-file cache, so they are not
+    resubmitted while their job runs.
+
+    :param objects: The missed objects, as returned by list_objects_v2.
+    :param verified: The verified-file cache, see load_verified_cache.
+    :return: The number of jobs submitted.
+    """
+    # imported here to keep them out of the cold start import path, they are only needed with REINGEST_MISSED_FILES
+    import ingest_jobs
+    import mozart_client
+
+    jobs = []
+    submitted_objects = []
+    for obj in objects:
+        try:
+            job = ingest_jobs.form_ingest_job(to_s3_record(signal_file_bucket, obj), None)
+        except Exception as err:
+            print("ERROR Forming ingest job for {}: {}".format(obj['Key'], str(err)))
+            metrics.put_metric("ReingestFailures", 1)
+            continue
+        if job is not None:
+            jobs.append(job)
+            submitted_objects.append(obj)
+
+    job_submit_url = "%s/api/v0.1/job/submit" % os.environ["MOZART_URL"]
+    results = mozart_client.submit_jobs(job_submit_url, jobs, max_concurrency=REINGEST_MAX_CONCURRENCY,
+                                        rate_limit=REINGEST_RATE_LIMIT)
+    submitted_at = time()
+    submitted = 0
+    for obj, result in zip(submitted_objects, results):
+        if result["error"] is None:
+            print("Resubmitted ingest of {} as job {}".format(obj['Key'], result["job_id"]))
+            verified[obj['Key']] = [obj['ETag'], submitted_at]
+            submitted += 1
+        else:
+            metrics.put_metric("ReingestFailures", 1)
+    metrics.put_metric("FilesReingested", submitted)
+    return submitted
+
+
+def process_batch(objects, verified, stats=None):
+    """
+    Checks a batch of stale objects and, if REINGEST_MISSED_FILES is set,
+    resubmits the ingest of the missed ones. Missed files that do not trigger
+    an ingest job of their own, e.g. met_required data files, are not
+    resubmitted and are counted in the not_reingestable_count statistic.
+
+    :return: The keys of the objects that have no ingest job.
+    """
+    missed_files = check_files(objects, verified, stats)
+    if REINGEST_MISSED_FILES and missed_files:
+        # imported here to keep it out of the cold start import path, it is only needed with REINGEST_MISSED_FILES
+        import ingest_jobs
+
+        missed = set(missed_files)
+        reingestable = []
+        for obj in objects:
+            if obj['Key'] not in missed:
+                continue
+            if ingest_jobs.triggers_ingest_job(obj['Key']):
+                reingestable.append(obj)
+            else:
+                print("{} does not trigger an ingest job of its own, not resubmitting it".format(obj['Key']))
+                if stats is not None:
+                    stats["not_reingestable_count"] = stats.get("not_reingestable_count", 0) + 1
+        if reingestable:
+            reingest_files(reingestable, verified)
+    return missed_files
+
+
+@metrics.instrument("event-misfire")
+def lambda_handler(event, context):
+    """
+    Continues the scan of signal_file_bucket from the saved cursor until the
+    bucket is exhausted or the invocation runs low on time. The number of
+    missed files is only published once a full pass of the bucket completes.
+    """
     alert_msg = "Possible Event Misfire: There are ancillary files left in the bucket. Please check the information below and take immediate action"
 
+    state = load_state(SCAN_STATE_NAME, {"generation": 0, "start_after": "", "missed_file_count": 0})
+    stats = state.setdefault("stats", new_scan_stats())
+    verified = load_verified_cache(time())
+    loaded_verified = dict(verified)
+    print("Scan generation {} starting after '{}', {} missed files so far".format(
+        state["generation"], state["start_after"], state["missed_file_count"]))
+
+    #check if there any file older than the threshold left in signal_file_bucket
     now = datetime.now(timezone.utc)
-    if len(s3_files)==0:
-        print("No files found in {}".format(signal_file_bucket))
+    older_than = now - timedelta(seconds=event_misfire_delay_threshold_second)
+    print("event_misfire_delay_threshold_second : {} seconds".format(event_misfire_delay_threshold_second))
+    if S3_LIST_WORKERS > 1:
+        pages = iter_stale_pages_by_prefix(signal_file_bucket, older_than, S3_LIST_WORKERS, state["start_after"])
     else:
-        print("event_misfire_delay_threshold_second : {} seconds".format(event_misfire_delay_threshold_second))
-        for key in s3_files:
-            file_creation_time = s3_files[key]
-            print("file_creation_time : {} of type : {}".format(file_creation_time, type(file_creation_time)))
-            if type(file_creation_time) == str:
-                file_creation_time = datetime.strptime(file_creation_time, '%d%m%YT%H:%M:%S')
-
-            difference = (now - file_creation_time).total_seconds()        
-            print("File was created {} seconds ago".format(difference))
-
-            if difference <= event_misfire_delay_threshold_second:
-                print("No Action as file creation time within threshold value of : {} seconds".format(event_misfire_delay_threshold_second))
-                continue
+        pages = iter_stale_pages(signal_file_bucket, older_than, start_after=state["start_after"])
 
-            print("Checking job as diff is above threshold value of : {} seconds".format(event_misfire_delay_threshold_second))
-            job_data_len = get_job_info(key)
-            if job_data_len>0:
-                print("Job Found, No action Required")
-                continue
-            else:
-                print("No Job Found. Submit Alert")
-                missed_files.append(key)
+    # look up the jobs of the stale files as they are listed, a batch at a time
+    candidate_count = 0
+    missed_files = []
+    pending = []
+    complete = True
+    for last_key, stale_files in pages:
+        for obj in stale_files:
+            add_sample(stats["stale_file_age"], (now - obj['LastModified']).total_seconds())
+        pending.extend(stale_files)
+        while len(pending) >= ES_MSEARCH_BATCH_SIZE:
+            batch, pending = pending[:ES_MSEARCH_BATCH_SIZE], pending[ES_MSEARCH_BATCH_SIZE:]
+            candidate_count += len(batch)
+            missed_files.extend(process_batch(batch, verified, stats))
+        if not retry.has_time(context, reserve_ms=SCAN_TIME_RESERVE_MS):
+            print("Running out of time, pausing the scan after {}".format(last_key))
+            state["start_after"] = last_key
+            complete = False
+            break
+    pages.close()
+    candidate_count += len(pending)
+    missed_files.extend(process_batch(pending, verified, stats))
+
+    state["missed_file_count"] += len(missed_files)
+    stats["candidate_count"] += candidate_count
+    print("candidate_count : {}, missed files in this invocation : {}".format(candidate_count, len(missed_files)))
 
-    missed_file_count = len(missed_files)
-    print("missed_file_count : {}".format(missed_file_count))
-    send_cloudwatch_alarm(missed_file_count)    
+    if complete:
+        missed_file_count = state["missed_file_count"]
+        print("Scan generation {} complete, missed_file_count : {}".format(state["generation"], missed_file_count))
+        send_cloudwatch_alarm(missed_file_count, stats)
+        state = {"generation": state["generation"] + 1, "start_after": "", "missed_file_count": 0,
+                 "stats": new_scan_stats()}
+    save_state(SCAN_STATE_NAME, state)
+    if verified != loaded_verified:
+        save_state(VERIFIED_CACHE_NAME, verified)
 
     return {
         'statusCode': 200,
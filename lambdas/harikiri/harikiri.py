@@ -1,9 +1,11 @@
 import re
-import boto3
-import botocore
-import backoff
+import botocore.exceptions
 import traceback
 
+import aws_clients
+import metrics
+import retry
+
 
 # regexes
 NO_MANAGED_FOUND_RE = re.compile(r"No managed instance found")
@@ -16,33 +18,45 @@ def is_not_managed_instance(e):
     return True if NO_MANAGED_FOUND_RE.search(str(e)) else False
 
 
-@backoff.on_exception(
-    backoff.expo,
-    botocore.exceptions.ClientError,
-    max_tries=8,
-    max_value=64,
-    giveup=is_not_managed_instance,
-)
-def terminate_instance(client, instance_id):
-    client.terminate_instance_in_auto_scaling_group(
-        InstanceId=instance_id, ShouldDecrementDesiredCapacity=True
+def terminate_instance(client, instance_id, context=None):
+    """Terminate the instance, retrying client errors while the invocation
+       has time left."""
+
+    retry.call(
+        lambda: client.terminate_instance_in_auto_scaling_group(
+            InstanceId=instance_id, ShouldDecrementDesiredCapacity=True
+        ),
+        context,
+        retry_on=botocore.exceptions.ClientError,
+        max_tries=8,
+        max_value=64,
+        giveup=is_not_managed_instance,
     )
 
 
+@metrics.instrument("harikiri")
 def lambda_handler(event, context):
     print("in lambda_handler")
     print("SQS payload = " + str(event["Records"]))
-    c = boto3.client("autoscaling")
+    c = aws_clients.get_client("autoscaling")
     terminated_ids = []
+    failures = []
     for record in event["Records"]:
         instance_id = record["body"]
         print("Instance id from SQS is " + instance_id)
         try:
-            terminate_instance(c, instance_id)
+            with metrics.timed("TerminateInstance"):
+                terminate_instance(c, instance_id, context)
             terminated_ids.append(instance_id)
         except Exception as e:
             print(f"Exception in calling terminate_instance on {instance_id}: {str(e)}")
             print(traceback.format_exc())
-            raise
-
-    return {"statusCode": 200, "body": f"Terminated instances: {terminated_ids}"}
+            failures.append({"itemIdentifier": record["messageId"]})
+
+    # Only the failed messages are returned to the queue for redelivery. This
+    # requires ReportBatchItemFailures on the SQS event source mapping.
+    return {
+        "statusCode": 200,
+        "body": f"Terminated instances: {terminated_ids}",
+        "batchItemFailures": failures,
+    }
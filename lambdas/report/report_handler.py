@@ -2,7 +2,8 @@ from __future__ import print_function
 
 import os
 import json
-import requests
+import metrics
+import mozart_client
 
 from datetime import datetime, timedelta
 
@@ -28,41 +29,10 @@ def convert_datetime(datetime_obj, strformat=DATETIME_FORMAT):
 
 def submit_job(job_name, job_spec, job_params, queue, tags, priority=0):
     """Submit job to mozart via REST API."""
-
-    # setup params
-    params = {
-        "queue": queue,
-        "priority": priority,
-        "tags": json.dumps(tags),
-        "type": job_spec,
-        "params": json.dumps(job_params),
-        "name": job_name,
-    }
-
-    # submit job
-    print("Job params: %s" % json.dumps(params))
-    print("Job URL: %s" % JOB_SUBMIT_URL)
-    req = requests.post(JOB_SUBMIT_URL, data=params, verify=False)
-
-    print("Request code: %s" % req.status_code)
-    print("Request text: %s" % req.text)
-
-    if req.status_code != 200:
-        req.raise_for_status()
-    result = req.json()
-    print("Request Result: %s" % result)
-
-    if "result" in result.keys() and "success" in result.keys():
-        if result["success"] is True:
-            job_id = result["result"]
-            print("submitted job: %s job_id: %s" % (job_spec, job_id))
-        else:
-            print("job not submitted successfully: %s" % result)
-            raise Exception("job not submitted successfully: %s" % result)
-    else:
-        raise Exception("job not submitted successfully: %s" % result)
+    return mozart_client.submit_job(JOB_SUBMIT_URL, job_name, job_spec, job_params, queue, tags, priority)
 
 
+@metrics.instrument("report")
 def lambda_handler(event, context):
     """
     This lambda handler calls submit_job with the job type info
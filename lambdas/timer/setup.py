@@ -15,6 +15,8 @@ import six
 
 WHEELHOUSE = "wheelhouse"
 DIST = "dist"
+# Modules shared by every lambda, packaged next to lambda_function.py
+COMMON = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common")
 
 
 class Package(setuptools.Command):
@@ -180,6 +182,10 @@ class Package(setuptools.Command):
             "zip -9 {package_name} {files}".format(
                 package_name=lambda_package,
                 files=' '.join(glob.glob("lambda_function.py"))))
+        self.execute(
+            "zip -9 -j {package_name} {files}".format(
+                package_name=lambda_package,
+                files=' '.join(sorted(glob.glob(os.path.join(COMMON, "*.py"))))))
         os.chdir(os.path.join(self.workspace, WHEELHOUSE))
         self.execute(
             "zip -rg ../{dist}/{archive_name}-{version}.zip "
@@ -3,5 +3,9 @@ from setuptools import setup, find_packages
 setup(
     name='opera_sds_lambdas',
     version='0.0.1',
-    packages=find_packages()
+    packages=find_packages(),
+    extras_require={
+        # tools/plan_batch_campaign.py
+        "tools": ["numpy>=1.21.0"],
+    }
 )
@@ -1,6 +1,12 @@
+import os
+import sys
+
 import pytest
 import requests
 
+# Shared modules are packaged next to lambda_function.py, so lambdas import them as top-level modules.
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "lambdas", "common"))
+
 
 @pytest.fixture(autouse=True)
 def deny_network_requests(monkeypatch):
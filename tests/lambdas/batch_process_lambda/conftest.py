@@ -0,0 +1,5 @@
+import os
+
+# batch_process_lambda reads the map path at import. The real map is packaged with the lambda.
+os.environ.setdefault("DISP_FRAME_BURST_MAP_JSON",
+                      os.path.join(os.path.dirname(__file__), "data", "opera-s1-disp-frame-to-burst.json"))
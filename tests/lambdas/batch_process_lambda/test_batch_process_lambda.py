@@ -175,4 +175,612 @@ def test_lambda_handler_disp_last():
     job_name, job_spec, job_params, job_tags, last_proc_date, last_proc_frame, finished = \
         batch_lambda.form_job_params(p, map)
 
-    assert finished == True
\ No newline at end of file
+    assert finished == True
+
+def generate_proc_doc(doc_id, **fields):
+    source = {
+        "enabled": True,
+        "label": doc_id,
+        "processing_mode": "forward",
+        "data_start_date": "2021-01-01T00:00:00",
+        "data_end_date": "2021-01-02T00:00:00",
+        "last_successful_proc_data_date": "1900-01-01T00:00:00",
+        "last_run_date": "1900-01-01T00:00:00",
+        "data_date_incr_mins": 60,
+        "run_interval_mins": 10,
+        "job_type": JOB_TYPE,
+        "job_queue": "some_job_queue",
+        "download_job_queue": "some_queue",
+        "chunk_size": 1,
+    }
+    source.update(fields)
+    return {"_id": doc_id, "_source": source}
+
+
+def written_docs(eu):
+    """
+    Returns the batch proc docs written by every _bulk request, by id.
+    """
+    docs = {}
+    for call in eu.es.bulk.call_args_list:
+        actions = call.kwargs["body"]
+        docs.update({actions[i]["update"]["_id"]: actions[i + 1]["doc"] for i in range(0, len(actions), 2)})
+    return docs
+
+
+def test_get_due_procs_query__then_filters_enabled_and_due_procs():
+    query = batch_lambda.get_due_procs_query(datetime(2021, 1, 1, 12, 0, 0))
+
+    filters = query["query"]["bool"]["filter"]
+    assert {"term": {"enabled": True}} in filters
+    assert filters[1]["bool"]["should"][0] == {"range": {"next_run_date": {"lte": "2021-01-01T12:00:00"}}}
+
+
+def test_create_batch_proc_index__when_missing__then_creates_it_with_mappings(mocker):
+    # ARRANGE
+    eu = mocker.MagicMock()
+    eu.es.indices.exists.return_value = False
+    mocker.patch.object(batch_lambda, "get_eu", return_value=eu)
+
+    # ACT
+    batch_lambda.create_batch_proc_index()
+
+    # ASSERT
+    eu.es.indices.create.assert_called_once_with(
+        index="batch_proc", body={"mappings": batch_lambda.BATCH_PROC_MAPPINGS})
+    eu.es.indices.put_mapping.assert_not_called()
+
+
+def test_create_batch_proc_index__when_exists__then_maps_only_unmapped_fields(mocker):
+    # ARRANGE
+    eu = mocker.MagicMock()
+    eu.es.indices.exists.return_value = True
+    eu.es.indices.get_mapping.return_value = {"batch_proc": {"mappings": {"properties": {
+        field: {"type": "date"} for field in batch_lambda.BATCH_PROC_MAPPINGS["properties"] if field != "next_run_date"
+    }}}}
+    mocker.patch.object(batch_lambda, "get_eu", return_value=eu)
+
+    # ACT
+    batch_lambda.create_batch_proc_index()
+
+    # ASSERT
+    eu.es.indices.create.assert_not_called()
+    eu.es.indices.put_mapping.assert_called_once_with(
+        index="batch_proc", body={"properties": {"next_run_date": batch_lambda.ES_DATE_MAPPING}})
+
+
+def test_batch_proc_once__then_applies_mappings_once_and_retries_after_failure(mocker, monkeypatch):
+    # ARRANGE
+    monkeypatch.setattr(batch_lambda, "_index_ready", False)
+    eu = mocker.MagicMock()
+    eu.query.return_value = []
+    mocker.patch.object(batch_lambda, "get_eu", return_value=eu)
+    create_batch_proc_index = mocker.patch.object(
+        batch_lambda, "create_batch_proc_index", side_effect=[ConnectionError("connection refused"), None])
+
+    # ACT
+    for _ in range(3):
+        batch_lambda.batch_proc_once()
+
+    # ASSERT
+    assert create_batch_proc_index.call_count == 2
+    assert eu.query.call_count == 3
+
+
+def test_batch_proc_once__then_queries_due_procs_and_schedules_next_run(mocker):
+    # ARRANGE
+    eu = mocker.MagicMock()
+    now = datetime.utcnow().strftime(batch_lambda.ES_DATETIME_FORMAT)
+    eu.query.return_value = [generate_proc_doc("not_due", last_run_date=now), generate_proc_doc("due")]
+    eu.es.update.return_value = {"_seq_no": 4, "_primary_term": 1}
+    mocker.patch.object(batch_lambda, "get_eu", return_value=eu)
+    submit_job = mocker.patch.object(batch_lambda, "submit_job", return_value="job-id")
+
+    # ACT
+    batch_lambda.batch_proc_once()
+
+    # ASSERT
+    assert eu.query.call_args.kwargs["body"]["query"]["bool"]["filter"][0] == {"term": {"enabled": True}}
+    assert submit_job.call_count == 1
+    assert eu.es.update.call_count == 1
+    assert eu.es.update.call_args.kwargs["id"] == "due"
+    assert "next_run_date" in eu.es.update.call_args.kwargs["body"]["doc"]
+    actions = eu.es.bulk.call_args.kwargs["body"]
+    assert actions[0] == {"update": {"_index": "batch_proc", "_id": "due", "if_seq_no": 4, "if_primary_term": 1}}
+    assert "doc_as_upsert" not in actions[1]
+    assert len(actions) == 2
+
+
+def test_batch_proc_once__when_many_due_procs__then_services_all_and_summarizes(mocker):
+    # ARRANGE
+    eu = mocker.MagicMock()
+    eu.query.return_value = [
+        generate_proc_doc("due_1"),
+        generate_proc_doc("due_2"),
+        generate_proc_doc("done", last_successful_proc_data_date="2021-01-02T00:00:00"),
+        generate_proc_doc("broken", data_start_date="not a date"),
+    ]
+    mocker.patch.object(batch_lambda, "get_eu", return_value=eu)
+    mocker.patch.object(batch_lambda, "submit_job", side_effect=lambda job_name, *args: "id-" + job_name)
+
+    # ACT
+    summary = batch_lambda.batch_proc_once()
+
+    # ASSERT
+    assert [s["label"] for s in summary["submitted"]] == ["due_1", "due_2"]
+    assert summary["submitted"][0]["start_date"] == "2021-01-01T00:00:00Z"
+    assert summary["submitted"][0]["end_date"] == "2021-01-01T01:00:00Z"
+    assert summary["completed"] == ["done"]
+    assert summary["failed"] == ["broken"]
+    assert summary["deferred"] == []
+
+
+def test_batch_proc_once__when_out_of_time__then_defers_procs(mocker):
+    # ARRANGE
+    eu = mocker.MagicMock()
+    eu.query.return_value = [generate_proc_doc("due_1"), generate_proc_doc("due_2")]
+    mocker.patch.object(batch_lambda, "get_eu", return_value=eu)
+    submit_job = mocker.patch.object(batch_lambda, "submit_job")
+    context = mocker.MagicMock()
+    context.get_remaining_time_in_millis.return_value = batch_lambda.PROC_TIME_RESERVE_MS - 1
+
+    # ACT
+    summary = batch_lambda.batch_proc_once(context)
+
+    # ASSERT
+    assert summary["deferred"] == ["due_1", "due_2"]
+    submit_job.assert_not_called()
+
+
+def test_batch_proc_once__then_writes_each_state_transition_once_serviced(mocker):
+    # ARRANGE
+    eu = mocker.MagicMock()
+    eu.query.return_value = [
+        generate_proc_doc("due"),
+        generate_proc_doc("done", last_successful_proc_data_date="2021-01-02T00:00:00"),
+        generate_proc_doc("submit_fails", last_successful_proc_data_date="2021-01-01T05:00:00"),
+    ]
+    eu.es.bulk.return_value = {"errors": False, "items": []}
+    mocker.patch.object(batch_lambda, "get_eu", return_value=eu)
+
+    def submit_job(job_name, *args):
+        if "submit_fails" in job_name:
+            raise RuntimeError("mozart is down")
+        return "job-id"
+    mocker.patch.object(batch_lambda, "submit_job", side_effect=submit_job)
+
+    # ACT
+    summary = batch_lambda.batch_proc_once()
+
+    # ASSERT
+    assert summary["failed"] == ["submit_fails"]
+    assert summary["update_failed"] == []
+    assert eu.es.bulk.call_count == 3
+    assert all(len(call.kwargs["body"]) == 2 for call in eu.es.bulk.call_args_list)
+    eu.update_document.assert_not_called()
+    docs = written_docs(eu)
+    assert docs["due"]["last_attempted_proc_data_date"] == "2021-01-01T01:00:00"
+    assert docs["due"]["last_successful_proc_data_date"] == "2021-01-01T01:00:00"
+    assert docs["done"]["enabled"] is False
+    assert docs["submit_fails"]["last_attempted_proc_data_date"] == "2021-01-01T06:00:00"
+    assert "last_successful_proc_data_date" not in docs["submit_fails"]
+    assert all("last_run_date" not in doc for doc in docs.values())
+
+
+def test_batch_proc_once__when_state_write_fails__then_reports_it_and_keeps_other_procs(mocker):
+    # ARRANGE
+    eu = mocker.MagicMock()
+    eu.query.return_value = [generate_proc_doc("rejected"), generate_proc_doc("es_down"), generate_proc_doc("due")]
+
+    def bulk(body):
+        doc_id = body[0]["update"]["_id"]
+        if doc_id == "es_down":
+            raise ConnectionError("connection refused")
+        error = {"error": {"type": "mapper_parsing_exception"}} if doc_id == "rejected" else {}
+        return {"errors": bool(error), "items": [{"update": dict({"_id": doc_id, "status": 200}, **error)}]}
+    eu.es.bulk.side_effect = bulk
+    mocker.patch.object(batch_lambda, "get_eu", return_value=eu)
+    mocker.patch.object(batch_lambda, "submit_job", return_value="job-id")
+
+    # ACT
+    summary = batch_lambda.batch_proc_once()
+
+    # ASSERT
+    assert [s["label"] for s in summary["submitted"]] == ["rejected", "es_down", "due"]
+    assert summary["update_failed"] == ["rejected", "es_down"]
+    assert "update_failed" not in summary["submitted"][0]
+
+
+def test_batch_proc_once__when_proc_claimed_by_another_scheduler__then_skips_it(mocker):
+    # ARRANGE
+    from elasticsearch.exceptions import ConflictError
+
+    eu = mocker.MagicMock()
+    eu.query.return_value = [
+        dict(generate_proc_doc("mine"), _seq_no=3, _primary_term=1),
+        dict(generate_proc_doc("theirs"), _seq_no=7, _primary_term=1),
+    ]
+
+    def update(index, id, body, **kwargs):
+        if id == "theirs":
+            raise ConflictError(409, "version_conflict_engine_exception", {})
+        return {"_seq_no": kwargs["if_seq_no"] + 1, "_primary_term": 1}
+    eu.es.update.side_effect = update
+    mocker.patch.object(batch_lambda, "get_eu", return_value=eu)
+    submit_job = mocker.patch.object(batch_lambda, "submit_job", return_value="job-id")
+
+    # ACT
+    summary = batch_lambda.batch_proc_once()
+
+    # ASSERT
+    assert eu.query.call_args.kwargs["body"]["seq_no_primary_term"] is True
+    claims = {c.kwargs["id"]: c.kwargs for c in eu.es.update.call_args_list}
+    assert (claims["mine"]["if_seq_no"], claims["mine"]["if_primary_term"]) == (3, 1)
+    assert (claims["theirs"]["if_seq_no"], claims["theirs"]["if_primary_term"]) == (7, 1)
+    assert submit_job.call_count == 1
+    assert [s["label"] for s in summary["submitted"]] == ["mine"]
+    assert summary["skipped"] == ["theirs"]
+    assert written_docs(eu).keys() == {"mine"}
+    assert eu.es.bulk.call_args.kwargs["body"][0]["update"]["if_seq_no"] == 4
+
+
+def test_batch_proc_once__then_holds_claim_for_the_invocation_and_releases_it_once_written(mocker):
+    # ARRANGE
+    eu = mocker.MagicMock()
+    eu.query.return_value = [generate_proc_doc("due", run_interval_mins=1)]
+    eu.es.update.return_value = {"_seq_no": 4, "_primary_term": 1}
+    mocker.patch.object(batch_lambda, "get_eu", return_value=eu)
+    mocker.patch.object(batch_lambda, "submit_job", return_value="job-id")
+    context = mocker.MagicMock()
+    context.get_remaining_time_in_millis.return_value = 15 * 60 * 1000
+
+    # ACT
+    batch_lambda.batch_proc_once(context)
+
+    # ASSERT
+    claim = eu.es.update.call_args.kwargs["body"]["doc"]
+    last_run_date = datetime.strptime(claim["last_run_date"], batch_lambda.ES_DATETIME_FORMAT)
+    lease = datetime.strptime(claim["next_run_date"], batch_lambda.ES_DATETIME_FORMAT) - last_run_date
+    assert lease.total_seconds() == 15 * 60
+    next_run_date = datetime.strptime(written_docs(eu)["due"]["next_run_date"], batch_lambda.ES_DATETIME_FORMAT)
+    assert (next_run_date - last_run_date).total_seconds() == 60
+
+
+def test_batch_proc_once__when_claimed_by_another_scheduler_mid_tick__then_does_not_overwrite_it(mocker):
+    # ARRANGE
+    eu = mocker.MagicMock()
+    eu.query.return_value = [dict(generate_proc_doc("slow"), _seq_no=3, _primary_term=1)]
+    eu.es.update.return_value = {"_seq_no": 4, "_primary_term": 1}
+    eu.es.bulk.return_value = {"errors": True, "items": [{"update": {
+        "_id": "slow", "status": 409, "error": {"type": "version_conflict_engine_exception"}}}]}
+    mocker.patch.object(batch_lambda, "get_eu", return_value=eu)
+    mocker.patch.object(batch_lambda, "submit_job", return_value="job-id")
+
+    # ACT
+    summary = batch_lambda.batch_proc_once()
+
+    # ASSERT
+    update = eu.es.bulk.call_args.kwargs["body"][0]["update"]
+    assert (update["if_seq_no"], update["if_primary_term"]) == (4, 1)
+    assert summary["update_failed"] == ["slow"]
+
+
+def test_batch_proc_once__when_proc_behind__then_catches_up_to_max_windows_per_tick(mocker):
+    # ARRANGE
+    eu = mocker.MagicMock()
+    eu.query.return_value = [
+        generate_proc_doc("behind", max_windows_per_tick=3),
+        generate_proc_doc("last_windows", max_windows_per_tick=3, last_successful_proc_data_date="2021-01-01T23:00:00"),
+        generate_proc_doc("one_window"),
+    ]
+    mocker.patch.object(batch_lambda, "get_eu", return_value=eu)
+    submit_job = mocker.patch.object(batch_lambda, "submit_job", side_effect=lambda job_name, *args: job_name)
+
+    # ACT
+    summary = batch_lambda.batch_proc_once()
+
+    # ASSERT
+    assert submit_job.call_count == 5
+    behind, last_windows, one_window = summary["submitted"]
+    assert len(behind["job_ids"]) == 3
+    assert (behind["start_date"], behind["end_date"]) == ("2021-01-01T00:00:00Z", "2021-01-01T03:00:00Z")
+    assert len(last_windows["job_ids"]) == 1
+    assert len(one_window["job_ids"]) == 1
+    assert written_docs(eu)["behind"]["last_successful_proc_data_date"] == "2021-01-01T03:00:00"
+
+
+def test_batch_proc_once__when_catch_up_window_fails__then_keeps_submitted_windows(mocker):
+    # ARRANGE
+    eu = mocker.MagicMock()
+    eu.query.return_value = [generate_proc_doc("behind", max_windows_per_tick=3)]
+    mocker.patch.object(batch_lambda, "get_eu", return_value=eu)
+    mocker.patch.object(batch_lambda, "submit_job", side_effect=["job-1", RuntimeError("mozart is down")])
+
+    # ACT
+    summary = batch_lambda.batch_proc_once()
+
+    # ASSERT
+    assert summary["submitted"][0]["job_ids"] == ["job-1"]
+    doc = eu.es.bulk.call_args.kwargs["body"][1]["doc"]
+    assert doc["last_successful_proc_data_date"] == "2021-01-01T01:00:00"
+    assert doc["last_attempted_proc_data_date"] == "2021-01-01T02:00:00"
+
+
+def test_batch_proc_once__when_max_concurrent_windows__then_submits_a_window_per_lane(mocker):
+    # ARRANGE
+    eu = mocker.MagicMock()
+    eu.query.return_value = [generate_proc_doc("lanes", max_concurrent_windows=3)]
+    mocker.patch.object(batch_lambda, "get_eu", return_value=eu)
+    mocker.patch.object(batch_lambda, "submit_job", side_effect=lambda job_name, *args: job_name)
+
+    # ACT
+    summary = batch_lambda.batch_proc_once()
+
+    # ASSERT
+    assert summary["submitted"][0]["windows"] == [
+        ("2021-01-01T00:00:00Z", "2021-01-01T01:00:00Z"),
+        ("2021-01-01T08:00:00Z", "2021-01-01T09:00:00Z"),
+        ("2021-01-01T16:00:00Z", "2021-01-01T17:00:00Z"),
+    ]
+    doc = eu.es.bulk.call_args.kwargs["body"][1]["doc"]
+    assert doc["lanes_max_concurrent_windows"] == 3
+    assert doc["lanes"][1] == {
+        "start_date": "2021-01-01T08:00:00",
+        "end_date": "2021-01-01T16:00:00",
+        "last_attempted_proc_data_date": "2021-01-01T09:00:00",
+        "last_successful_proc_data_date": "2021-01-01T09:00:00",
+    }
+    assert doc["last_successful_proc_data_date"] == "2021-01-01T01:00:00"
+    assert doc["last_attempted_proc_data_date"] == "2021-01-01T17:00:00"
+
+
+def test_batch_proc_once__when_lanes_exist__then_resumes_them_and_completes_when_all_done(mocker):
+    # ARRANGE
+    lanes = [
+        {"start_date": "2021-01-01T00:00:00", "end_date": "2021-01-01T12:00:00",
+         "last_successful_proc_data_date": "2021-01-01T12:00:00"},
+        {"start_date": "2021-01-01T12:00:00", "end_date": "2021-01-02T00:00:00",
+         "last_successful_proc_data_date": "2021-01-01T20:00:00"},
+    ]
+    done_lanes = [dict(lane, last_successful_proc_data_date=lane["end_date"]) for lane in lanes]
+    eu = mocker.MagicMock()
+    eu.query.return_value = [
+        generate_proc_doc("resumed", max_concurrent_windows=2, lanes_max_concurrent_windows=2, lanes=lanes),
+        generate_proc_doc("done", max_concurrent_windows=2, lanes_max_concurrent_windows=2, lanes=done_lanes),
+    ]
+    mocker.patch.object(batch_lambda, "get_eu", return_value=eu)
+    mocker.patch.object(batch_lambda, "submit_job", side_effect=lambda job_name, *args: job_name)
+
+    # ACT
+    summary = batch_lambda.batch_proc_once()
+
+    # ASSERT
+    assert summary["submitted"][0]["windows"] == [("2021-01-01T20:00:00Z", "2021-01-01T21:00:00Z")]
+    assert summary["completed"] == ["done"]
+    doc = written_docs(eu)["resumed"]
+    assert doc["last_successful_proc_data_date"] == "2021-01-01T21:00:00"
+
+
+@pytest.mark.parametrize("fields, windows", [
+    # more lanes: only the rest of the unfinished lane is split again
+    ({"max_concurrent_windows": 3}, [("2021-01-01T20:00:00Z", "2021-01-01T21:00:00Z"),
+                                     ("2021-01-01T22:00:00Z", "2021-01-01T23:00:00Z")]),
+    # later data end date: the unfinished lane goes on and the new data gets its own lane
+    ({"data_end_date": "2021-01-02T04:00:00"}, [("2021-01-01T20:00:00Z", "2021-01-01T21:00:00Z"),
+                                                ("2021-01-02T00:00:00Z", "2021-01-02T01:00:00Z")]),
+])
+def test_batch_proc_once__when_lanes_split_again__then_keeps_submitted_windows(mocker, fields, windows):
+    # ARRANGE
+    lanes = [
+        {"start_date": "2021-01-01T00:00:00", "end_date": "2021-01-01T12:00:00",
+         "last_successful_proc_data_date": "2021-01-01T12:00:00"},
+        {"start_date": "2021-01-01T12:00:00", "end_date": "2021-01-02T00:00:00",
+         "last_successful_proc_data_date": "2021-01-01T20:00:00"},
+    ]
+    eu = mocker.MagicMock()
+    eu.query.return_value = [generate_proc_doc("resplit", **dict(
+        {"max_concurrent_windows": 2, "lanes_max_concurrent_windows": 2, "lanes": lanes}, **fields))]
+    mocker.patch.object(batch_lambda, "get_eu", return_value=eu)
+    mocker.patch.object(batch_lambda, "submit_job", side_effect=lambda job_name, *args: job_name)
+
+    # ACT
+    summary = batch_lambda.batch_proc_once()
+
+    # ASSERT
+    assert summary["submitted"][0]["windows"] == windows
+    doc = written_docs(eu)["resplit"]
+    assert all(lane["start_date"] >= "2021-01-01T20:00:00" for lane in doc["lanes"])
+    assert doc["last_successful_proc_data_date"] == "2021-01-01T21:00:00"
+
+
+def test_batch_proc_once__when_fewer_lanes_than_in_progress__then_submits_max_concurrent_windows(mocker):
+    # ARRANGE
+    lanes = [{"start_date": "2021-01-01T%02d:00:00" % start, "end_date": "2021-01-01T%02d:00:00" % (start + 8),
+              "last_successful_proc_data_date": "2021-01-01T%02d:00:00" % (start + 2)} for start in (0, 8)]
+    lanes.append({"start_date": "2021-01-01T16:00:00", "end_date": "2021-01-02T00:00:00",
+                  "last_successful_proc_data_date": "2021-01-01T18:00:00"})
+    eu = mocker.MagicMock()
+    eu.query.return_value = [generate_proc_doc(
+        "fewer", max_concurrent_windows=2, lanes_max_concurrent_windows=3, lanes=lanes)]
+    mocker.patch.object(batch_lambda, "get_eu", return_value=eu)
+    mocker.patch.object(batch_lambda, "submit_job", side_effect=lambda job_name, *args: job_name)
+
+    # ACT
+    summary = batch_lambda.batch_proc_once()
+
+    # ASSERT
+    assert summary["submitted"][0]["windows"] == [("2021-01-01T02:00:00Z", "2021-01-01T03:00:00Z"),
+                                                  ("2021-01-01T10:00:00Z", "2021-01-01T11:00:00Z")]
+    doc = written_docs(eu)["fewer"]
+    assert [lane["start_date"] for lane in doc["lanes"]] == [
+        "2021-01-01T02:00:00", "2021-01-01T10:00:00", "2021-01-01T18:00:00"]
+
+
+def test_batch_proc_once__when_lanes_lowered_to_one__then_works_through_their_gaps_in_order(mocker):
+    # ARRANGE
+    lanes = [{"start_date": "2021-01-01T%02d:00:00" % start, "end_date": "2021-01-01T%02d:00:00" % (start + 8),
+              "last_successful_proc_data_date": "2021-01-01T%02d:00:00" % (start + 1)} for start in (0, 8)]
+    lanes.append({"start_date": "2021-01-01T16:00:00", "end_date": "2021-01-02T00:00:00",
+                  "last_successful_proc_data_date": "2021-01-01T17:00:00"})
+    eu = mocker.MagicMock()
+    eu.query.return_value = [generate_proc_doc(
+        "one_lane", max_concurrent_windows=1, lanes_max_concurrent_windows=3, lanes=lanes)]
+    mocker.patch.object(batch_lambda, "get_eu", return_value=eu)
+    mocker.patch.object(batch_lambda, "submit_job", side_effect=lambda job_name, *args: job_name)
+
+    # ACT
+    summary = batch_lambda.batch_proc_once()
+
+    # ASSERT
+    assert summary["submitted"][0]["windows"] == [("2021-01-01T01:00:00Z", "2021-01-01T02:00:00Z")]
+    doc = written_docs(eu)["one_lane"]
+    assert doc["lanes_max_concurrent_windows"] == 1
+    assert [(lane["start_date"], lane["end_date"]) for lane in doc["lanes"]] == [
+        ("2021-01-01T01:00:00", "2021-01-01T08:00:00"),
+        ("2021-01-01T09:00:00", "2021-01-01T16:00:00"),
+        ("2021-01-01T17:00:00", "2021-01-02T00:00:00"),
+    ]
+    assert doc["last_successful_proc_data_date"] == "2021-01-01T02:00:00"
+
+
+def test_batch_proc_once__when_one_lane_left_up_to_data_end__then_leaves_lanes(mocker):
+    # ARRANGE
+    lanes = [
+        {"start_date": "2021-01-01T00:00:00", "end_date": "2021-01-01T12:00:00",
+         "last_successful_proc_data_date": "2021-01-01T11:00:00"},
+        {"start_date": "2021-01-01T12:00:00", "end_date": "2021-01-02T00:00:00",
+         "last_successful_proc_data_date": "2021-01-01T20:00:00"},
+    ]
+    eu = mocker.MagicMock()
+    eu.query.return_value = [generate_proc_doc(
+        "leaving", max_concurrent_windows=1, lanes_max_concurrent_windows=1, lanes=lanes,
+        lanes_data_end_date="2021-01-02T00:00:00")]
+    mocker.patch.object(batch_lambda, "get_eu", return_value=eu)
+    mocker.patch.object(batch_lambda, "submit_job", side_effect=lambda job_name, *args: job_name)
+
+    # ACT
+    summary = batch_lambda.batch_proc_once()
+
+    # ASSERT
+    assert summary["submitted"][0]["windows"] == [("2021-01-01T11:00:00Z", "2021-01-01T12:00:00Z")]
+    doc = written_docs(eu)["leaving"]
+    assert doc["lanes"] is None
+    assert doc["lanes_max_concurrent_windows"] is None
+    assert doc["last_successful_proc_data_date"] == "2021-01-01T20:00:00"
+
+
+def test_batch_proc_once__when_last_lane_finished__then_split_again_lanes_are_kept(mocker):
+    # ARRANGE
+    lanes = [
+        {"start_date": "2021-01-01T00:00:00", "end_date": "2021-01-01T12:00:00",
+         "last_successful_proc_data_date": "2021-01-01T04:00:00"},
+        {"start_date": "2021-01-01T12:00:00", "end_date": "2021-01-02T00:00:00",
+         "last_successful_proc_data_date": "2021-01-02T00:00:00"},
+    ]
+    eu = mocker.MagicMock()
+    eu.query.return_value = [generate_proc_doc(
+        "resplit", max_concurrent_windows=2, lanes_max_concurrent_windows=3, lanes=lanes)]
+    mocker.patch.object(batch_lambda, "get_eu", return_value=eu)
+    mocker.patch.object(batch_lambda, "submit_job", side_effect=lambda job_name, *args: job_name)
+    batch_lambda.batch_proc_once()
+    written = written_docs(eu)["resplit"]
+    eu.query.return_value = [generate_proc_doc("resplit", max_concurrent_windows=2, **written)]
+
+    # ACT
+    summary = batch_lambda.batch_proc_once()
+
+    # ASSERT
+    assert written["lanes_data_end_date"] == "2021-01-02T00:00:00"
+    assert written["lanes"][-1]["end_date"] == "2021-01-01T12:00:00"
+    assert summary["submitted"][0]["windows"] == [("2021-01-01T05:00:00Z", "2021-01-01T06:00:00Z"),
+                                                  ("2021-01-01T09:00:00Z", "2021-01-01T10:00:00Z")]
+
+
+def test_batch_proc__then_parses_dates_and_applies_defaults():
+    p = batch_lambda.BatchProc.from_hit(dict(generate_proc_doc("proc"), _seq_no=3, _primary_term=1))
+
+    assert (p.doc_id, p.seq_no, p.primary_term) == ("proc", 3, 1)
+    assert p.data_start_date == datetime(2021, 1, 1)
+    assert p.last_run_date == datetime(1900, 1, 1)
+    assert p.temporal is False
+    assert p.include_regions == ""
+    assert p.max_windows_per_tick == 1
+    assert not hasattr(p, "__dict__")
+
+
+@pytest.mark.parametrize("fields", [
+    {"job_queue": None},
+    {"data_end_date": "2021-01-02"},
+    {"run_interval_mins": 0},
+    {"processing_mode": "backwards"},
+    {"data_end_date": "2020-12-31T00:00:00"},
+])
+def test_batch_proc__when_malformed__then_raises(fields):
+    with pytest.raises(ValueError):
+        batch_lambda.BatchProc.from_hit(generate_proc_doc("proc", **fields))
+
+
+def generate_disp_proc_doc(doc_id, **fields):
+    disp_fields = {"collection_short_name": "OPERA_L2_CSLC-S1_V1", "processing_mode": "historical",
+                   "data_end_date": "2021-02-01T00:00:00", "frames_per_query": 100, "k": 1, "m": 4}
+    disp_fields.update(fields)
+    return generate_proc_doc(doc_id, **disp_fields)
+
+
+def test_batch_proc__when_disp_proc_has_lanes__then_raises():
+    with pytest.raises(ValueError, match="max_concurrent_windows"):
+        batch_lambda.BatchProc.from_hit(generate_disp_proc_doc("disp", max_concurrent_windows=2))
+
+
+def test_batch_proc_once__when_disp_proc__then_sweeps_frames_and_rolls_over(mocker):
+    # ARRANGE
+    eu = mocker.MagicMock()
+    eu.query.return_value = [generate_disp_proc_doc("disp", max_windows_per_tick=4)]
+    mocker.patch.object(batch_lambda, "get_eu", return_value=eu)
+    mocker.patch.object(batch_lambda, "get_disp_frame_burst_map", return_value={i: {} for i in range(1, 251)})
+    submit_job = mocker.patch.object(batch_lambda, "submit_job", side_effect=lambda job_name, *args: job_name)
+
+    # ACT
+    summary = batch_lambda.batch_proc_once()
+
+    # ASSERT
+    assert summary["submitted"][0]["frame_ranges"] == [(1, 100), (101, 200), (201, 250), (1, 100)]
+    assert summary["submitted"][0]["windows"][-1] == ("2021-01-13T00:00:00Z", "2021-01-25T00:00:00Z")
+    assert submit_job.call_args_list[1].args[2]["frame_range"] == "--frame-range=101,200"
+    doc = eu.es.bulk.call_args.kwargs["body"][1]["doc"]
+    assert doc["last_successful_proc_data_date"] == "2021-01-13T00:00:00"
+    assert doc["last_successful_proc_frame"] == 100
+
+
+def test_batch_proc_once__when_disp_proc_swept_every_window__then_completes(mocker):
+    # ARRANGE
+    eu = mocker.MagicMock()
+    eu.query.return_value = [generate_disp_proc_doc(
+        "disp", last_successful_proc_data_date="2021-01-25T00:00:00", last_successful_proc_frame=250)]
+    mocker.patch.object(batch_lambda, "get_eu", return_value=eu)
+    mocker.patch.object(batch_lambda, "get_disp_frame_burst_map", return_value={i: {} for i in range(1, 251)})
+    submit_job = mocker.patch.object(batch_lambda, "submit_job")
+
+    # ACT
+    summary = batch_lambda.batch_proc_once()
+
+    # ASSERT
+    assert summary["completed"] == ["disp"]
+    submit_job.assert_not_called()
+
+
+def test_batch_proc_once__when_disp_frame_map_missing__then_fails_without_claiming(mocker):
+    # ARRANGE
+    eu = mocker.MagicMock()
+    eu.query.return_value = [generate_disp_proc_doc("disp")]
+    mocker.patch.object(batch_lambda, "get_eu", return_value=eu)
+    mocker.patch.object(batch_lambda, "get_disp_frame_burst_map", side_effect=FileNotFoundError("no map"))
+    submit_job = mocker.patch.object(batch_lambda, "submit_job")
+
+    # ACT
+    summary = batch_lambda.batch_proc_once()
+
+    # ASSERT
+    assert summary["failed"] == ["disp"]
+    eu.es.update.assert_not_called()
+    submit_job.assert_not_called()
@@ -0,0 +1,103 @@
+import base64
+import importlib
+import json
+import os
+
+import pytest
+from pytest_mock import MockerFixture
+
+import mozart_client
+
+os.environ.update({
+    "MOZART_URL": "https://dummy_mozart_url/mozart",
+    "JOB_QUEUE": "dummy_job_queue",
+    "JOB_TYPE": "dummy_job_type",
+    "JOB_RELEASE": "dummy_job_release",
+    "PRODUCT_TAG": "true",
+    "EVENT_TRIGGER": "kinesis",
+})
+
+cnm_r = importlib.import_module("lambdas.cnm_r.lambda_function-cnm_response")
+
+
+def generate_cnm_message(identifier):
+    return {"collection": "L3_DSWx_HLS", "identifier": identifier, "response": {"status": "SUCCESS"}}
+
+
+def generate_kinesis_event(identifiers):
+    return {"Records": [
+        {"kinesis": {"sequenceNumber": "seq-{}".format(identifier),
+                     "data": base64.b64encode(json.dumps(generate_cnm_message(identifier)).encode()).decode()}}
+        for identifier in identifiers
+    ]}
+
+
+def generate_sqs_event(identifiers):
+    return {"Records": [
+        {"messageId": "msg-{}".format(identifier), "body": json.dumps(generate_cnm_message(identifier))}
+        for identifier in identifiers
+    ]}
+
+
+def fail_for(failing):
+    """
+    Fakes mozart_client.submit_job, failing the submissions of the given
+    identifiers. RuntimeError is not a request error, so it is not retried.
+    """
+    def submit_job(job_submit_url, job_name, *args, **kwargs):
+        if any(job_name.endswith("-" + identifier) for identifier in failing):
+            raise RuntimeError("job not submitted successfully")
+        return "job-id"
+    return submit_job
+
+
+def submit_jobs_failing_for(failing):
+    submit_job = fail_for(failing)
+
+    def submit_jobs(job_submit_url, jobs):
+        results = []
+        for job in jobs:
+            try:
+                results.append({"job_id": submit_job(job_submit_url, **job), "error": None})
+            except RuntimeError as e:
+                results.append({"job_id": None, "error": e})
+        return results
+    return submit_jobs
+
+
+@pytest.mark.parametrize("failing, expected", [
+    ([], []),
+    (["b"], ["seq-b"]),
+    (["a", "b", "c"], ["seq-a", "seq-b", "seq-c"]),
+])
+def test_lambda_handler__when_kinesis__then_reports_failed_records(mocker: MockerFixture, failing, expected):
+    # ARRANGE
+    mocker.patch.object(cnm_r, "EVENT_TRIGGER", "kinesis")
+    mocker.patch.object(mozart_client, "submit_jobs", side_effect=submit_jobs_failing_for(failing))
+    submit_job = mocker.patch.object(mozart_client, "submit_job", side_effect=fail_for(failing))
+
+    # ACT
+    response = cnm_r.lambda_handler(generate_kinesis_event(["a", "b", "c"]), None)
+
+    # ASSERT
+    assert response == {"batchItemFailures": [{"itemIdentifier": identifier} for identifier in expected]}
+    # only the failed submissions are retried one at a time
+    assert submit_job.call_count == len(failing)
+
+
+@pytest.mark.parametrize("failing, expected", [
+    ([], []),
+    (["b"], ["msg-b"]),
+    (["a", "b", "c"], ["msg-a", "msg-b", "msg-c"]),
+])
+def test_lambda_handler__when_sqs__then_reports_failed_messages(mocker: MockerFixture, failing, expected):
+    # ARRANGE
+    mocker.patch.object(cnm_r, "EVENT_TRIGGER", "sqs")
+    submit_job = mocker.patch.object(mozart_client, "submit_job", side_effect=fail_for(failing))
+
+    # ACT
+    response = cnm_r.lambda_handler(generate_sqs_event(["a", "b", "c"]), None)
+
+    # ASSERT
+    assert response == {"batchItemFailures": [{"itemIdentifier": identifier} for identifier in expected]}
+    assert submit_job.call_count == 3
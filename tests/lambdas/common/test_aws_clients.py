@@ -0,0 +1,29 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from pytest_mock import MockerFixture
+
+import aws_clients
+
+
+def test_get_client__when_called_from_many_threads__then_creates_client_once(mocker: MockerFixture, monkeypatch):
+    # ARRANGE
+    monkeypatch.setattr(aws_clients, "_clients", {})
+    boto3_client = mocker.patch("boto3.client", side_effect=lambda service_name: object())
+
+    # ACT
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        clients = list(executor.map(lambda _: aws_clients.get_client("s3"), range(32)))
+
+    # ASSERT
+    assert boto3_client.call_count == 1
+    assert all(client is clients[0] for client in clients)
+
+
+def test_get_client__when_different_services__then_creates_one_client_each(mocker: MockerFixture, monkeypatch):
+    # ARRANGE
+    monkeypatch.setattr(aws_clients, "_clients", {})
+    mocker.patch("boto3.client", side_effect=lambda service_name: service_name)
+
+    # ACT / ASSERT
+    assert aws_clients.get_client("s3") == "s3"
+    assert aws_clients.get_client("sns") == "sns"
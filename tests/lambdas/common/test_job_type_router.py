@@ -0,0 +1,52 @@
+from job_type_router import JobTypeRouter
+
+JOB_TYPES = {
+    "INGEST_L0": {"PATTERN": r"_L0_", "RELEASE": "r1", "QUEUE": "q_l0"},
+    "INGEST_OPERA": {"PATTERN": r"^OPERA_", "RELEASE": "r2", "QUEUE": "q_opera"},
+    "INGEST_H5": {"PATTERN": r"\.h5$", "RELEASE": "r3", "QUEUE": "q_h5"},
+}
+
+
+def generate_router(job_types=JOB_TYPES):
+    return JobTypeRouter(job_types, "INGEST_DEFAULT", "r0", "q_default")
+
+
+def test_route__when_no_pattern_matches__then_returns_defaults():
+    assert generate_router().route("something.txt") == ("INGEST_DEFAULT", "r0", "q_default")
+
+
+def test_route__when_several_patterns_match__then_first_in_mapping_order_wins():
+    # "^OPERA_" matches further left than "_L0_", but "_L0_" comes first in the mapping
+    assert generate_router().route("OPERA_L0_file.h5") == ("INGEST_L0", "r1", "q_l0")
+    assert generate_router().route("OPERA_L2_file.h5") == ("INGEST_OPERA", "r2", "q_opera")
+    assert generate_router().route("NISAR_L2_file.h5") == ("INGEST_H5", "r3", "q_h5")
+
+
+def test_route__when_pattern_uses_backreference__then_falls_back_to_per_pattern_matching():
+    # ARRANGE
+    job_types = {
+        "REPEATED": {"PATTERN": r"(ab)\1", "RELEASE": "r1", "QUEUE": "q1"},
+        "OTHER": {"PATTERN": r"(cd)\1", "RELEASE": "r2", "QUEUE": "q2"},
+    }
+    router = generate_router(job_types)
+
+    # ACT / ASSERT
+    assert router._combined is None
+    assert router.route("x_cdcd_y") == ("OTHER", "r2", "q2")
+    assert router.route("x_cd_y") == ("INGEST_DEFAULT", "r0", "q_default")
+
+
+def test_route__when_no_job_types__then_returns_defaults():
+    assert generate_router({}).route("OPERA_L2_file.h5") == ("INGEST_DEFAULT", "r0", "q_default")
+
+
+def test_route__when_same_file_routed_twice__then_uses_cache():
+    # ARRANGE
+    router = generate_router()
+
+    # ACT
+    router.route("OPERA_L2_file.h5")
+    router.route("OPERA_L2_file.h5")
+
+    # ASSERT
+    assert router._match.cache_info().hits == 1
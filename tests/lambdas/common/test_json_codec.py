@@ -0,0 +1,33 @@
+import json
+
+import pytest
+
+import json_codec
+
+PAYLOAD = {
+    "id": "file_0.h5",
+    "data_url": ["s3://endpoint/bucket/file_0.h5"],
+    "prod_met": {"tags": ["ISL"], "restaged": False, "size": 1.5, "note": "café"},
+    "checksum": False,
+    "checksum_type": None,
+}
+
+
+def test_dumps__then_produces_compact_json():
+    assert json_codec.dumps(PAYLOAD) == json.dumps(PAYLOAD, separators=(",", ":"), ensure_ascii=False)
+
+
+def test_dumps__when_orjson_cannot_serialize__then_falls_back_to_stdlib():
+    assert json_codec.dumps({1: "a"}) == '{"1":"a"}'
+
+
+def test_loads__when_str_or_bytes__then_round_trips():
+    text = json_codec.dumps(PAYLOAD)
+
+    assert json_codec.loads(text) == PAYLOAD
+    assert json_codec.loads(text.encode("utf-8")) == PAYLOAD
+
+
+def test_loads__when_invalid__then_raises_value_error():
+    with pytest.raises(ValueError):
+        json_codec.loads("{")
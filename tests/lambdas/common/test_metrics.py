@@ -0,0 +1,91 @@
+import json
+
+import pytest
+
+import metrics
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    metrics.start(None)
+    yield
+    metrics.start(None)
+
+
+def test_put_metric__when_not_instrumented__then_records_nothing():
+    # ACT
+    metrics.put_metric("Records", 1)
+
+    # ASSERT
+    assert metrics.to_emf() == []
+
+
+def test_to_emf__when_job_type_given__then_groups_by_job_type_dimension():
+    # ARRANGE
+    metrics.start("isl")
+
+    # ACT
+    metrics.put_metric("Records", 3)
+    metrics.put_metric("MozartSubmitLatency", 10.0, "Milliseconds", job_type="ingest")
+    metrics.put_metric("MozartSubmitLatency", 20.0, "Milliseconds", job_type="ingest")
+    docs = metrics.to_emf()
+
+    # ASSERT
+    assert len(docs) == 2
+    lambda_doc = next(doc for doc in docs if "JobType" not in doc)
+    assert lambda_doc["LambdaName"] == "isl"
+    assert lambda_doc["Records"] == 3
+    assert lambda_doc["_aws"]["CloudWatchMetrics"][0]["Dimensions"] == [["LambdaName"]]
+
+    job_doc = next(doc for doc in docs if "JobType" in doc)
+    assert job_doc["JobType"] == "ingest"
+    assert job_doc["MozartSubmitLatency"] == [10.0, 20.0]
+    assert job_doc["_aws"]["CloudWatchMetrics"][0]["Dimensions"] == [["LambdaName", "JobType"]]
+    assert job_doc["_aws"]["CloudWatchMetrics"][0]["Metrics"] == [{"Name": "MozartSubmitLatency", "Unit": "Milliseconds"}]
+
+
+def test_to_emf__when_more_values_than_allowed__then_splits_documents():
+    # ARRANGE
+    metrics.start("isl")
+
+    # ACT
+    for i in range(metrics.MAX_VALUES_PER_METRIC + 1):
+        metrics.put_metric("EventParse", i, "Milliseconds")
+    docs = metrics.to_emf()
+
+    # ASSERT
+    assert len(docs) == 2
+    assert len(docs[0]["EventParse"]) == metrics.MAX_VALUES_PER_METRIC
+    assert docs[1]["EventParse"] == metrics.MAX_VALUES_PER_METRIC
+
+
+def test_instrument__when_handler_returns__then_prints_emf_and_resets(capsys):
+    # ARRANGE
+    @metrics.instrument("timer")
+    def handler(event, context):
+        with metrics.timed("Stage"):
+            pass
+        return "ok"
+
+    # ACT
+    response = handler({}, None)
+
+    # ASSERT
+    assert response == "ok"
+    doc = json.loads(capsys.readouterr().out.strip())
+    assert doc["LambdaName"] == "timer"
+    assert {metric["Name"] for metric in doc["_aws"]["CloudWatchMetrics"][0]["Metrics"]} == {"Stage", "InvocationDuration"}
+    assert metrics.to_emf() == []
+
+
+def test_instrument__when_handler_raises__then_records_error(capsys):
+    # ARRANGE
+    @metrics.instrument("timer")
+    def handler(event, context):
+        raise ValueError("boom")
+
+    # ACT / ASSERT
+    with pytest.raises(ValueError):
+        handler({}, None)
+    doc = json.loads(capsys.readouterr().out.strip())
+    assert doc["InvocationErrors"] == 1
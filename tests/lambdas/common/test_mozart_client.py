@@ -0,0 +1,198 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock
+
+import pytest
+import requests
+from pytest_mock import MockerFixture
+
+import mozart_client
+
+
+def mock_response(status_code=200, body=None):
+    response = MagicMock()
+    response.status_code = status_code
+    response.json.return_value = body
+    response.text = json.dumps(body)
+    return response
+
+
+def test_get_session__when_called_twice__then_reuses_session(monkeypatch):
+    # ARRANGE
+    monkeypatch.setattr(mozart_client, "_session", None)
+
+    # ACT
+    session = mozart_client.get_session()
+
+    # ASSERT
+    assert session is mozart_client.get_session()
+    assert session.verify is False
+    assert session.get_adapter("https://mozart/").poolmanager.connection_pool_kw["maxsize"] == mozart_client.POOL_SIZE
+
+
+def test_get_session__when_called_from_many_threads__then_creates_session_once(mocker: MockerFixture, monkeypatch):
+    # ARRANGE
+    monkeypatch.setattr(mozart_client, "_session", None)
+    session_cls = mocker.patch("requests.Session", side_effect=lambda: MagicMock())
+
+    # ACT
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        sessions = list(executor.map(lambda _: mozart_client.get_session(), range(32)))
+
+    # ASSERT
+    assert session_cls.call_count == 1
+    assert all(session is sessions[0] for session in sessions)
+
+
+def test_submit_job__when_success__then_returns_job_id(mocker: MockerFixture):
+    # ARRANGE
+    session = MagicMock()
+    session.post.return_value = mock_response(body={"success": True, "result": "job-id-1"})
+    mocker.patch.object(mozart_client, "get_session", return_value=session)
+
+    # ACT
+    job_id = mozart_client.submit_job("https://mozart/submit", "name", "job-type:release", {"a": 1}, "queue", ["tag"])
+
+    # ASSERT
+    assert job_id == "job-id-1"
+    args, kwargs = session.post.call_args
+    assert args == ("https://mozart/submit",)
+    assert kwargs["data"]["params"] == '{"a":1}'
+    assert kwargs["data"]["tags"] == '["tag"]'
+    assert "enable_dedup" not in kwargs["data"]
+    assert kwargs["timeout"] == (mozart_client.CONNECT_TIMEOUT, mozart_client.READ_TIMEOUT)
+
+
+def test_form_submit_params__when_enable_dedup_given__then_included_in_form():
+    # ACT
+    params = mozart_client.form_submit_params("name", "job-type:release", {}, "queue", [], "5", enable_dedup=True)
+
+    # ASSERT
+    assert params["enable_dedup"] is True
+    assert params["priority"] == "5"
+
+
+def test_submit_job__when_not_successful__then_raises(mocker: MockerFixture):
+    # ARRANGE
+    session = MagicMock()
+    session.post.return_value = mock_response(body={"success": False, "result": None})
+    mocker.patch.object(mozart_client, "get_session", return_value=session)
+
+    # ACT / ASSERT
+    with pytest.raises(Exception, match="job not submitted successfully"):
+        mozart_client.submit_job("https://mozart/submit", "name", "job-type:release", {}, "queue", [])
+
+
+def test_submit_job__when_http_error__then_raises(mocker: MockerFixture):
+    # ARRANGE
+    response = mock_response(status_code=500, body={})
+    response.raise_for_status.side_effect = requests.exceptions.HTTPError("500")
+    session = MagicMock()
+    session.post.return_value = response
+    mocker.patch.object(mozart_client, "get_session", return_value=session)
+
+    # ACT / ASSERT
+    with pytest.raises(requests.exceptions.HTTPError):
+        mozart_client.submit_job("https://mozart/submit", "name", "job-type:release", {}, "queue", [])
+
+
+def test_submit_jobs__when_many_jobs__then_bounds_concurrency_and_keeps_order(mocker: MockerFixture):
+    # ARRANGE
+    lock = threading.Lock()
+    in_flight = {"now": 0, "max": 0}
+
+    def post(url, data, timeout):
+        with lock:
+            in_flight["now"] += 1
+            in_flight["max"] = max(in_flight["max"], in_flight["now"])
+        time.sleep(0.01)
+        with lock:
+            in_flight["now"] -= 1
+        return mock_response(body={"success": True, "result": "id-" + data["name"]})
+
+    session = MagicMock()
+    session.post.side_effect = post
+    mocker.patch.object(mozart_client, "get_session", return_value=session)
+    jobs = [{"job_name": str(i), "job_spec": "job-type:release", "job_params": {}, "queue": "queue", "tags": []}
+            for i in range(20)]
+
+    # ACT
+    results = mozart_client.submit_jobs("https://mozart/submit", jobs, max_concurrency=4)
+
+    # ASSERT
+    assert [result["job_id"] for result in results] == ["id-%d" % i for i in range(20)]
+    assert all(result["error"] is None for result in results)
+    assert in_flight["max"] <= 4
+
+
+def test_submit_jobs__when_submission_times_out__then_reports_error(mocker: MockerFixture):
+    # ARRANGE
+    timeouts = []
+
+    def post(url, data, timeout):
+        timeouts.append(timeout)
+        if data["name"] == "slow":
+            raise requests.exceptions.ReadTimeout("read timed out")
+        return mock_response(body={"success": True, "result": "id-" + data["name"]})
+
+    session = MagicMock()
+    session.post.side_effect = post
+    mocker.patch.object(mozart_client, "get_session", return_value=session)
+    jobs = [{"job_name": name, "job_spec": "job-type:release", "job_params": {}, "queue": "queue", "tags": []}
+            for name in ("fast", "slow")]
+
+    # ACT
+    results = mozart_client.submit_jobs("https://mozart/submit", jobs, timeout=0.1)
+
+    # ASSERT
+    assert timeouts == [(0.1, 0.1), (0.1, 0.1)]
+    assert results[0] == {"job_id": "id-fast", "error": None}
+    assert isinstance(results[1]["error"], requests.exceptions.Timeout)
+
+
+def test_submit_jobs__when_timeout_is_set__then_waits_for_request_to_finish(mocker: MockerFixture):
+    # ARRANGE
+    finished = []
+
+    def post(url, data, timeout):
+        # a request that outlives the timeout must not be abandoned mid-flight
+        time.sleep(0.2)
+        finished.append(data["name"])
+        return mock_response(body={"success": True, "result": "id-" + data["name"]})
+
+    session = MagicMock()
+    session.post.side_effect = post
+    mocker.patch.object(mozart_client, "get_session", return_value=session)
+    jobs = [{"job_name": "slow", "job_spec": "job-type:release", "job_params": {}, "queue": "queue", "tags": []}]
+
+    # ACT
+    results = mozart_client.submit_jobs("https://mozart/submit", jobs, timeout=0.1)
+
+    # ASSERT
+    assert finished == ["slow"]
+    assert results == [{"job_id": "id-slow", "error": None}]
+
+
+def test_submit_jobs__when_rate_limited__then_spaces_out_submissions(mocker: MockerFixture):
+    # ARRANGE
+    started = []
+
+    def post(url, data, timeout):
+        started.append(time.monotonic())
+        return mock_response(body={"success": True, "result": "id-" + data["name"]})
+
+    session = MagicMock()
+    session.post.side_effect = post
+    mocker.patch.object(mozart_client, "get_session", return_value=session)
+    jobs = [{"job_name": str(i), "job_spec": "job-type:release", "job_params": {}, "queue": "queue", "tags": []}
+            for i in range(5)]
+
+    # ACT
+    results = mozart_client.submit_jobs("https://mozart/submit", jobs, max_concurrency=5, rate_limit=50)
+
+    # ASSERT
+    assert all(result["error"] is None for result in results)
+    started.sort()
+    assert started[-1] - started[0] >= 4 * 0.02 * 0.9
@@ -0,0 +1,99 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+import retry
+
+
+def generate_context(*remaining_ms):
+    context = MagicMock()
+    context.get_remaining_time_in_millis.side_effect = list(remaining_ms)
+    return context
+
+
+def flaky(failures, result="ok"):
+    calls = []
+
+    def func():
+        calls.append(1)
+        if len(calls) <= failures:
+            raise ValueError("failure %d" % len(calls))
+        return result
+
+    return func, calls
+
+
+def test_call__when_no_context__then_retries_until_success():
+    # ARRANGE
+    func, calls = flaky(2)
+    sleep = MagicMock()
+
+    # ACT
+    result = retry.call(func, None, sleep=sleep)
+
+    # ASSERT
+    assert result == "ok"
+    assert len(calls) == 3
+    assert sleep.call_count == 2
+
+
+def test_call__when_max_tries_reached__then_raises_last_error():
+    func, calls = flaky(10)
+
+    with pytest.raises(ValueError, match="failure 3"):
+        retry.call(func, None, max_tries=3, sleep=MagicMock())
+    assert len(calls) == 3
+
+
+def test_call__when_giveup__then_raises_without_retrying():
+    func, calls = flaky(10)
+
+    with pytest.raises(ValueError):
+        retry.call(func, None, giveup=lambda e: True, sleep=MagicMock())
+    assert len(calls) == 1
+
+
+def test_call__when_not_retryable__then_raises_without_retrying():
+    func, calls = flaky(10)
+
+    with pytest.raises(ValueError):
+        retry.call(func, None, retry_on=KeyError, sleep=MagicMock())
+    assert len(calls) == 1
+
+
+def test_call__when_budget_cannot_fit_retry__then_raises_deadline_exceeded():
+    # ARRANGE
+    func, calls = flaky(10)
+    sleep = MagicMock()
+    # enough time for the first attempt and one retry, then only the reserve is left
+    context = generate_context(60000, 60000, 2000)
+
+    # ACT
+    with pytest.raises(retry.DeadlineExceeded) as excinfo:
+        retry.call(func, context, reserve_ms=2000, sleep=sleep)
+
+    # ASSERT
+    assert len(calls) == 2
+    assert sleep.call_count == 1
+    assert isinstance(excinfo.value.__cause__, ValueError)
+
+
+def test_call__when_no_time_left__then_does_not_call():
+    func, calls = flaky(0)
+
+    with pytest.raises(retry.DeadlineExceeded):
+        retry.call(func, generate_context(1000), reserve_ms=2000)
+    assert not calls
+
+
+def test_call__then_backoff_is_bounded_by_max_value(monkeypatch):
+    # ARRANGE
+    bounds = []
+    monkeypatch.setattr(retry.random, "uniform", lambda low, high: bounds.append(high) or 0)
+    func, calls = flaky(5)
+
+    # ACT
+    retry.call(func, None, max_value=4, sleep=MagicMock())
+
+    # ASSERT
+    assert bounds == [1, 2, 4, 4, 4]
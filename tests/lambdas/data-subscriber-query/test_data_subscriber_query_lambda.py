@@ -180,4 +180,15 @@ def test_create_job_cslc_coverage_percentage(monkeypatch):
 
     job_name, job_spec, job_params, queue, tags = data_subscriber_query._create_job(event)
 
-    assert job_params['coverage_percentage'] == '--coverage-percentage=90'
\ No newline at end of file
+    assert job_params['coverage_percentage'] == '--coverage-percentage=90'
+
+
+@pytest.mark.parametrize("value, expected", [("True", True), ("yes", True), ("1", True),
+                                             ("false", False), ("OFF", False), ("0", False)])
+def test_strtobool(value, expected):
+    assert data_subscriber_query.strtobool(value) is expected
+
+
+def test_strtobool__when_not_a_truth_value__then_raises():
+    with pytest.raises(ValueError):
+        data_subscriber_query.strtobool("")
@@ -0,0 +1,397 @@
+import importlib
+import io
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock
+
+import pytest
+from pytest_mock import MockerFixture
+
+import mozart_client
+
+os.environ.update({
+    "SIGNAL_FILE_BUCKET": "isl-bucket",
+    "MOZART_ES_URL": "http://dummy_mozart_es:9200",
+    "DELAY_THRESHOLD": "3600",
+    "E_MISFIRE_METRIC_ALARM_NAME": "dummy_alarm",
+    "MOZART_URL": "https://dummy_mozart_url/mozart",
+    "SIGNAL_FILE_SUFFIX": json.dumps({"met_required": {"ext": ".signal"}}),
+    "MET_REQUIRED": "met_required",
+    "DATASET_S3_ENDPOINT": "s3-us-west-2.amazonaws.com",
+    "JOB_TYPE": "dummy_job_type",
+    "JOB_RELEASE": "dummy_job_release",
+    "JOB_QUEUE": "dummy_job_queue",
+})
+
+event_misfire = importlib.import_module("lambdas.event-misfire.event-misfire")
+
+
+def msearch_response(counts):
+    return {"responses": [{"hits": {"total": {"value": count, "relation": "eq"}, "hits": []}} for count in counts]}
+
+
+def test_get_job_counts__then_batches_prefix_queries_in_msearch(mocker: MockerFixture):
+    # ARRANGE
+    mocker.patch.object(event_misfire, "ES_MSEARCH_BATCH_SIZE", 2)
+    es = MagicMock()
+    es.msearch.side_effect = [msearch_response([1, 0]), msearch_response([1])]
+    mocker.patch.object(event_misfire, "get_es", return_value=es)
+
+    # ACT
+    job_counts = event_misfire.get_job_counts(["tlm/a.h5", "tlm/b.h5", "c.h5"])
+
+    # ASSERT
+    assert job_counts == {"tlm/a.h5": 1, "tlm/b.h5": 0, "c.h5": 1}
+    assert es.msearch.call_count == 2
+    body = es.msearch.call_args_list[0].kwargs["body"]
+    assert body[0] == {"index": "job_status-current"}
+    assert body[1]["query"] == {"prefix": {"job_id": "ingest-staged-a.h5-"}}
+
+
+def test_get_job_counts__when_search_fails__then_counts_are_unknown(mocker: MockerFixture):
+    # ARRANGE
+    es = MagicMock()
+    es.msearch.return_value = {"responses": [{"error": {"type": "index_not_found_exception"}}, msearch_response([2])["responses"][0]]}
+    mocker.patch.object(event_misfire, "get_es", return_value=es)
+
+    # ACT / ASSERT
+    assert event_misfire.get_job_counts(["a.h5", "b.h5"]) == {"a.h5": None, "b.h5": 2}
+
+    es.msearch.side_effect = Exception("connection refused")
+    assert event_misfire.get_job_counts(["a.h5"]) == {"a.h5": None}
+
+
+@pytest.fixture(autouse=True)
+def state_dir(tmp_path, mocker: MockerFixture):
+    mocker.patch.object(event_misfire, "STATE_DIR", str(tmp_path))
+    mocker.patch.object(event_misfire, "STATE_BUCKET", None)
+    return tmp_path
+
+
+def generate_s3(pages_by_prefix):
+    """
+    Fakes an S3 client whose list_objects_v2 paginator returns the given
+    pages for each prefix. Pages for the "/" delimiter listing are keyed by
+    "/".
+    """
+    def paginate(Bucket, Prefix="", Delimiter=None, StartAfter=""):
+        pages = []
+        for page in pages_by_prefix["/" if Delimiter else Prefix]:
+            contents = [obj for obj in page.get("Contents", []) if obj["Key"] > StartAfter]
+            if contents or "CommonPrefixes" in page:
+                pages.append(dict(page, Contents=contents))
+        return iter(pages)
+
+    s3 = MagicMock()
+    s3.get_paginator.return_value.paginate.side_effect = paginate
+    return s3
+
+
+def generate_object(key, age_hours, now=datetime.now(timezone.utc)):
+    return {"Key": key, "LastModified": now - timedelta(hours=age_hours), "ETag": '"etag-{}"'.format(key)}
+
+
+def generate_context(remaining_ms):
+    context = MagicMock()
+    context.get_remaining_time_in_millis.side_effect = remaining_ms
+    return context
+
+
+def test_iter_stale_pages__then_yields_only_objects_older_than_cutoff(mocker: MockerFixture):
+    # ARRANGE
+    s3 = generate_s3({"": [
+        {"Contents": [generate_object("tlm/", 5), generate_object("tlm/a.h5", 2), generate_object("tlm/b.h5", 0)]},
+        {"KeyCount": 0},
+        {"Contents": [generate_object("tlm/c.h5", 0)]},
+    ]})
+    mocker.patch.object(event_misfire.aws_clients, "get_client", return_value=s3)
+    older_than = datetime.now(timezone.utc) - timedelta(hours=1)
+
+    # ACT
+    pages = [(last_key, [obj["Key"] for obj in objects])
+             for last_key, objects in event_misfire.iter_stale_pages("isl-bucket", older_than)]
+
+    # ASSERT
+    assert pages == [("tlm/b.h5", ["tlm/a.h5"]), ("tlm/c.h5", [])]
+
+
+def test_iter_stale_pages_by_prefix__then_yields_pages_in_key_order(mocker: MockerFixture):
+    # ARRANGE
+    s3 = generate_s3({
+        "/": [{"CommonPrefixes": [{"Prefix": "met_required/"}, {"Prefix": "tlm/"}],
+               "Contents": [generate_object("a.h5", 2), generate_object("n.h5", 0), generate_object("z.h5", 2)]}],
+        "met_required/": [{"Contents": [generate_object("met_required/a.signal", 2),
+                                        generate_object("met_required/b.signal", 0)]}],
+        "tlm/": [{"Contents": [generate_object("tlm/a.h5", 2), generate_object("tlm/b.h5", 2)]}],
+    })
+    mocker.patch.object(event_misfire.aws_clients, "get_client", return_value=s3)
+    older_than = datetime.now(timezone.utc) - timedelta(hours=1)
+
+    # ACT
+    pages = [(last_key, [obj["Key"] for obj in objects])
+             for last_key, objects in event_misfire.iter_stale_pages_by_prefix("isl-bucket", older_than, 2)]
+    resumed = [last_key for last_key, _ in
+               event_misfire.iter_stale_pages_by_prefix("isl-bucket", older_than, 2, start_after="tlm/a.h5")]
+
+    # ASSERT
+    assert pages == [
+        ("a.h5", ["a.h5"]),
+        ("met_required/b.signal", ["met_required/a.signal"]),
+        ("n.h5", []),
+        ("tlm/b.h5", ["tlm/a.h5", "tlm/b.h5"]),
+        ("z.h5", ["z.h5"]),
+    ]
+    assert resumed == ["tlm/b.h5", "z.h5"]
+
+
+def test_iter_stale_pages_by_prefix__when_closed_early__then_lists_only_prefixes_ahead(mocker: MockerFixture):
+    # ARRANGE
+    prefixes = ["p%d/" % i for i in range(10)]
+    pages_by_prefix = {prefix: [{"Contents": [generate_object(prefix + "a.h5", 2)]}] for prefix in prefixes}
+    pages_by_prefix["/"] = [{"CommonPrefixes": [{"Prefix": prefix} for prefix in prefixes]}]
+    s3 = generate_s3(pages_by_prefix)
+    mocker.patch.object(event_misfire.aws_clients, "get_client", return_value=s3)
+    older_than = datetime.now(timezone.utc) - timedelta(hours=1)
+
+    # ACT
+    pages = event_misfire.iter_stale_pages_by_prefix("isl-bucket", older_than, 2)
+    first_key, _ = next(pages)
+    pages.close()
+
+    # ASSERT
+    assert first_key == "p0/a.h5"
+    listed = [call.kwargs["Prefix"] for call in s3.get_paginator.return_value.paginate.call_args_list
+              if "Prefix" in call.kwargs]
+    # the consumed prefix and the 2 listed ahead of it
+    assert sorted(listed) == ["p0/", "p1/", "p2/"]
+
+
+def test_lambda_handler__then_alarms_on_stale_files_without_jobs(mocker: MockerFixture):
+    # ARRANGE
+    mocker.patch.object(event_misfire, "ES_MSEARCH_BATCH_SIZE", 2)
+    s3 = generate_s3({"": [{"Contents": [
+        generate_object("tlm/new.h5", 0),
+        generate_object("tlm/stale_1.h5", 2),
+        generate_object("tlm/stale_2.h5", 2),
+        generate_object("tlm/stale_3.h5", 2),
+    ]}]})
+    mocker.patch.object(event_misfire.aws_clients, "get_client", return_value=s3)
+    get_job_counts = mocker.patch.object(event_misfire, "get_job_counts", side_effect=[
+        {"tlm/stale_1.h5": 1, "tlm/stale_2.h5": 0},
+        {"tlm/stale_3.h5": 0},
+    ])
+    send_cloudwatch_alarm = mocker.patch.object(event_misfire, "send_cloudwatch_alarm")
+
+    # ACT
+    event_misfire.lambda_handler({}, None)
+
+    # ASSERT
+    assert [c.args[0] for c in get_job_counts.call_args_list] == [["tlm/stale_1.h5", "tlm/stale_2.h5"], ["tlm/stale_3.h5"]]
+    assert send_cloudwatch_alarm.call_count == 1
+    missed_file_count, stats = send_cloudwatch_alarm.call_args.args
+    assert missed_file_count == 2
+    assert stats["candidate_count"] == 3
+    assert stats["stale_file_age"]["SampleCount"] == 3
+    assert stats["es_lookup_latency"]["SampleCount"] == 2
+    assert stats["missed_by_file_type"] == {"tlm": 2}
+    state = event_misfire.load_state(event_misfire.SCAN_STATE_NAME, None)
+    assert (state["generation"], state["start_after"], state["missed_file_count"]) == (1, "", 0)
+    assert state["stats"] == event_misfire.new_scan_stats()
+
+
+def test_lambda_handler__when_out_of_time__then_resumes_from_cursor_and_alarms_after_full_pass(mocker: MockerFixture):
+    # ARRANGE
+    s3 = generate_s3({"": [
+        {"Contents": [generate_object("tlm/stale_1.h5", 2)]},
+        {"Contents": [generate_object("tlm/stale_2.h5", 2)]},
+    ]})
+    mocker.patch.object(event_misfire.aws_clients, "get_client", return_value=s3)
+    get_job_counts = mocker.patch.object(event_misfire, "get_job_counts",
+                                         side_effect=lambda keys: {key: 0 for key in keys})
+    send_cloudwatch_alarm = mocker.patch.object(event_misfire, "send_cloudwatch_alarm")
+
+    # ACT
+    event_misfire.lambda_handler({}, generate_context([event_misfire.SCAN_TIME_RESERVE_MS - 1]))
+
+    # ASSERT
+    send_cloudwatch_alarm.assert_not_called()
+    state = event_misfire.load_state(event_misfire.SCAN_STATE_NAME, None)
+    assert (state["generation"], state["start_after"], state["missed_file_count"]) == (0, "tlm/stale_1.h5", 1)
+
+    # ACT
+    event_misfire.lambda_handler({}, generate_context([60000] * 2))
+
+    # ASSERT
+    assert [c.args[0] for c in get_job_counts.call_args_list] == [["tlm/stale_1.h5"], ["tlm/stale_2.h5"]]
+    assert send_cloudwatch_alarm.call_count == 1
+    missed_file_count, stats = send_cloudwatch_alarm.call_args.args
+    assert missed_file_count == 2
+    assert stats["candidate_count"] == 2
+    assert stats["missed_by_file_type"] == {"tlm": 2}
+    assert event_misfire.load_state(event_misfire.SCAN_STATE_NAME, None)["generation"] == 1
+
+
+def test_lambda_handler__when_file_verified__then_not_looked_up_again_until_etag_changes(mocker: MockerFixture):
+    # ARRANGE
+    contents = [generate_object("tlm/stale_1.h5", 2), generate_object("tlm/stale_2.h5", 2)]
+    s3 = generate_s3({"": [{"Contents": contents}]})
+    mocker.patch.object(event_misfire.aws_clients, "get_client", return_value=s3)
+    get_job_counts = mocker.patch.object(event_misfire, "get_job_counts",
+                                         side_effect=lambda keys: {key: 1 if key.endswith("1.h5") else 0 for key in keys})
+    mocker.patch.object(event_misfire, "send_cloudwatch_alarm")
+
+    # ACT
+    event_misfire.lambda_handler({}, None)
+    event_misfire.lambda_handler({}, None)
+    contents[0]["ETag"] = '"new-etag"'
+    event_misfire.lambda_handler({}, None)
+
+    # ASSERT
+    assert [c.args[0] for c in get_job_counts.call_args_list] == [
+        ["tlm/stale_1.h5", "tlm/stale_2.h5"],
+        ["tlm/stale_2.h5"],
+        ["tlm/stale_1.h5", "tlm/stale_2.h5"],
+    ]
+
+
+def test_load_verified_cache__then_drops_expired_entries(mocker: MockerFixture):
+    # ARRANGE
+    mocker.patch.object(event_misfire, "VERIFIED_CACHE_TTL_SECONDS", 100)
+    event_misfire.save_state(event_misfire.VERIFIED_CACHE_NAME, {"old.h5": ["etag", 1000], "new.h5": ["etag", 1950]})
+
+    # ACT / ASSERT
+    assert event_misfire.load_verified_cache(2000) == {"new.h5": ["etag", 1950]}
+
+
+def test_load_verified_cache__when_cold_container__then_loads_s3_snapshot(mocker: MockerFixture):
+    # ARRANGE
+    mocker.patch.object(event_misfire, "STATE_BUCKET", "state-bucket")
+    s3 = MagicMock()
+    s3.get_object.return_value = {"Body": io.BytesIO(b'{"a.h5":["etag",1950]}')}
+    mocker.patch.object(event_misfire.aws_clients, "get_client", return_value=s3)
+
+    # ACT
+    cache = event_misfire.load_verified_cache(2000)
+
+    # ASSERT
+    assert cache == {"a.h5": ["etag", 1950]}
+    s3.get_object.assert_called_once_with(Bucket="state-bucket", Key="event-misfire/verified_files.json")
+
+
+def test_lambda_handler__when_reingest_enabled__then_resubmits_missed_files_once(mocker: MockerFixture):
+    # ARRANGE
+    mocker.patch.object(event_misfire, "REINGEST_MISSED_FILES", True)
+    s3 = generate_s3({"": [{"Contents": [generate_object("ancillary/stale_1.h5", 2), generate_object("ancillary/stale_2.h5", 2)]}]})
+    mocker.patch.object(event_misfire.aws_clients, "get_client", return_value=s3)
+    mocker.patch.object(event_misfire, "get_job_counts", side_effect=lambda keys: {key: 0 for key in keys})
+    submit_jobs = mocker.patch.object(mozart_client, "submit_jobs", return_value=[
+        {"job_id": "job-1", "error": None},
+        {"job_id": None, "error": Exception("mozart unavailable")},
+    ])
+    send_cloudwatch_alarm = mocker.patch.object(event_misfire, "send_cloudwatch_alarm")
+
+    # ACT
+    event_misfire.lambda_handler({}, None)
+    event_misfire.lambda_handler({}, None)
+
+    # ASSERT
+    assert send_cloudwatch_alarm.call_args_list[0].args[0] == 2
+    url, jobs = submit_jobs.call_args_list[0].args
+    assert url == "https://dummy_mozart_url/mozart/api/v0.1/job/submit"
+    assert [job["job_name"] for job in jobs] == ["ingest-staged-stale_1.h5", "ingest-staged-stale_2.h5"]
+    assert jobs[0]["job_spec"] == "job-dummy_job_type:dummy_job_release"
+    assert jobs[0]["job_params"]["data_url"] == ["s3://s3-us-west-2.amazonaws.com/isl-bucket/ancillary/stale_1.h5"]
+    assert jobs[0]["job_params"]["payload_hash"] == "etag-ancillary/stale_1.h5"
+    assert submit_jobs.call_args_list[0].kwargs["rate_limit"] == event_misfire.REINGEST_RATE_LIMIT
+    # only the file whose resubmission failed is submitted again
+    assert [job["job_name"] for job in submit_jobs.call_args_list[1].args[1]] == ["ingest-staged-stale_2.h5"]
+
+
+def test_lambda_handler__when_prefixed_file_has_ingest_job__then_does_not_reingest_it(mocker: MockerFixture):
+    # ARRANGE
+    mocker.patch.object(event_misfire, "REINGEST_MISSED_FILES", True)
+    s3 = generate_s3({"": [{"Contents": [generate_object("ancillary/stale_1.h5", 2), generate_object("ancillary/stale_2.h5", 2)]}]})
+    mocker.patch.object(event_misfire.aws_clients, "get_client", return_value=s3)
+    es = MagicMock()
+    es.msearch.return_value = msearch_response([1, 0])
+    mocker.patch.object(event_misfire, "get_es", return_value=es)
+    submit_jobs = mocker.patch.object(mozart_client, "submit_jobs", return_value=[{"job_id": "job-2", "error": None}])
+    mocker.patch.object(event_misfire, "send_cloudwatch_alarm")
+
+    # ACT
+    event_misfire.lambda_handler({}, None)
+
+    # ASSERT
+    body = es.msearch.call_args.kwargs["body"]
+    assert [search["query"]["prefix"]["job_id"] for search in body[1::2]] == [
+        "ingest-staged-stale_1.h5-", "ingest-staged-stale_2.h5-"]
+    assert [job["job_name"] for job in submit_jobs.call_args.args[1]] == ["ingest-staged-stale_2.h5"]
+
+
+def test_lambda_handler__when_met_required_data_file_missed__then_counts_it_without_reingesting(mocker: MockerFixture):
+    # ARRANGE
+    mocker.patch.object(event_misfire, "REINGEST_MISSED_FILES", True)
+    s3 = generate_s3({"": [{"Contents": [generate_object("ancillary/stale_1.h5", 2), generate_object("met_required/data.h5", 2)]}]})
+    mocker.patch.object(event_misfire.aws_clients, "get_client", return_value=s3)
+    mocker.patch.object(event_misfire, "get_job_counts", side_effect=lambda keys: {key: 0 for key in keys})
+    submit_jobs = mocker.patch.object(mozart_client, "submit_jobs", return_value=[{"job_id": "job-1", "error": None}])
+    send_cloudwatch_alarm = mocker.patch.object(event_misfire, "send_cloudwatch_alarm")
+
+    # ACT
+    event_misfire.lambda_handler({}, None)
+
+    # ASSERT
+    assert [job["job_name"] for job in submit_jobs.call_args.args[1]] == ["ingest-staged-stale_1.h5"]
+    missed_file_count, stats = send_cloudwatch_alarm.call_args.args
+    assert missed_file_count == 2
+    assert stats["not_reingestable_count"] == 1
+
+
+def test_lambda_handler__when_es_lookup_fails__then_neither_alarms_nor_reingests(mocker: MockerFixture):
+    # ARRANGE
+    mocker.patch.object(event_misfire, "REINGEST_MISSED_FILES", True)
+    s3 = generate_s3({"": [{"Contents": [generate_object("ancillary/stale_1.h5", 2), generate_object("ancillary/stale_2.h5", 2)]}]})
+    mocker.patch.object(event_misfire.aws_clients, "get_client", return_value=s3)
+    es = MagicMock()
+    es.msearch.side_effect = Exception("connection refused")
+    mocker.patch.object(event_misfire, "get_es", return_value=es)
+    submit_jobs = mocker.patch.object(mozart_client, "submit_jobs")
+    send_cloudwatch_alarm = mocker.patch.object(event_misfire, "send_cloudwatch_alarm")
+
+    # ACT
+    event_misfire.lambda_handler({}, None)
+
+    # ASSERT
+    submit_jobs.assert_not_called()
+    missed_file_count, stats = send_cloudwatch_alarm.call_args.args
+    assert missed_file_count == 0
+    assert stats["lookup_failure_count"] == 2
+
+
+def test_send_cloudwatch_alarm__then_publishes_all_metrics_in_one_call(mocker: MockerFixture):
+    # ARRANGE
+    cloudwatch = MagicMock()
+    mocker.patch.object(event_misfire.aws_clients, "get_client", return_value=cloudwatch)
+    stats = event_misfire.new_scan_stats()
+    stats["candidate_count"] = 3
+    for age in (4000, 7200, 5000):
+        event_misfire.add_sample(stats["stale_file_age"], age)
+    stats["missed_by_file_type"] = {"tlm": 1, "met_required": 1}
+
+    # ACT
+    event_misfire.send_cloudwatch_alarm(2, stats)
+
+    # ASSERT
+    assert cloudwatch.put_metric_data.call_count == 1
+    metric_data = cloudwatch.put_metric_data.call_args.kwargs["MetricData"]
+    by_name = {(m["MetricName"], len(m["Dimensions"])): m for m in metric_data}
+    assert by_name[("NumberOfMissedFiles", 2)]["Value"] == 2
+    assert by_name[("NumberOfCandidateFiles", 2)]["Value"] == 3
+    assert by_name[("NumberOfNotReingestableFiles", 2)]["Value"] == 0
+    assert by_name[("StaleFileAge", 2)]["StatisticValues"] == \
+        {"SampleCount": 3, "Sum": 16200.0, "Minimum": 4000, "Maximum": 7200}
+    # no lookups were made, so there is no latency statistic set to publish
+    assert ("ESLookupLatency", 2) not in by_name
+    per_type = {m["Dimensions"][-1]["Value"]: m["Value"] for m in metric_data if len(m["Dimensions"]) == 3}
+    assert per_type == {"met_required": 1, "tlm": 1}
@@ -0,0 +1,50 @@
+import importlib
+from unittest.mock import MagicMock
+
+import botocore.exceptions
+import pytest
+from pytest_mock import MockerFixture
+
+harikiri = importlib.import_module("lambdas.harikiri.harikiri")
+
+
+def generate_event(instance_ids):
+    return {"Records": [{"messageId": "msg-{}".format(instance_id), "body": instance_id}
+                        for instance_id in instance_ids]}
+
+
+def generate_autoscaling(failing):
+    """
+    Fakes an autoscaling client failing to terminate the given instances.
+    "No managed instance found" errors are given up on without retrying.
+    """
+    def terminate_instance_in_auto_scaling_group(InstanceId, ShouldDecrementDesiredCapacity):
+        if InstanceId in failing:
+            raise botocore.exceptions.ClientError(
+                {"Error": {"Code": "ValidationError", "Message": "No managed instance found for instance ID"}},
+                "TerminateInstanceInAutoScalingGroup")
+        return {}
+
+    client = MagicMock()
+    client.terminate_instance_in_auto_scaling_group.side_effect = terminate_instance_in_auto_scaling_group
+    return client
+
+
+@pytest.mark.parametrize("failing, expected", [
+    ([], []),
+    (["i-2"], ["msg-i-2"]),
+    (["i-1", "i-2", "i-3"], ["msg-i-1", "msg-i-2", "msg-i-3"]),
+])
+def test_lambda_handler__then_reports_failed_messages(mocker: MockerFixture, failing, expected):
+    # ARRANGE
+    client = generate_autoscaling(failing)
+    mocker.patch.object(harikiri.aws_clients, "get_client", return_value=client)
+
+    # ACT
+    response = harikiri.lambda_handler(generate_event(["i-1", "i-2", "i-3"]), None)
+
+    # ASSERT
+    assert response["batchItemFailures"] == [{"itemIdentifier": identifier} for identifier in expected]
+    assert response["body"] == "Terminated instances: {}".format(
+        [instance_id for instance_id in ["i-1", "i-2", "i-3"] if instance_id not in failing])
+    assert client.terminate_instance_in_auto_scaling_group.call_count == 3
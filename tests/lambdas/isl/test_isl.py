@@ -0,0 +1,117 @@
+import importlib
+import io
+import json
+import os
+from unittest.mock import MagicMock
+
+from pytest_mock import MockerFixture
+
+os.environ.update({
+    "MOZART_URL": "https://dummy_mozart_url/mozart",
+    "SIGNAL_FILE_SUFFIX": json.dumps({"met_required": {"ext": ".signal"}}),
+    "MET_REQUIRED": "met_required",
+    "DATASET_S3_ENDPOINT": "s3-us-west-2.amazonaws.com",
+    "JOB_TYPE": "dummy_job_type",
+    "JOB_RELEASE": "dummy_job_release",
+    "JOB_QUEUE": "dummy_job_queue",
+})
+
+isl = importlib.import_module("lambdas.isl.isl")
+
+
+def generate_record(message_id, key):
+    s3_event = {"Records": [{"s3": {"bucket": {"name": "isl-bucket"}, "object": {"key": key, "eTag": "etag"}}}]}
+    return {
+        "messageId": message_id,
+        "receiptHandle": f"handle-{message_id}",
+        "body": json.dumps(s3_event),
+        "eventSourceARN": "arn:aws:sqs:us-west-2:123456789012:isl-queue",
+    }
+
+
+def generate_event(n):
+    return {"Records": [generate_record(f"msg-{i}", f"ancillary/file_{i}.h5") for i in range(n)]}
+
+
+def test_process_record__when_plain_file__then_submits_ingest_job(mocker: MockerFixture):
+    # ARRANGE
+    submit_job = mocker.patch.object(isl, "submit_job", return_value="job-id")
+    event = generate_event(1)
+
+    # ACT
+    job_id = isl.process_record(event, event["Records"][0])
+
+    # ASSERT
+    assert job_id == "job-id"
+    job_spec, job_params, queue, tags = submit_job.call_args.args
+    assert job_spec == "job-dummy_job_type:dummy_job_release"
+    assert queue == "dummy_job_queue"
+    assert tags == ["data-staged"]
+    assert job_params["data_file"] == "file_0.h5"
+    assert job_params["data_url"] == ["s3://s3-us-west-2.amazonaws.com/isl-bucket/ancillary/file_0.h5"]
+    assert job_params["payload_hash"] == "etag"
+
+
+def test_submit_records__when_one_record_fails__then_tracks_result_per_record(mocker: MockerFixture):
+    # ARRANGE
+    def process_record(event, record):
+        if record["messageId"] == "msg-1":
+            raise Exception("mozart unavailable")
+        return "job-" + record["messageId"]
+
+    mocker.patch.object(isl, "process_record", side_effect=process_record)
+
+    # ACT
+    results = isl.submit_records(generate_event(3))
+
+    # ASSERT
+    assert results["msg-0"] == {"job_id": "job-msg-0", "error": None}
+    assert results["msg-2"] == {"job_id": "job-msg-2", "error": None}
+    assert results["msg-1"]["job_id"] is None
+    assert str(results["msg-1"]["error"]) == "mozart unavailable"
+
+
+def test_lambda_handler__when_all_records_succeed__then_reports_no_failures(mocker: MockerFixture):
+    # ARRANGE
+    mocker.patch.object(isl, "process_record", return_value="job-id")
+
+    # ACT
+    response = isl.lambda_handler(generate_event(2), MagicMock())
+
+    # ASSERT
+    assert response == {"batchItemFailures": []}
+
+
+def test_lambda_handler__when_a_record_fails__then_reports_only_that_message(mocker: MockerFixture):
+    # ARRANGE
+    def process_record(event, record):
+        if record["messageId"] == "msg-1":
+            raise Exception("mozart unavailable")
+        return "job-id"
+
+    mocker.patch.object(isl, "process_record", side_effect=process_record)
+
+    # ACT
+    response = isl.lambda_handler(generate_event(3), MagicMock())
+
+    # ASSERT
+    assert response == {"batchItemFailures": [{"itemIdentifier": "msg-1"}]}
+
+
+def test_process_record__when_signal_file__then_reads_it_with_cached_s3_client(mocker: MockerFixture):
+    # ARRANGE
+    s3 = MagicMock()
+    s3.get_object.return_value = {"Body": io.BytesIO(b"file_a.h5\n\nfile_b.h5\n")}
+    get_client = mocker.patch.object(isl.aws_clients, "get_client", return_value=s3)
+    submit_job = mocker.patch.object(isl, "submit_job", return_value="job-id")
+    record = generate_record("msg-0", "met_required/files.signal")
+
+    # ACT
+    isl.process_record({"Records": [record]}, record)
+
+    # ASSERT
+    get_client.assert_called_with("s3")
+    s3.get_object.assert_called_once_with(Bucket="isl-bucket", Key="met_required/files.signal")
+    job_spec, job_params, queue, tags = submit_job.call_args.args
+    assert job_params["data_file"] == "file_a.h5"
+    assert job_params["prod_met"]["ISL_urls"][-1] == "s3://s3-us-west-2.amazonaws.com/isl-bucket/met_required/files.signal"
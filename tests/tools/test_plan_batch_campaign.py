@@ -0,0 +1,92 @@
+from datetime import datetime
+import importlib
+import pytest
+
+pytest.importorskip("numpy")
+batch_lambda = importlib.import_module("lambdas.batch_process.batch_process_lambda")
+planner = importlib.import_module("tools.plan_batch_campaign")
+
+
+def generate_proc(doc_id, **fields):
+    source = {
+        "enabled": True,
+        "label": doc_id,
+        "processing_mode": "forward",
+        "data_start_date": "2021-01-01T00:00:00",
+        "data_end_date": "2021-01-02T00:00:00",
+        "last_successful_proc_data_date": "1900-01-01T00:00:00",
+        "last_run_date": "1900-01-01T00:00:00",
+        "data_date_incr_mins": 60,
+        "run_interval_mins": 10,
+        "job_type": "slcs1a_query",
+        "job_queue": "some_job_queue",
+        "download_job_queue": "some_queue",
+        "chunk_size": 1,
+    }
+    source.update(fields)
+    return batch_lambda.BatchProc.from_hit({"_id": doc_id, "_source": source})
+
+
+def test_plan_campaign__then_projects_windows_job_count_and_completion():
+    p = generate_proc("proc")
+
+    plan = planner.plan_campaign(p, now=datetime(2023, 1, 1))
+
+    assert plan["job_count"] == 24
+    assert str(plan["window_starts"][1]) == "2021-01-01T01:00:00"
+    assert str(plan["window_ends"][-1]) == "2021-01-02T00:00:00"
+    assert plan["completion_date"] == "2023-01-01T03:50:00Z"
+    submit_date, (job_name, job_spec, job_params, job_tags) = next(planner.iter_planned_jobs(p, plan))
+    assert submit_date == datetime(2023, 1, 1)
+    assert job_params["end_datetime"] == "--end-date=2021-01-01T01:00:00Z"
+
+
+@pytest.mark.parametrize("fields, completion_date", [
+    ({"max_windows_per_tick": 4}, "2023-01-01T00:50:00Z"),
+    ({"max_concurrent_windows": 3}, "2023-01-01T01:10:00Z"),
+    ({"last_successful_proc_data_date": "2021-01-02T00:00:00"}, None),
+])
+def test_plan_campaign__when_catching_up_or_in_lanes__then_finishes_sooner(fields, completion_date):
+    p = generate_proc("proc", **fields)
+
+    plan = planner.plan_campaign(p, now=datetime(2023, 1, 1))
+
+    assert plan["completion_date"] == completion_date
+
+
+def test_plan_campaign__when_data_in_the_future__then_catching_up_does_not_delay_it():
+    p = generate_proc("proc")
+    caught_up = generate_proc("proc", max_windows_per_tick=4)
+
+    plan = planner.plan_campaign(p, now=datetime(2020, 1, 1))
+    caught_up_plan = planner.plan_campaign(caught_up, now=datetime(2020, 1, 1))
+
+    assert caught_up_plan["completion_date"] == plan["completion_date"] == "2020-01-01T03:50:00Z"
+
+
+def test_plan_campaign__when_data_partly_in_the_past__then_catches_up_on_the_past_windows_only():
+    p = generate_proc("proc", max_windows_per_tick=4)
+
+    plan = planner.plan_campaign(p, now=datetime(2021, 1, 1, 5, 30))
+
+    # the first tick submits 4 windows in the past, the next one the last past window, then one per tick
+    assert [str(d) for d in plan["submit_dates"][:7]] == [
+        "2021-01-01T05:30:00", "2021-01-01T05:30:00", "2021-01-01T05:30:00", "2021-01-01T05:30:00",
+        "2021-01-01T05:40:00", "2021-01-01T05:50:00", "2021-01-01T06:00:00"]
+    assert plan["completion_date"] == "2021-01-01T08:50:00Z"
+
+
+def test_plan_campaign__when_disp_proc__then_plans_every_frame_range():
+    p = generate_proc("disp", collection_short_name="OPERA_L2_CSLC-S1_V1", processing_mode="historical",
+                      data_end_date="2021-02-01T00:00:00", frames_per_query=100, k=1, m=4,
+                      last_successful_proc_frame=100)
+
+    plan = planner.plan_campaign(p, now=datetime(2023, 1, 1), frame_to_bursts={i: {} for i in range(1, 251)})
+
+    # 2 frame ranges left in the first window, 3 in each of the 2 following ones
+    assert plan["job_count"] == 8
+    assert plan["first_frames"].tolist() == [101, 201, 1, 101, 201, 1, 101, 201]
+    assert plan["last_frames"].tolist()[:3] == [200, 250, 100]
+    assert str(plan["window_ends"][-1]) == "2021-02-01T00:00:00"
+    submit_date, (job_name, job_spec, job_params, job_tags) = next(planner.iter_planned_jobs(p, plan))
+    assert job_params["frame_range"] == "--frame-range=101,200"
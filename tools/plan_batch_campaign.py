@@ -0,0 +1,165 @@
+"""
+Projects the rest of a batch proc's campaign from its current state, without
+contacting Mozart or ES: every window it will submit, the number of query
+jobs and when the last one is submitted at the configured run_interval_mins.
+
+Usage: python -m tools.plan_batch_campaign PROC_JSON [--now DATE] [--jobs]
+
+PROC_JSON is a batch proc document, e.g.
+lambdas/batch_process/batch_proc_example_1.json. DISP procs are planned
+against the frame to burst map of DISP_FRAME_BURST_MAP_JSON.
+
+Planning needs NumPy, installed with the "tools" extra (pip install -e .[tools]).
+It is not part of the batch_process lambda package.
+"""
+import argparse
+import bisect
+import importlib
+import json
+import os
+import sys
+from datetime import datetime
+
+import numpy as np
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, os.path.join(ROOT, "lambdas", "common"))
+sys.path.insert(0, ROOT)
+
+# the lambda requires its endpoints at import, planning never uses them
+for ev in ("MOZART_IP", "GRQ_IP", "GRQ_ES_PORT", "ENDPOINT", "JOB_RELEASE"):
+    os.environ.setdefault(ev, "unused")
+
+batch_lambda = importlib.import_module("lambdas.batch_process.batch_process_lambda")
+
+
+def plan_campaign(p, now=None, frame_to_bursts=None):
+    """
+    Plans the rest of a batch proc's campaign. Ticks are assumed to run on
+    time with enough time budget. Windows are computed with NumPy datetime64
+    arrays, so campaigns of many thousands of windows are planned without a
+    Python loop per window. Procs that catch up are scheduled tick by tick,
+    see get_lane_ticks.
+
+    :param p: The BatchProc.
+    :param now: The datetime to plan from. Defaults to the current time.
+    :param frame_to_bursts: The DISP frame to burst map for DISP procs.
+    Defaults to the map of DISP_FRAME_BURST_MAP_JSON.
+    :return: A dict with the proc "label", the "window_starts", "window_ends"
+    and "submit_dates" of the jobs as datetime64[s] arrays ordered by submit
+    date, for DISP procs the "first_frames" and "last_frames" they query
+    (None for other procs), the "job_count" and the "completion_date" of the
+    last submission, or None if there is nothing left to submit.
+    """
+    now = np.datetime64(now or datetime.utcnow(), "s")
+    interval = np.timedelta64(p.run_interval_mins, "m")
+    first_tick = max(now, np.datetime64(p.last_run_date, "s") + interval)
+
+    # The jobs of each lane, in submission order, as (starts, ends, first_frames, last_frames) arrays
+    lanes_jobs = []
+    is_disp = batch_lambda.is_disp_proc(p)
+    if is_disp:
+        frame_to_bursts = frame_to_bursts or batch_lambda.get_disp_frame_burst_map()
+        s_date, _, first_frame, _ = batch_lambda.next_disp_job(p, frame_to_bursts)
+        data_end = np.datetime64(p.data_end_date, "s")
+        window = np.timedelta64(p.k * batch_lambda.DISP_REVISIT_DAYS, "D")
+        max_frame = max(frame_to_bursts)
+        window_starts = np.arange(np.datetime64(s_date, "s"), data_end, window)
+        # The rest of the frames of the current window, then every frame of the following windows
+        first_window_frames = np.arange(first_frame, max_frame + 1, p.frames_per_query)
+        window_frames = np.arange(1, max_frame + 1, p.frames_per_query)
+        following = max(len(window_starts) - 1, 0)
+        window_index = np.concatenate([np.zeros(len(first_window_frames) if len(window_starts) else 0, int),
+                                       np.repeat(np.arange(1, following + 1), len(window_frames))])
+        first_frames = np.concatenate([first_window_frames[:len(window_index)],
+                                       np.tile(window_frames, following)])
+        starts = window_starts[window_index]
+        lanes_jobs.append((starts, np.minimum(starts + window, data_end), first_frames,
+                           np.minimum(first_frames + p.frames_per_query - 1, max_frame)))
+    else:
+        incr = np.timedelta64(p.data_date_incr_mins, "m")
+        for lane in batch_lambda.get_lanes(p):
+            lane_end = np.datetime64(lane["end_date"], "s")
+            starts = np.arange(np.datetime64(lane["last_successful_proc_data_date"], "s"), lane_end, incr)
+            lanes_jobs.append((starts, np.minimum(starts + incr, lane_end), None, None))
+
+    ticks = [np.array([], int)]
+    for starts, ends, _, _ in lanes_jobs:
+        ticks.append(get_lane_ticks(ends, first_tick, interval, p.max_windows_per_tick))
+
+    def jobs(i, dtype):
+        return np.concatenate([np.array([], dtype)] + [lane_jobs[i] for lane_jobs in lanes_jobs])[order]
+
+    ticks = np.concatenate(ticks)
+    order = np.argsort(ticks, kind="stable")
+    submit_dates = first_tick + ticks[order] * interval
+    return {
+        "label": p.label,
+        "window_starts": jobs(0, "datetime64[s]"),
+        "window_ends": jobs(1, "datetime64[s]"),
+        "first_frames": jobs(2, int) if is_disp else None,
+        "last_frames": jobs(3, int) if is_disp else None,
+        "submit_dates": submit_dates,
+        "job_count": len(submit_dates),
+        "completion_date": batch_lambda.convert_datetime(submit_dates[-1].item()) if len(submit_dates) else None,
+    }
+
+
+def get_lane_ticks(ends, first_tick, interval, max_windows_per_tick):
+    """
+    Returns the tick, counted from first_tick, in which each job of a lane is
+    submitted. As in submit_lane_windows and process_disp_proc, each tick submits the next job of
+    the lane, and up to max_windows_per_tick jobs in total while their data
+    is in the past at the tick.
+
+    :param ends: The data end dates of the jobs of the lane, in submission
+    order, as a datetime64 array.
+    """
+    if max_windows_per_tick == 1:
+        return np.arange(len(ends))
+    # the first tick at which the data of each job is in the past
+    in_past_ticks = np.ceil((ends - first_tick) / interval).clip(min=0).astype(int).tolist()
+    ticks = []
+    tick = 0
+    while len(ticks) < len(in_past_ticks):
+        first = len(ticks)
+        # in_past_ticks never decreases along a lane, so the following jobs in the past are the leading ones
+        catch_up = bisect.bisect_right(in_past_ticks, tick, first + 1,
+                                       min(first + max_windows_per_tick, len(in_past_ticks))) - first - 1
+        ticks.extend([tick] * (1 + catch_up))
+        tick += 1
+    return np.array(ticks, int)
+
+
+def iter_planned_jobs(p, plan):
+    """
+    Yields the submit date and the form_window_job_params result of every
+    job of a plan_campaign plan
+    """
+    frame_ranges = (zip(plan["first_frames"].tolist(), plan["last_frames"].tolist())
+                    if plan["first_frames"] is not None else [None] * plan["job_count"])
+    for s_date, e_date, frame_range, submit_date in zip(plan["window_starts"].tolist(), plan["window_ends"].tolist(),
+                                                        frame_ranges, plan["submit_dates"].tolist()):
+        yield submit_date, batch_lambda.form_window_job_params(p, s_date, e_date, frame_range)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("proc_json", help="batch proc document")
+    parser.add_argument("--now", type=datetime.fromisoformat, help="date to plan from, defaults to now")
+    parser.add_argument("--jobs", action="store_true", help="print every planned job")
+    args = parser.parse_args()
+
+    with open(args.proc_json) as f:
+        source = json.load(f)
+    p = batch_lambda.BatchProc.from_hit({"_id": source["label"], "_source": source})
+
+    plan = plan_campaign(p, now=args.now)
+    if args.jobs:
+        for submit_date, (job_name, _, _, _) in iter_planned_jobs(p, plan):
+            print("%s  %s" % (batch_lambda.convert_datetime(submit_date), job_name))
+    print("%s: %d jobs, completes %s" % (plan["label"], plan["job_count"], plan["completion_date"]))
+
+
+if __name__ == "__main__":
+    main()